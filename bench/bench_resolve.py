@@ -0,0 +1,137 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compare the throughput of ``URLTree.resolve()`` in this tree against
+the ``urltree`` module from an earlier git revision--by default, the
+first commit--for a few representative requests.  Only routes every
+revision supports are used, so that the comparison is like for like.
+
+Usage: bench_resolve.py [COUNT [REVISION [MAX_SLOWDOWN]]]
+
+If MAX_SLOWDOWN is given, e.g., 0.1, the exit status is 1 if any path
+resolves that much more slowly than it does at the earlier revision.
+"""
+
+import os
+import subprocess
+import sys
+import types
+
+import routetable
+import urltree
+
+
+# The representative requests, by the kind of route they exercise
+REQUESTS = [
+    ('collection', 'GET', '/v1/resource7'),
+    ('member', 'GET', '/v1/resource7/123'),
+    ('action', 'POST', '/v1/resource7/123/reboot'),
+    ('path_info', 'POST', '/v1/resource7/123/reboot/extra'),
+    ('missing', 'GET', '/v2/resource7/missing'),
+]
+
+
+def load(revision):
+    """
+    Load the ``urltree`` module as of a git revision.
+
+    :param revision: The git revision.
+
+    :returns: The module.
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if revision is None:
+        revision = subprocess.check_output(
+            ['git', 'rev-list', '--max-parents=0', 'HEAD'],
+            cwd=root).decode('ascii').split()[-1]
+    source = subprocess.check_output(
+        ['git', 'show', '%s:urltree.py' % revision], cwd=root)
+
+    module = types.ModuleType('urltree_%s' % revision)
+
+    # The oldest revisions were written for Python 2
+    module.basestring = str
+    module.unicode = str
+    exec(compile(source, 'urltree.py@%s' % revision, 'exec'),
+         module.__dict__)
+
+    return module
+
+
+def build(module):
+    """
+    Build the route table for the comparison.
+
+    :param module: The ``urltree`` module to use.
+
+    :returns: A ``URLTree``.
+    """
+
+    tree = module.URLTree()
+
+    for res in routetable.RESOURCES:
+        tree.route('/v1/%s' % res, 'dest', 'GET', 'POST')
+        tree.route('/v1/%s/{id}' % res, 'dest', 'GET', 'PUT', 'DELETE',
+                   id=int)
+        tree.route('/v1/%s/{id}/{action}' % res, 'dest', 'POST', id=int)
+
+    return tree
+
+
+def rate(tree, method, path, count):
+    """
+    Measure how fast a tree resolves a request, taking the best of
+    several runs to reduce the noise.
+
+    :param tree: The ``URLTree``.
+    :param method: The HTTP method.
+    :param path: The path to resolve.
+    :param count: The number of resolutions in each run.
+
+    :returns: The number of resolutions per second.
+    """
+
+    return max(routetable.measure(lambda: tree.resolve(method, path), count)
+               for _i in range(3))
+
+
+def main(count=20000, revision=None, max_slowdown=None):
+    current = build(urltree)
+    baseline = build(load(revision))
+
+    slow = []
+    print('%-12s %12s %12s %8s' % ('path', 'current/s', 'baseline/s',
+                                   'ratio'))
+    for name, method, path in REQUESTS:
+        cur = rate(current, method, path, count)
+        base = rate(baseline, method, path, count)
+        print('%-12s %12.0f %12.0f %8.2f' % (name, cur, base, cur / base))
+        if max_slowdown is not None and cur < base * (1 - max_slowdown):
+            slow.append(name)
+
+    if slow:
+        print('Slower than the baseline: %s' % ', '.join(slow))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(main(int(args[0]) if args else 20000,
+                  args[1] if len(args) > 1 else None,
+                  float(args[2]) if len(args) > 2 else None))
@@ -0,0 +1,91 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the request throughput of ``WSGIDispatcher`` when driven by a
+stub WSGI server, compared to the usual hand-written glue around
+``URLTree.resolve()``.
+"""
+
+import sys
+
+import routetable
+import urltree
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'OK']
+
+
+def make_glue(tree):
+    """
+    Build a WSGI application which dispatches the way applications
+    typically did before ``WSGIDispatcher`` was available.
+    """
+
+    def glue(environ, start_response):
+        dest, params = tree.resolve(environ['REQUEST_METHOD'],
+                                    environ['PATH_INFO'])
+        if dest is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'404 Not Found']
+
+        environ['wsgiorg.routing_args'] = ((), params)
+        return dest(environ, start_response)
+
+    return glue
+
+
+def make_server(application, reqs):
+    """
+    Build a stub WSGI server which runs each request through the
+    application once, consuming the response as a server would.
+    """
+
+    environs = [{
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+    } for method, path in reqs]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def serve():
+        for environ in environs:
+            for _chunk in application(environ.copy(), start_response):
+                pass
+
+    return serve
+
+
+def main(count=200):
+    tree = routetable.build(app)
+    reqs = routetable.requests()
+
+    for name, application in [('glue', make_glue(tree)),
+                              ('WSGIDispatcher',
+                               urltree.WSGIDispatcher(tree))]:
+        rate = routetable.measure(make_server(application, reqs), count)
+        print('%-16s %10.0f requests/s' % (name, rate * len(reqs)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
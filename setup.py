@@ -44,8 +44,16 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Topic :: Internet :: WWW/HTTP',
     ],
-    py_modules=['urltree'],
+    py_modules=['urltree', 'urltree_asgi', 'urltree_cover'],
+    python_requires='>=3.8',
+    entry_points={
+        'console_scripts': [
+            'urltree-cover = urltree_cover:main',
+        ],
+    },
     tests_require=readreq('.test-requires'),
 )
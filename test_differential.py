@@ -0,0 +1,797 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Differential tests for ``URLTree``.  Random route tables and random
+requests are run through ``URLTree.resolve()``, in several
+configurations, and through ``ReferenceRouter``, a deliberately naive
+implementation of the documented resolution rules which keeps the
+routes in a plain list and builds no tree.  The configurations
+include routes for a virtual host and dispatching through
+``WSGIDispatcher``, and the path elements include non-ASCII text.  Any
+disagreement is shrunk to a minimal route table and request before
+being reported.
+
+Run as a script, this module checks many more tables than the unit
+test does, and can also time ``URLTree.resolve()`` on the generated
+tables, doubling as a throughput regression check::
+
+    python test_differential.py check [COUNT [SEED]]
+    python test_differential.py time [COUNT [MIN_RATE]]
+
+In "time" mode, the exit status is nonzero if the throughput falls
+below MIN_RATE requests per second.
+"""
+
+import random
+import re
+import sys
+import time
+import unittest
+from unittest import mock
+
+import urltree
+
+
+# The constant path elements used in route patterns and requests
+LITERALS = ['a', 'b', 'go', '12', 'x.y', 'caf\xe9']
+
+# The variable kinds, by name prefix; the variable names in a pattern
+# are suffixed with their depth, so that the names and restrictions at
+# each level of the tree are always consistent
+VARIABLES = {
+    'num': int,
+    'act': '(go|stop)',
+    'word': '[a-z]+',
+    'alnum': r'\w+',
+    'three': '.{3}',
+    'any': None,
+}
+
+# The partial element patterns; "%d" is replaced by the depth
+TEMPLATES = ['v{num%d}', '{word%d}.{any%d}', 'f{any%d}.txt']
+
+# Additional path elements which exercise the restrictions in requests
+ELEMENTS = LITERALS + [
+    '7', '123', '-4', 'stop', 'abc', 'ABC', 'v3', 'vx', 'abc.def',
+    'a.b.c', 'fz.txt', 'f.txt', 'go.x', 'caf\xe9', '\xe9t\xe9', 'na\xefve',
+    '\u0663', 'v\u0663', 'x\u20acy', 'f\xe9.txt',
+]
+
+METHODS = ['GET', 'PUT', 'POST']
+
+
+def restrictions(rand):
+    """
+    Select the restrictions for a route table.  The same restrictions
+    are passed to every route in the table.
+
+    :param rand: The ``random.Random`` to use.
+
+    :returns: A dictionary of the restrictions, by variable name.
+    """
+
+    result = {}
+    for depth in range(4):
+        for prefix, restrict in VARIABLES.items():
+            # Exercise memoized restrictions too
+            if callable(restrict) and rand.random() < 0.5:
+                restrict = urltree.Memoize(restrict, 4)
+            result['%s%d' % (prefix, depth)] = restrict
+        result['rest%d' % depth] = None
+
+    return result
+
+
+def gen_pattern(rand):
+    """
+    Generate a random route pattern.
+
+    :param rand: The ``random.Random`` to use.
+
+    :returns: The route pattern.
+    """
+
+    elems = []
+    for depth in range(rand.randint(0, 3)):
+        kind = rand.random()
+        if kind < 0.45:
+            elems.append(rand.choice(LITERALS))
+        elif kind < 0.8:
+            elems.append('{%s%d}' % (rand.choice(list(VARIABLES)), depth))
+        else:
+            elems.append(rand.choice(TEMPLATES).replace('%d', str(depth)))
+
+    if rand.random() < 0.15:
+        elems.append('{rest%d:*}' % len(elems))
+
+    return '/' + '/'.join(elems)
+
+
+def gen_routes(rand):
+    """
+    Generate a random route table.
+
+    :param rand: The ``random.Random`` to use.
+
+    :returns: A list of (pattern, destination, methods) tuples.
+    """
+
+    routes = []
+    for idx in range(rand.randint(1, 12)):
+        methods = rand.sample(METHODS, rand.randint(0, 2))
+        routes.append((gen_pattern(rand), 'dest%d' % idx, methods))
+
+    return routes
+
+
+def gen_request(rand, routes):
+    """
+    Generate a random request.  Most requests are based on one of the
+    route patterns, so that they stand a good chance of resolving.
+
+    :param rand: The ``random.Random`` to use.
+    :param routes: The route table.
+
+    :returns: A tuple of the method and the URL.
+    """
+
+    if routes and rand.random() < 0.7:
+        pattern = rand.choice(routes)[0]
+        elems = []
+        for elem in pattern.split('/')[1:]:
+            if '{' in elem and rand.random() < 0.9:
+                elem = re.sub(r'\{[^{}]+\}',
+                              lambda match: rand.choice(ELEMENTS), elem)
+            elems.append(elem)
+    else:
+        elems = [rand.choice(ELEMENTS) for _i in range(rand.randint(0, 4))]
+
+    # Sometimes add extra elements, or drop the last one
+    if elems and rand.random() < 0.1:
+        elems.pop()
+    while rand.random() < 0.2:
+        elems.append(rand.choice(ELEMENTS))
+
+    url = ''.join(rand.choice(['/', '/', '/', '//']) + elem
+                  for elem in elems) or '/'
+    if rand.random() < 0.1:
+        url += '/'
+    if rand.random() < 0.1:
+        url += '?q=1'
+
+    method = rand.choice(METHODS)
+    if rand.random() < 0.1:
+        method = method.lower()
+
+    return method, url
+
+
+def _match_var(restrict, text, params, name):
+    """
+    Match text against a variable restriction.
+
+    :param restrict: The restriction.
+    :param text: The text to match.
+    :param params: The dictionary to add the value to.
+    :param name: The name of the variable.
+
+    :returns: ``True`` if the text matches, ``False`` otherwise.
+    """
+
+    if restrict is None:
+        value = text
+    elif isinstance(restrict, str):
+        value = re.match(restrict if restrict.endswith('$') else
+                         restrict + '$', text)
+        if value is None:
+            return False
+    else:
+        try:
+            value = restrict(text)
+        except ValueError:
+            return False
+
+    params[name] = value
+    return True
+
+
+class ReferenceRouter:
+    """
+    A naive URL router implementing the documented semantics of
+    ``URLTree.resolve()``, for the path elements and methods only.
+    Routes are kept in a list, and at each path element the routes
+    still in the running are narrowed down to those sharing the
+    pattern element which wins by the documented priorities: exact
+    constants, then partial elements with the most constant text,
+    then restricted variables in the order they were first declared,
+    then the unrestricted variable, and finally the catch-all.  There
+    is no backtracking.
+    """
+
+    def __init__(self):
+        """
+        Initialize a ``ReferenceRouter``.
+        """
+
+        self.routes = []
+
+    def route(self, pattern, dest, *methods, **restrictions):
+        """
+        Add a route.
+
+        :param pattern: The URL pattern; only paths are supported.
+        :param dest: The destination.
+        :param methods: The HTTP methods.
+        :param restrictions: The restrictions on the variables.
+        """
+
+        elems = []
+        for elem in pattern.split('/'):
+            if not elem:
+                continue
+
+            parts = re.split(r'\{([^{}]+)\}', elem)
+            if len(parts) == 1:
+                elems.append(('literal', elem, None))
+            elif parts[0] or parts[2] or len(parts) > 3:
+                elems.append(('partial', elem, [
+                    (name, restrictions.get(name)) for name in parts[1::2]
+                ]))
+            elif parts[1].endswith(':*'):
+                name = parts[1][:-2]
+                elems.append(('tail', name, restrictions.get(name)))
+            else:
+                elems.append(('variable', parts[1],
+                              restrictions.get(parts[1])))
+
+        self.routes.append((elems, dest,
+                            [method.upper() for method in methods]))
+
+    def _candidates(self, live, depth):
+        """
+        List the distinct pattern elements at a given depth of the
+        routes still in the running, in the order they are to be
+        tried.  Catch-alls are not included.
+
+        :param live: The routes still in the running.
+        :param depth: The depth.
+
+        :returns: A list of pattern elements.
+        """
+
+        seen = []
+        for elems, _dest, _methods in live:
+            if len(elems) > depth and elems[depth][0] != 'tail':
+                if elems[depth][:2] not in [elem[:2] for elem in seen]:
+                    seen.append(elems[depth])
+
+        def fixed(elem):
+            return len(re.sub(r'\{[^{}]+\}', '', elem[1]))
+
+        literals = [elem for elem in seen if elem[0] == 'literal']
+        partials = sorted((elem for elem in seen if elem[0] == 'partial'),
+                          key=lambda elem: -fixed(elem))
+        variables = [elem for elem in seen if elem[0] == 'variable']
+
+        return (literals + partials +
+                [elem for elem in variables if elem[2] is not None] +
+                [elem for elem in variables if elem[2] is None])
+
+    def _match(self, elem, text, params):
+        """
+        Match a path element against a pattern element.
+
+        :param elem: The pattern element.
+        :param text: The path element.
+        :param params: The dictionary to add the values to.
+
+        :returns: ``True`` if the path element matches, ``False``
+                  otherwise.
+        """
+
+        kind, key, restrict = elem
+        if kind == 'literal':
+            return text == key
+        elif kind == 'variable':
+            return _match_var(restrict, text, params, key)
+
+        # A partial element: constant text around greedy variables
+        consts = re.split(r'\{[^{}]+\}', key)
+        match = re.match('(.+)'.join(re.escape(const) for const in consts) +
+                         '$', text)
+        if match is None:
+            return False
+
+        values = {}
+        for (name, restrict), value in zip(restrict, match.groups()):
+            if not _match_var(restrict, value, values, name):
+                return False
+        params.update(values)
+        return True
+
+    def resolve(self, method, url):
+        """
+        Resolve a request.
+
+        :param method: The HTTP method.
+        :param url: The URL path, possibly with a query string.
+
+        :returns: A tuple of the destination and a dictionary of
+                  parameters, or ``(None, None)``.
+        """
+
+        path = url.partition('?')[0]
+        elems = [(match.group(), match.start())
+                 for match in re.finditer('[^/]+', path)]
+
+        live = self.routes
+        params = {}
+        depth = 0
+        for idx, (text, start) in enumerate(elems):
+            for elem in self._candidates(live, depth):
+                if self._match(elem, text, params):
+                    live = [route for route in live
+                            if len(route[0]) > depth and
+                            route[0][depth][:2] == elem[:2]]
+                    depth += 1
+                    break
+            else:
+                # Try the catch-all on the rest of the path
+                tails = [route for route in live
+                         if len(route[0]) == depth + 1 and
+                         route[0][depth][0] == 'tail']
+                if tails and _match_var(tails[0][0][depth][2], path[start:],
+                                        params, tails[0][0][depth][1]):
+                    return self._select(method, tails, depth + 1, params)
+
+                params['path_info'] = '/'.join(
+                    text for text, _start in elems[idx:])
+                break
+
+        return self._select(method, live, depth, params)
+
+    def _select(self, method, live, depth, params):
+        """
+        Select the destination among the routes ending at a depth.
+
+        :param method: The HTTP method.
+        :param live: The routes still in the running.
+        :param depth: The depth.
+        :param params: The parameters.
+
+        :returns: A tuple of the destination and the parameters, or
+                  ``(None, None)``.
+        """
+
+        dests = {}
+        default = None
+        for elems, dest, methods in live:
+            if len(elems) != depth:
+                continue
+            for meth in methods:
+                dests[meth] = dest
+            if not methods:
+                default = dest
+
+        dest = dests.get(method.upper(), default)
+        if dest is None:
+            return None, None
+        return dest, params
+
+
+class Dest(str):
+    """
+    A destination, which is also a WSGI application returning itself
+    and the environment it was called with, so that the same route
+    table can be used with ``WSGIDispatcher``.
+    """
+
+    def __call__(self, environ, start_response):
+        return self, environ
+
+
+def _wsgi_resolve(tree, method, url):
+    """
+    Resolve a request through ``WSGIDispatcher``, presenting the path
+    as a WSGI server would, and translate the result back into the
+    form ``URLTree.resolve()`` returns.
+
+    :param tree: The tree.
+    :param method: The HTTP method.
+    :param url: The URL path, possibly with a query string.
+
+    :returns: A tuple of the destination and a dictionary of
+              parameters, or ``(None, None)``.
+    """
+
+    path, _sep, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': query,
+    }
+
+    result = urltree.WSGIDispatcher(tree)(environ, mock.Mock())
+    if not isinstance(result, tuple):
+        return None, None
+
+    dest, environ = result
+    params = dict(environ['wsgiorg.routing_args'][1])
+    if 'SCRIPT_NAME' in environ:
+        rest = environ['PATH_INFO'].encode('latin-1').decode('utf-8')
+        params['path_info'] = '/'.join(elem for elem in rest.split('/')
+                                       if elem)
+
+    return dest, params
+
+
+def canonical(result):
+    """
+    Canonicalize the result of resolving a request, for comparison.
+    Match objects are replaced by the matched value; nothing else is
+    converted, so a byte string where the reference has text is a
+    mismatch.
+
+    :param result: The tuple returned by ``resolve()``.
+
+    :returns: The canonical form.
+    """
+
+    dest, params = result
+    if params is None:
+        return dest, params
+
+    canon = {}
+    for name, value in params.items():
+        if isinstance(value, re.Match):
+            value = value.group()
+        canon[name] = value
+
+    return dest, canon
+
+
+# The URLTree configurations checked against the reference; each is a
+# tuple of a name, a prefix for the route patterns, the keyword
+# arguments for URLTree, and a function taking the tree, the method,
+# and the URL and resolving the request
+CONFIGS = [
+    ('plain', '', {}, lambda tree, method, url: tree.resolve(method, url)),
+    ('bytes', '', {},
+     lambda tree, method, url: tree.resolve(method, url.encode('utf-8'))),
+    ('reject_cache', '', dict(reject_cache=4),
+     lambda tree, method, url: tree.resolve(method, url)),
+    ('vhost', 'https://*.example.com', dict(reject_cache=4),
+     lambda tree, method, url: tree.resolve(
+         method, 'https://www.example.com' + url)),
+    ('wsgi', '', {}, _wsgi_resolve),
+]
+
+
+def build(cls, routes, restricts, prefix='', **kwargs):
+    """
+    Build a router from a route table.
+
+    :param cls: The router class.
+    :param routes: The route table.
+    :param restricts: The restrictions.
+    :param prefix: A prefix for the route patterns, e.g., to restrict
+                   them to a virtual host.
+
+    :returns: The router.
+    """
+
+    router = cls(**kwargs)
+    for pattern, dest, methods in routes:
+        router.route(prefix + pattern, Dest(dest), *methods, **restricts)
+    return router
+
+
+def mismatches(routes, restricts, requests, training=None):
+    """
+    Run requests through the reference router and through each
+    ``URLTree`` configuration, the last time after letting an
+    optimized tree reorder itself based on a set of requests.
+
+    :param routes: The route table.
+    :param restricts: The restrictions.
+    :param requests: A list of (method, URL) tuples.
+    :param training: A list of (method, URL) tuples to optimize the
+                     tree with.  Defaults to ``requests``.
+
+    :returns: A list of (configuration name, method, URL, expected,
+              actual) tuples, one for each disagreement.
+    """
+
+    ref = build(ReferenceRouter, routes, restricts)
+    expected = [canonical(ref.resolve(method, url))
+                for method, url in requests]
+
+    result = []
+    for name, prefix, kwargs, resolve in CONFIGS:
+        tree = build(urltree.URLTree, routes, restricts, prefix, **kwargs)
+
+        # Resolve everything twice, to exercise any caching
+        for _i in range(2):
+            for (method, url), exp in zip(requests, expected):
+                actual = canonical(resolve(tree, method, url))
+                if actual != exp:
+                    result.append((name, method, url, exp, actual))
+
+    tree = build(urltree.URLTree, routes, restricts, stats=True)
+    for method, url in requests if training is None else training:
+        tree.resolve(method, url)
+    tree.optimize()
+    for (method, url), exp in zip(requests, expected):
+        actual = canonical(tree.resolve(method, url))
+        if actual != exp:
+            result.append(('optimize', method, url, exp, actual))
+
+    return result
+
+
+def shrink(routes, restricts, requests):
+    """
+    Shrink a failing case to a minimal route table and a single
+    request which still fail.  Since the order of an optimized tree
+    depends on the requests used to optimize it, all the original
+    requests are still used for that.
+
+    :param routes: The route table.
+    :param restricts: The restrictions.
+    :param requests: The requests; at least one must fail.
+
+    :returns: A tuple of the shrunken route table and request.
+    """
+
+    def fails(routes, request):
+        return bool(mismatches(routes, restricts, [request], requests))
+
+    request = next(req for req in requests if fails(routes, req))
+
+    changed = True
+    while changed:
+        changed = False
+
+        # Try dropping each route
+        for idx in range(len(routes)):
+            candidate = routes[:idx] + routes[idx + 1:]
+            if fails(candidate, request):
+                routes = candidate
+                changed = True
+                break
+        if changed:
+            continue
+
+        # Try simpler URLs: fewer path elements, no query string, and
+        # single slashes
+        method, url = request
+        elems = url.partition('?')[0].split('/')
+        candidates = ['/'.join(elems[:idx] + elems[idx + 1:]) or '/'
+                      for idx in range(1, len(elems))]
+        candidates += [url.partition('?')[0], re.sub('/+', '/', url)]
+        for candidate in candidates:
+            if candidate != url and fails(routes, (method, candidate)):
+                request = method, candidate
+                changed = True
+                break
+        if changed:
+            continue
+
+        # Try the simplest method
+        if method != 'GET' and fails(routes, ('GET', url)):
+            request = 'GET', url
+            changed = True
+
+    return routes, request
+
+
+def report(routes, restricts, request, training):
+    """
+    Describe a failing case as a snippet of Python code.
+
+    :param routes: The route table.
+    :param restricts: The restrictions.
+    :param request: The failing request.
+    :param training: The requests used to optimize the tree.
+
+    :returns: The description.
+    """
+
+    lines = ['tree = URLTree()']
+    for pattern, dest, methods in routes:
+        names = re.findall(r'\{([^{}:]+)(?::\*)?\}', pattern)
+        args = [repr(pattern), repr(dest)] + [repr(meth) for meth in methods]
+        args += ['%s=%r' % (name, restricts[name]) for name in names
+                 if restricts.get(name) is not None]
+        lines.append('tree.route(%s)' % ', '.join(args))
+    lines.append('tree.resolve(%r, %r)' % request)
+
+    for name, method, url, exp, actual in mismatches(
+            routes, restricts, [request], training):
+        line = '# %s: expected %r, got %r' % (name, exp, actual)
+        if line not in lines:
+            lines.append(line)
+
+    return '\n'.join(lines)
+
+
+def check(count, seed=0):
+    """
+    Check a number of random route tables.
+
+    :param count: The number of route tables.
+    :param seed: The seed of the first route table; each table is
+                 generated from its own seed, so that failures can be
+                 reproduced individually.
+
+    :returns: A list of reports of minimal failing cases.
+    """
+
+    failures = []
+    for table in range(seed, seed + count):
+        rand = random.Random(table)
+        restricts = restrictions(rand)
+        routes = gen_routes(rand)
+        requests = [gen_request(rand, routes) for _i in range(40)]
+
+        try:
+            build(urltree.URLTree, routes, restricts)
+        except (NameError, ValueError):
+            # The route table itself was rejected; not interesting
+            continue
+
+        if mismatches(routes, restricts, requests):
+            routes, request = shrink(routes, restricts, requests)
+            failures.append('# seed %d\n%s' % (
+                table, report(routes, restricts, request, requests)))
+
+    return failures
+
+
+def timing(count):
+    """
+    Time ``URLTree.resolve()`` on random route tables and requests.
+
+    :param count: The number of route tables.
+
+    :returns: The number of requests resolved per second.
+    """
+
+    total = 0
+    elapsed = 0.0
+    for table in range(count):
+        rand = random.Random(table)
+        restricts = restrictions(rand)
+        routes = gen_routes(rand)
+        requests = [gen_request(rand, routes) for _i in range(200)]
+        try:
+            tree = build(urltree.URLTree, routes, restricts)
+        except (NameError, ValueError):
+            continue
+
+        resolve = tree.resolve
+        start = time.perf_counter()
+        for method, url in requests:
+            resolve(method, url)
+        elapsed += time.perf_counter() - start
+        total += len(requests)
+
+    return total / elapsed
+
+
+class TestDifferential(unittest.TestCase):
+    def test_reference(self):
+        ref = build(ReferenceRouter, [
+            ('/a/{num1}', 'dest1', ['GET']),
+            ('/a/{any1}', 'dest2', []),
+            ('/a/v{num1}', 'dest3', []),
+            ('/b/{rest1:*}', 'dest4', []),
+        ], restrictions(random.Random(0)))
+
+        self.assertEqual(ref.resolve('GET', '/a/12'),
+                         ('dest1', dict(num1=12)))
+        self.assertEqual(ref.resolve('PUT', '/a/12'), (None, None))
+        self.assertEqual(ref.resolve('PUT', '/a/v2/x'),
+                         ('dest3', dict(num1=2, path_info='x')))
+        self.assertEqual(ref.resolve('GET', '/a/abc'),
+                         ('dest2', dict(any1='abc')))
+        self.assertEqual(ref.resolve('GET', '/b//c/'),
+                         ('dest4', dict(rest1='c/')))
+        self.assertEqual(ref.resolve('GET', '/c'), (None, None))
+
+    def test_shrink(self):
+        restricts = restrictions(random.Random(0))
+        routes = [
+            ('/a', 'dest1', []),
+            ('/b/{any1}', 'dest2', []),
+            ('/b/{num1}', 'dest3', []),
+        ]
+
+        # Make the reference disagree about integers
+        with mock.patch.object(
+                ReferenceRouter, '_candidates',
+                lambda self, live, depth: [
+                    elem for elems, _dest, _meths in live
+                    if len(elems) > depth for elem in elems[depth:depth + 1]
+                ]):
+            result = shrink(routes, restricts, [
+                ('PUT', '/a'), ('PUT', '//b/7?q=1'),
+            ])
+
+        self.assertEqual(result, (routes[1:], ('GET', '/b/7')))
+
+    def test_check_resolve_error(self):
+        # Only errors building the route table are skipped
+        with mock.patch.object(urltree.URLTree, 'resolve',
+                               side_effect=UnicodeDecodeError(
+                                   'utf-8', b'', 0, 1, 'bad')):
+            self.assertRaises(UnicodeDecodeError, check, 1)
+
+    def test_wsgi_resolve(self):
+        tree = build(urltree.URLTree, [
+            ('/caf\xe9/{any1}', 'dest1', ['GET']),
+        ], restrictions(random.Random(0)))
+
+        self.assertEqual(_wsgi_resolve(tree, 'GET', '/caf\xe9/x//\xe9t\xe9/'),
+                         ('dest1', dict(any1='x', path_info='\xe9t\xe9')))
+        self.assertEqual(_wsgi_resolve(tree, 'PUT', '/caf\xe9/x'),
+                         (None, None))
+
+    def test_canonical(self):
+        self.assertEqual(canonical(('dest1', dict(
+            any1=re.match('[a-z]+', 'abc'), num1=5))),
+            ('dest1', dict(any1='abc', num1=5)))
+        self.assertNotEqual(canonical(('dest1', dict(
+            any1=re.match(b'[a-z]+', b'abc')))),
+            ('dest1', dict(any1='abc')))
+        self.assertEqual(canonical((None, None)), (None, None))
+
+    def test_wsgi_resolve_text(self):
+        tree = build(urltree.URLTree, [
+            ('/a/{any1}', 'dest1', ['GET']),
+        ], dict(any1='[a-z]+'))
+
+        dest, params = _wsgi_resolve(tree, 'GET', '/a/abc')
+
+        self.assertEqual(dest, 'dest1')
+        self.assertTrue(isinstance(params['any1'].group(), str))
+
+    def test_differential(self):
+        failures = check(150)
+
+        self.assertEqual(failures, [], '\n\n'.join(failures))
+
+
+def main(mode='check', count=None, arg=None):
+    if mode == 'check':
+        failures = check(int(count or 2000), int(arg or 0))
+        for failure in failures:
+            print(failure)
+            print()
+        print('%d failing route tables' % len(failures))
+        sys.exit(1 if failures else 0)
+    elif mode == 'time':
+        rate = timing(int(count or 200))
+        print('URLTree.resolve() %10.0f requests/s' % rate)
+        if arg is not None and rate < float(arg):
+            print('below the minimum of %s requests/s' % arg)
+            sys.exit(1)
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:4])
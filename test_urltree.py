@@ -13,13 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import mock
-import unittest2
+import io
+import json
+import sys
+import traceback
+import unittest
+from unittest import mock
 
 import urltree
 
 
-class TestPathSplit(unittest2.TestCase):
+class TestPathSplit(unittest.TestCase):
     def test_path_split_notrail(self):
         url = "///root//elem1/elem2////"
 
@@ -41,8 +45,253 @@ class TestPathSplit(unittest2.TestCase):
 
         self.assertEqual(result, ['root', 'elem1', 'elem2'])
 
+    def test_path_split_bytes(self):
+        url = b"///root//elem1/elem2////"
 
-class TestMethodDict(unittest2.TestCase):
+        result = list(urltree._path_split(url))
+
+        self.assertEqual(result, [b'root', b'elem1', b'elem2'])
+
+
+class TestPathNormalize(unittest.TestCase):
+    def test_plain(self):
+        result = urltree._path_normalize('///root//elem1/elem2/')
+
+        self.assertEqual(result, ['root', 'elem1', 'elem2'])
+
+    def test_dots(self):
+        result = urltree._path_normalize('/./root/../../elem1/./elem2/..')
+
+        self.assertEqual(result, ['elem1'])
+
+    @mock.patch.object(urltree, 'unquote', side_effect=lambda x: x.lower())
+    def test_no_percent(self, mock_unquote):
+        result = urltree._path_normalize('/Root/Elem1')
+
+        self.assertEqual(result, ['Root', 'Elem1'])
+        self.assertFalse(mock_unquote.called)
+
+    @mock.patch.object(urltree, 'unquote', side_effect=lambda x: x.lower())
+    def test_percent_per_elem(self, mock_unquote):
+        result = urltree._path_normalize('/Root/%41')
+
+        self.assertEqual(result, ['Root', '%41'])
+        mock_unquote.assert_called_once_with('%41')
+
+    def test_decode(self):
+        result = urltree._path_normalize('/a%20b/c%2Fd/e/%2e%2E/f')
+
+        self.assertEqual(result, ['a b', 'c/d', 'f'])
+
+    def test_decode_bytes(self):
+        result = urltree._path_normalize(b'/a%20b/c%2Fd/./%C3%A4')
+
+        self.assertEqual(result, [b'a b', b'c/d', b'\xc3\xa4'])
+
+
+class TestHostKey(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(urltree._host_key('Example.COM'), 'example.com')
+
+    def test_port(self):
+        self.assertEqual(urltree._host_key('example.com:8080'),
+                         'example.com')
+
+    def test_trailing_dot(self):
+        self.assertEqual(urltree._host_key('example.com.'), 'example.com')
+
+    def test_ipv6(self):
+        self.assertEqual(urltree._host_key('[::1]'), '[::1]')
+
+    def test_ipv6_port(self):
+        self.assertEqual(urltree._host_key('[::1]:8080'), '[::1]')
+
+
+class TestHostCandidates(unittest.TestCase):
+    def test_candidates(self):
+        result = urltree._host_candidates('WWW.example.com:443')
+
+        self.assertEqual(result, ('www.example.com', '*.example.com',
+                                  '*.com'))
+
+    def test_single_label(self):
+        self.assertEqual(urltree._host_candidates('localhost'),
+                         ('localhost',))
+
+
+class TestSplitURL(unittest.TestCase):
+    def test_path(self):
+        result = urltree._split_url('/elem1/elem2')
+
+        self.assertEqual(result, (None, None, '/elem1/elem2'))
+
+    def test_path_with_colon(self):
+        result = urltree._split_url('/elem1/a://b')
+
+        self.assertEqual(result, (None, None, '/elem1/a://b'))
+
+    def test_absolute(self):
+        result = urltree._split_url('https://example.com/elem1/elem2')
+
+        self.assertEqual(result, ('https', 'example.com', '/elem1/elem2'))
+
+    def test_bytes(self):
+        result = urltree._split_url(b'https://example.com/elem1')
+
+        self.assertEqual(result, ('https', 'example.com', b'/elem1'))
+
+    def test_bytes_path(self):
+        result = urltree._split_url(b'/elem1/elem2')
+
+        self.assertEqual(result, (None, None, b'/elem1/elem2'))
+
+    def test_absolute_nopath(self):
+        result = urltree._split_url('https://example.com')
+
+        self.assertEqual(result, ('https', 'example.com', '/'))
+
+
+class TestMappingHeader(unittest.TestCase):
+    def test_exact(self):
+        headers = {'accept': 'text/html'}
+
+        self.assertEqual(urltree._mapping_header(headers, 'accept'),
+                         'text/html')
+
+    def test_case(self):
+        headers = {'Accept': 'text/html'}
+
+        self.assertEqual(urltree._mapping_header(headers, 'accept'),
+                         'text/html')
+
+    def test_missing(self):
+        headers = {'Accept': 'text/html'}
+
+        self.assertEqual(urltree._mapping_header(headers, 'x-version'), None)
+
+
+class TestEnvironHeader(unittest.TestCase):
+    def test_header(self):
+        environ = dict(HTTP_X_VERSION='2')
+
+        self.assertEqual(urltree._environ_header(environ, 'x-version'), '2')
+
+    def test_content_type(self):
+        environ = dict(CONTENT_TYPE='text/plain')
+
+        self.assertEqual(urltree._environ_header(environ, 'content-type'),
+                         'text/plain')
+
+    def test_missing(self):
+        self.assertEqual(urltree._environ_header({}, 'x-version'), None)
+
+
+class TestBytesPattern(unittest.TestCase):
+    def test_ascii(self):
+        for pattern in ('[a-z]+$', '(list|detail)$', r'v[0-9]+\.json$',
+                        r'(?P<id>[0-9]{2,4})$', r'a\\$'):
+            self.assertEqual(urltree._bytes_pattern(pattern).pattern,
+                             pattern.encode('ascii'))
+
+    def test_text(self):
+        for pattern in ('caf\xe9$', r'\w+$', r'\d+$', r'\x41$', '.{4}$',
+                        '[^/]+$', '(?u)[a-z]+$', '(?i)abc$', '(?-i:a)$'):
+            self.assertEqual(urltree._bytes_pattern(pattern), None)
+
+
+class TestRestrictDomain(unittest.TestCase):
+    def test_int(self):
+        self.assertEqual(urltree._restrict_domain(int), ('int', None))
+
+    def test_function(self):
+        self.assertEqual(urltree._restrict_domain(float), None)
+
+    def test_memoize(self):
+        self.assertEqual(urltree._restrict_domain(urltree.Memoize(int)),
+                         ('int', None))
+        self.assertEqual(urltree._restrict_domain(urltree.Memoize(float)),
+                         None)
+
+    def test_none(self):
+        self.assertEqual(urltree._restrict_domain(None), None)
+
+    def test_literal(self):
+        self.assertEqual(urltree._restrict_domain('detail$'),
+                         ('literals', frozenset(['detail'])))
+
+    def test_literal_group(self):
+        self.assertEqual(urltree._restrict_domain('(list|detail)'),
+                         ('literals', frozenset(['list', 'detail'])))
+        self.assertEqual(urltree._restrict_domain('(?:list|detail)$'),
+                         ('literals', frozenset(['list', 'detail'])))
+
+    def test_literal_ungrouped(self):
+        self.assertEqual(urltree._restrict_domain('list|detail'), None)
+
+    def test_literal_meta(self):
+        self.assertEqual(urltree._restrict_domain('(li.t|detail)'), None)
+
+    def test_nodigits(self):
+        self.assertEqual(urltree._restrict_domain('[a-z]+'),
+                         ('nodigits', None))
+        self.assertEqual(urltree._restrict_domain('[A-Za-z_-]{2,5}$'),
+                         ('nodigits', None))
+
+    def test_nodigits_digits(self):
+        self.assertEqual(urltree._restrict_domain('[a-z0-9]+'), None)
+        self.assertEqual(urltree._restrict_domain('[!-~]+'), None)
+
+    def test_nodigits_negated(self):
+        self.assertEqual(urltree._restrict_domain('[^0-9]+'), None)
+
+
+class TestDisjoint(unittest.TestCase):
+    def test_unknown(self):
+        self.assertFalse(urltree._disjoint(None, ('int', None)))
+        self.assertFalse(urltree._disjoint(('int', None), None))
+
+    def test_literals(self):
+        self.assertTrue(urltree._disjoint(
+            ('literals', frozenset(['a', 'b'])),
+            ('literals', frozenset(['c']))))
+        self.assertFalse(urltree._disjoint(
+            ('literals', frozenset(['a', 'b'])),
+            ('literals', frozenset(['b', 'c']))))
+
+    def test_int_nodigits(self):
+        self.assertTrue(urltree._disjoint(('int', None),
+                                          ('nodigits', None)))
+        self.assertTrue(urltree._disjoint(('nodigits', None),
+                                          ('int', None)))
+
+    def test_int_literals(self):
+        self.assertTrue(urltree._disjoint(
+            ('literals', frozenset(['a', 'b'])), ('int', None)))
+        self.assertFalse(urltree._disjoint(
+            ('int', None), ('literals', frozenset(['a', '12']))))
+
+    def test_nodigits_literals(self):
+        self.assertFalse(urltree._disjoint(
+            ('nodigits', None), ('literals', frozenset(['12']))))
+
+
+class TestDescribe(unittest.TestCase):
+    def test_string(self):
+        self.assertEqual(urltree._describe('spam'), 'spam')
+
+    def test_function(self):
+        self.assertEqual(urltree._describe(urltree._describe),
+                         'urltree:_describe')
+
+    def test_class(self):
+        self.assertEqual(urltree._describe(urltree.URLTree),
+                         'urltree:URLTree')
+
+    def test_other(self):
+        self.assertEqual(urltree._describe(5), '5')
+
+
+class TestMethodDict(unittest.TestCase):
     def test_init(self):
         mdict = urltree.MethodDict()
 
@@ -67,16 +316,197 @@ class TestMethodDict(unittest2.TestCase):
 
         self.assertEqual(mdict['POST'], 'default')
 
+    def test_pseudo_method(self):
+        mdict = urltree.MethodDict()
+        mdict.default = 'default'
+
+        self.assertEqual(mdict['WEBSOCKET'], None)
+
+        mdict['WEBSOCKET'] = 'socket'
+
+        self.assertEqual(mdict['WEBSOCKET'], 'socket')
+
+
+class TestPredicate(unittest.TestCase):
+    def test_query(self):
+        pred = urltree.Query('Format', 'json')
+
+        self.assertEqual(pred.kind, 'query')
+        self.assertEqual(pred.name, 'Format')
+        self.assertEqual(pred.value, 'json')
+        self.assertEqual(repr(pred), "Query('Format', 'json')")
+
+    def test_header(self):
+        pred = urltree.Header('X-Version')
+
+        self.assertEqual(pred.kind, 'header')
+        self.assertEqual(pred.name, 'x-version')
+        self.assertEqual(pred.value, None)
+
 
-class TestURLNode(unittest2.TestCase):
+def parse_pair(text):
+    first, second = text.split('-')
+    return int(first), int(second)
+
+
+class TestMemoize(unittest.TestCase):
+    def test_init(self):
+        memo = urltree.Memoize(parse_pair, 5)
+
+        self.assertEqual(memo.func, parse_pair)
+        self.assertEqual(memo.size, 5)
+        self.assertEqual(memo.__name__, 'parse_pair')
+        self.assertEqual(memo._cache, {})
+        self.assertEqual(memo.stats(), dict(hits=0, misses=0, evictions=0,
+                                            size=0))
+        self.assertEqual(repr(memo), 'Memoize(%r, 5)' % parse_pair)
+
+    def test_init_type(self):
+        memo = urltree.Memoize(int)
+
+        self.assertEqual(memo.__name__, 'int')
+        self.assertFalse('bit_length' in vars(memo))
+
+    def test_call(self):
+        func = mock.Mock(return_value='value')
+        memo = urltree.Memoize(func)
+
+        self.assertEqual(memo('elem'), 'value')
+        self.assertEqual(memo('elem'), 'value')
+
+        func.assert_called_once_with('elem')
+        self.assertEqual(memo.stats(), dict(hits=1, misses=1, evictions=0,
+                                            size=1))
+
+    def test_call_value_error(self):
+        func = mock.Mock(side_effect=ValueError('bad'))
+        memo = urltree.Memoize(func)
+
+        depths = []
+        for _i in range(3):
+            try:
+                memo('elem')
+            except ValueError as exc:
+                self.assertEqual(str(exc), 'bad')
+                depths.append(len(traceback.extract_tb(exc.__traceback__)))
+
+        # The traceback must not grow each time
+        self.assertEqual(depths, [depths[0]] * 3)
+
+        func.assert_called_once_with('elem')
+        self.assertEqual(memo.stats(), dict(hits=2, misses=1, evictions=0,
+                                            size=1))
+
+    def test_call_other_error(self):
+        func = mock.Mock(side_effect=TypeError('bad'))
+        memo = urltree.Memoize(func)
+
+        self.assertRaises(TypeError, memo, 'elem')
+        self.assertRaises(TypeError, memo, 'elem')
+
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(memo._cache, {})
+
+    def test_call_evict(self):
+        func = mock.Mock(side_effect=lambda elem: elem.upper())
+        memo = urltree.Memoize(func, 2)
+
+        for elem in ('a', 'b', 'a', 'c', 'a'):
+            memo(elem)
+
+        self.assertEqual(list(memo._cache), ['c', 'a'])
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(memo.stats(), dict(hits=2, misses=3, evictions=1,
+                                            size=2))
+
+    def test_stats_reset(self):
+        memo = urltree.Memoize(parse_pair)
+        memo('1-2')
+        memo('1-2')
+
+        result = memo.stats(reset=True)
+
+        self.assertEqual(result, dict(hits=1, misses=1, evictions=0,
+                                      size=1))
+        self.assertEqual(memo.stats(), dict(hits=0, misses=0, evictions=0,
+                                            size=1))
+
+    def test_eq(self):
+        memo = urltree.Memoize(parse_pair)
+
+        self.assertTrue(memo == urltree.Memoize(parse_pair, 5))
+        self.assertFalse(memo != urltree.Memoize(parse_pair, 5))
+        self.assertEqual(hash(memo), hash(urltree.Memoize(parse_pair)))
+        self.assertFalse(memo == urltree.Memoize(int))
+        self.assertFalse(memo == parse_pair)
+
+    def test_route(self):
+        tree = urltree.URLTree()
+        memo = urltree.Memoize(parse_pair)
+        tree.route('/elem1/{var}', 'dest1', 'get', var=memo)
+        tree.route('/elem1/{var}', 'dest2', 'put',
+                   var=urltree.Memoize(parse_pair))
+        tree.route('/elem1/{other}', 'dest3', 'get')
+
+        self.assertEqual(tree.resolve('get', '/elem1/1-2'),
+                         ('dest1', dict(var=(1, 2))))
+        self.assertEqual(tree.resolve('put', b'/elem1/1-2'),
+                         ('dest2', dict(var=(1, 2))))
+        self.assertEqual(tree.resolve('get', '/elem1/spam'),
+                         ('dest3', dict(other='spam')))
+        self.assertEqual(tree.resolve('get', '/elem1/spam'),
+                         ('dest3', dict(other='spam')))
+        self.assertEqual(memo.stats(), dict(hits=2, misses=2, evictions=0,
+                                            size=2))
+
+
+class TestPredicateIndex(unittest.TestCase):
+    def test_init(self):
+        index = urltree.PredicateIndex('query', 'format')
+
+        self.assertEqual(index.kind, 'query')
+        self.assertEqual(index.name, 'format')
+        self.assertEqual(index.values, {})
+        self.assertEqual(index.present, None)
+
+    def test_get_dests_value(self):
+        index = urltree.PredicateIndex('query', 'format')
+
+        result1 = index.get_dests('json')
+        result2 = index.get_dests('json')
+
+        self.assertTrue(isinstance(result1, urltree.MethodDict))
+        self.assertTrue(result1 is result2)
+        self.assertEqual(index.values, dict(json=result1))
+        self.assertEqual(index.present, None)
+
+    def test_get_dests_present(self):
+        index = urltree.PredicateIndex('query', 'format')
+
+        result1 = index.get_dests(None)
+        result2 = index.get_dests(None)
+
+        self.assertTrue(isinstance(result1, urltree.MethodDict))
+        self.assertTrue(result1 is result2)
+        self.assertEqual(index.values, {})
+        self.assertTrue(index.present is result1)
+
+
+class TestURLNode(unittest.TestCase):
     def test_init(self):
         node = urltree.URLNode()
 
         self.assertEqual(node._children, {})
+        self.assertEqual(node._bchildren, {})
         self.assertEqual(node._variables, {})
         self.assertEqual(node._defaults, [])
+        self.assertEqual(node._templates, {})
+        self.assertEqual(node._partials, [])
+        self.assertEqual(node._tail, None)
         self.assertEqual(node._dest, {})
         self.assertTrue(isinstance(node._dest, urltree.MethodDict))
+        self.assertEqual(node._preds, [])
+        self.assertEqual(node._hits, 0)
 
     @mock.patch.object(urltree, 'URLVarNode')
     def test_get_var_child_exists(self, mock_URLVarNode):
@@ -100,83 +530,287 @@ class TestURLNode(unittest2.TestCase):
     @mock.patch.object(urltree, 'URLVarNode')
     def test_get_var_child_noexist_sharedrestrict(self, mock_URLVarNode):
         node = urltree.URLNode()
-        node._defaults = [
-            mock.Mock(_restrict='other'),
-            mock.Mock(_restrict='restrict'),
-        ]
+        node._variables = dict(
+            other=mock.Mock(_restrict='other'),
+            spam2=mock.Mock(_restrict='restrict'),
+        )
 
         self.assertRaises(NameError, node._get_var_child, 'spam', 'restrict')
 
         self.assertFalse(mock_URLVarNode.called)
 
-    @mock.patch.object(urltree, 'URLVarNode', return_value='new_node')
-    def test_get_var_child_noexist_norestrict(self, mock_URLVarNode):
+    def test_get_var_child_noexist_norestrict(self):
         node = urltree.URLNode()
-        defaults = [
-            mock.Mock(_restrict='other'),
-            mock.Mock(_restrict='restrict'),
-        ]
-        node._defaults = defaults[:]
-
-        child = node._get_var_child('spam', None)
-
-        self.assertEqual(child, 'new_node')
-        self.assertEqual(node._variables, dict(spam='new_node'))
+        variables = dict(
+            other=mock.Mock(_restrict='other'),
+            restrict=mock.Mock(_restrict='restrict'),
+        )
+        node._variables = variables.copy()
+        new_node = mock.Mock(_restrict=None)
+
+        with mock.patch.object(urltree, 'URLVarNode',
+                               return_value=new_node) as mock_URLVarNode:
+            child = node._get_var_child('spam', None)
+
+        self.assertEqual(child, new_node)
+        self.assertEqual(node._variables, dict(variables, spam=new_node))
         self.assertEqual(node._defaults, [
-            defaults[0],
-            defaults[1],
-            'new_node',
+            variables['other'],
+            variables['restrict'],
+            new_node,
         ])
         mock_URLVarNode.assert_called_once_with('spam', None)
 
-    @mock.patch.object(urltree, 'URLVarNode', return_value='new_node')
-    def test_get_var_child_noexist_nodefaults(self, mock_URLVarNode):
+    def test_get_var_child_noexist_nodefaults(self):
         node = urltree.URLNode()
+        new_node = mock.Mock(_restrict='restrict')
 
-        child = node._get_var_child('spam', 'restrict')
+        with mock.patch.object(urltree, 'URLVarNode',
+                               return_value=new_node) as mock_URLVarNode:
+            child = node._get_var_child('spam', 'restrict')
 
-        self.assertEqual(child, 'new_node')
-        self.assertEqual(node._variables, dict(spam='new_node'))
-        self.assertEqual(node._defaults, ['new_node'])
+        self.assertEqual(child, new_node)
+        self.assertEqual(node._variables, dict(spam=new_node))
+        self.assertEqual(node._defaults, [new_node])
         mock_URLVarNode.assert_called_once_with('spam', 'restrict')
 
-    @mock.patch.object(urltree, 'URLVarNode', return_value='new_node')
-    def test_get_var_child_noexist_noemptyrestrict(self, mock_URLVarNode):
+    def test_get_var_child_noexist_noemptyrestrict(self):
         node = urltree.URLNode()
-        defaults = [
-            mock.Mock(_restrict='other'),
-        ]
-        node._defaults = defaults[:]
-
-        child = node._get_var_child('spam', 'restrict')
+        variables = dict(
+            other=mock.Mock(_restrict='other'),
+        )
+        node._variables = variables.copy()
+        new_node = mock.Mock(_restrict='restrict')
+
+        with mock.patch.object(urltree, 'URLVarNode',
+                               return_value=new_node) as mock_URLVarNode:
+            child = node._get_var_child('spam', 'restrict')
+
+        self.assertEqual(child, new_node)
+        self.assertEqual(node._variables, dict(variables, spam=new_node))
+        self.assertEqual(node._defaults, [
+            variables['other'],
+            new_node,
+        ])
+        mock_URLVarNode.assert_called_once_with('spam', 'restrict')
 
-        self.assertEqual(child, 'new_node')
-        self.assertEqual(node._variables, dict(spam='new_node'))
+    def test_get_var_child_noexist_withemptyrestrict(self):
+        node = urltree.URLNode()
+        variables = dict(
+            other=mock.Mock(_restrict='other'),
+            empty=mock.Mock(_restrict=None),
+        )
+        node._variables = variables.copy()
+        new_node = mock.Mock(_restrict='restrict')
+
+        with mock.patch.object(urltree, 'URLVarNode',
+                               return_value=new_node) as mock_URLVarNode:
+            child = node._get_var_child('spam', 'restrict')
+
+        self.assertEqual(child, new_node)
+        self.assertEqual(node._variables, dict(variables, spam=new_node))
         self.assertEqual(node._defaults, [
-            defaults[0],
-            'new_node',
+            variables['other'],
+            new_node,
+            variables['empty'],
         ])
         mock_URLVarNode.assert_called_once_with('spam', 'restrict')
 
-    @mock.patch.object(urltree, 'URLVarNode', return_value='new_node')
-    def test_get_var_child_noexist_withemptyrestrict(self, mock_URLVarNode):
+    def test_order_defaults(self):
         node = urltree.URLNode()
-        defaults = [
-            mock.Mock(_restrict='other'),
-            mock.Mock(_restrict=None),
-        ]
-        node._defaults = defaults[:]
+        node._variables = dict(
+            var1=mock.Mock(_restrict=None),
+            var2=mock.Mock(_restrict='restrict2'),
+            var3=mock.Mock(_restrict='restrict3'),
+        )
 
-        child = node._get_var_child('spam', 'restrict')
+        node._order_defaults()
 
-        self.assertEqual(child, 'new_node')
-        self.assertEqual(node._variables, dict(spam='new_node'))
         self.assertEqual(node._defaults, [
-            defaults[0],
-            'new_node',
-            defaults[1],
+            node._variables['var2'],
+            node._variables['var3'],
+            node._variables['var1'],
         ])
-        mock_URLVarNode.assert_called_once_with('spam', 'restrict')
+
+    @mock.patch.object(urltree, 'URLTemplateNode')
+    def test_get_template_child_exists(self, mock_URLTemplateNode):
+        node = urltree.URLNode()
+        node._templates[(('', '.txt'), ('restrict',))] = mock.Mock(
+            _names=('spam',))
+
+        child = node._get_template_child(['', 'spam', '.txt'], ['restrict'])
+
+        self.assertEqual(child,
+                         node._templates[(('', '.txt'), ('restrict',))])
+        self.assertFalse(mock_URLTemplateNode.called)
+
+    @mock.patch.object(urltree, 'URLTemplateNode')
+    def test_get_template_child_exists_badname(self, mock_URLTemplateNode):
+        node = urltree.URLNode()
+        node._templates[(('', '.txt'), ('restrict',))] = mock.Mock(
+            _names=('spam',))
+
+        self.assertRaises(NameError, node._get_template_child,
+                          ['', 'other', '.txt'], ['restrict'])
+
+        self.assertFalse(mock_URLTemplateNode.called)
+
+    @mock.patch.object(urltree, 'URLTemplateNode')
+    def test_get_template_child_exists_badrestrict(self,
+                                                   mock_URLTemplateNode):
+        node = urltree.URLNode()
+        node._templates[(('', '.txt'), ('restrict',))] = mock.Mock(
+            _names=('spam',))
+
+        self.assertRaises(NameError, node._get_template_child,
+                          ['', 'spam', '.txt'], ['other'])
+
+        self.assertFalse(mock_URLTemplateNode.called)
+
+    def test_get_template_child_noexist(self):
+        node = urltree.URLNode()
+        partials = [
+            mock.Mock(_fixed=5),
+            mock.Mock(_fixed=4),
+            mock.Mock(_fixed=2),
+        ]
+        node._partials = partials[:]
+        new_node = mock.Mock(_fixed=4)
+
+        with mock.patch.object(urltree, 'URLTemplateNode',
+                               return_value=new_node) as mock_URLTemplateNode:
+            child = node._get_template_child(['', 'spam', '.txt'],
+                                             ['restrict'])
+
+        self.assertEqual(child, new_node)
+        self.assertEqual(node._templates,
+                         {(('', '.txt'), ('restrict',)): new_node})
+        self.assertEqual(node._partials, [
+            partials[0],
+            partials[1],
+            new_node,
+            partials[2],
+        ])
+        mock_URLTemplateNode.assert_called_once_with(
+            ['', 'spam', '.txt'], ('restrict',))
+
+    @mock.patch.object(urltree, 'URLTailNode', return_value='new_node')
+    def test_get_tail_child_noexist(self, mock_URLTailNode):
+        node = urltree.URLNode()
+
+        child = node._get_tail_child('spam', 'restrict')
+
+        self.assertEqual(child, 'new_node')
+        self.assertEqual(node._tail, 'new_node')
+        mock_URLTailNode.assert_called_once_with('spam', 'restrict')
+
+    @mock.patch.object(urltree, 'URLTailNode')
+    def test_get_tail_child_exists(self, mock_URLTailNode):
+        node = urltree.URLNode()
+        node._tail = mock.Mock(_name='spam', _restrict='restrict')
+
+        child = node._get_tail_child('spam', 'restrict')
+
+        self.assertEqual(child, node._tail)
+        self.assertFalse(mock_URLTailNode.called)
+
+    @mock.patch.object(urltree, 'URLTailNode')
+    def test_get_tail_child_exists_badname(self, mock_URLTailNode):
+        node = urltree.URLNode()
+        node._tail = mock.Mock(_name='spam', _restrict='restrict')
+
+        self.assertRaises(NameError, node._get_tail_child, 'other',
+                          'restrict')
+
+        self.assertFalse(mock_URLTailNode.called)
+
+    @mock.patch.object(urltree, 'URLTailNode')
+    def test_get_tail_child_exists_badrestrict(self, mock_URLTailNode):
+        node = urltree.URLNode()
+        node._tail = mock.Mock(_name='spam', _restrict='restrict')
+
+        self.assertRaises(NameError, node._get_tail_child, 'spam', 'other')
+
+        self.assertFalse(mock_URLTailNode.called)
+
+    def _var_nodes(self, node, *specs):
+        for name, restrict, hits in specs:
+            child = node._get_var_child(name, restrict)
+            child._hits = hits
+        return [node._variables[spec[0]] for spec in specs]
+
+    def test_optimize(self):
+        node = urltree.URLNode()
+        nodes = self._var_nodes(node, ('a', '(x|y)', 1), ('b', int, 5),
+                                ('c', None, 10), ('d', '[a-z]+', 3))
+
+        result = node._optimize()
+
+        # d overlaps a, so it can't be moved ahead of it
+        self.assertEqual(result, True)
+        self.assertEqual(node._defaults, [nodes[1], nodes[0], nodes[3],
+                                          nodes[2]])
+        self.assertEqual(list(node._variables.values()), node._defaults)
+
+    def test_optimize_overlap(self):
+        node = urltree.URLNode()
+        nodes = self._var_nodes(node, ('a', '(x|y)', 1), ('b', '[a-z]+', 2),
+                                ('c', int, 5))
+
+        result = node._optimize()
+
+        # b overlaps a, so it can't go ahead of it, but c can go first
+        self.assertEqual(result, True)
+        self.assertEqual(node._defaults, [nodes[2], nodes[0], nodes[1]])
+
+    def test_optimize_memoize(self):
+        node = urltree.URLNode()
+        nodes = self._var_nodes(node, ('a', '(x|y)', 1),
+                                ('b', urltree.Memoize(int), 5))
+
+        result = node._optimize()
+
+        self.assertEqual(result, True)
+        self.assertEqual(node._defaults, [nodes[1], nodes[0]])
+
+    def test_optimize_unknown(self):
+        node = urltree.URLNode()
+        nodes = self._var_nodes(node, ('a', float, 1), ('b', int, 5))
+
+        result = node._optimize()
+
+        self.assertEqual(result, False)
+        self.assertEqual(node._defaults, nodes)
+
+    def test_optimize_unchanged(self):
+        node = urltree.URLNode()
+        nodes = self._var_nodes(node, ('a', int, 5), ('b', '(x|y)', 5))
+
+        result = node._optimize()
+
+        self.assertEqual(result, False)
+        self.assertEqual(node._defaults, nodes)
+
+    def test_optimize_single(self):
+        node = urltree.URLNode()
+        self._var_nodes(node, ('a', int, 5), ('b', None, 10))
+
+        self.assertEqual(node._optimize(), False)
+
+    def test_descendants(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}/{path:*}', 'dest')
+        tree.route('/elem2/{name}.{ext}', 'dest')
+        elem1 = tree._children['elem1']
+        var = elem1._variables['var']
+        elem2 = tree._children['elem2']
+
+        result = list(tree._descendants())
+
+        self.assertEqual(len(result), 6)
+        self.assertEqual(set(result), set([
+            tree, elem1, var, var._tail, elem2, elem2._partials[0],
+        ]))
 
     def test_get_child_exists(self):
         node = urltree.URLNode()
@@ -188,6 +822,15 @@ class TestURLNode(unittest2.TestCase):
         self.assertEqual(result, 'fakechild')
         self.assertFalse(mock_URLNode.called)
 
+    def test_get_child_interned(self):
+        node = urltree.URLNode()
+        elem = ''.join(['sp', 'am'])
+
+        node._get_child(elem)
+
+        key = list(node._children.keys())[0]
+        self.assertTrue(key is sys.intern('spam'))
+
     def test_get_child_noexist(self):
         node = urltree.URLNode()
 
@@ -196,8 +839,94 @@ class TestURLNode(unittest2.TestCase):
             result = node._get_child('spam')
 
         self.assertEqual(result, 'fakechild')
+        self.assertEqual(node._bchildren, {b'spam': 'fakechild'})
         mock_URLNode.assert_called_once_with()
 
+    def test_get_pred_dests(self):
+        node = urltree.URLNode()
+
+        result1 = node._get_pred_dests(urltree.Query('format', 'json'))
+        result2 = node._get_pred_dests(urltree.Header('format', 'json'))
+        result3 = node._get_pred_dests(urltree.Query('format', 'xml'))
+
+        self.assertEqual(len(node._preds), 2)
+        self.assertEqual(node._preds[0].kind, 'query')
+        self.assertEqual(node._preds[0].values, dict(json=result1,
+                                                     xml=result3))
+        self.assertEqual(node._preds[1].kind, 'header')
+        self.assertEqual(node._preds[1].values, dict(json=result2))
+
+    def test_has_dest(self):
+        node = urltree.URLNode()
+
+        self.assertEqual(node._has_dest(), False)
+
+        node._dest['GET'] = 'dest'
+        self.assertEqual(node._has_dest(), True)
+
+    def test_has_dest_default(self):
+        node = urltree.URLNode()
+        node._dest.default = 'dest'
+
+        self.assertEqual(node._has_dest(), True)
+
+    def test_has_dest_preds(self):
+        node = urltree.URLNode()
+        node._get_pred_dests(urltree.Query('format'))
+
+        self.assertEqual(node._has_dest(), True)
+
+    def test_allowed(self):
+        node = urltree.URLNode()
+        node._dest['PUT'] = 'dest'
+        node._dest['GET'] = 'dest'
+        node._dest['POST'] = None
+        node._dest['WEBSOCKET'] = 'dest'
+
+        self.assertEqual(node._allowed(), ['GET', 'PUT'])
+
+    @mock.patch.object(urltree, 'parse_qsl')
+    def test_select_nopreds(self, mock_parse_qsl):
+        node = urltree.URLNode()
+        node._dest['GET'] = 'dest'
+
+        result = node._select('GET', 'format=json', None, None)
+
+        self.assertEqual(result, 'dest')
+        self.assertFalse(mock_parse_qsl.called)
+
+    def test_select_query(self):
+        node = urltree.URLNode()
+        node._dest['GET'] = 'dest'
+        node._get_pred_dests(urltree.Query('format', 'json'))['GET'] = 'json'
+        node._get_pred_dests(urltree.Query('format')).default = 'format'
+
+        self.assertEqual(node._select('GET', 'format=json&format=xml',
+                                      None, None), 'json')
+        self.assertEqual(node._select('GET', 'format=xml', None, None),
+                         'format')
+        self.assertEqual(node._select('POST', 'format=json', None, None),
+                         'format')
+        self.assertEqual(node._select('GET', 'other=json', None, None),
+                         'dest')
+        self.assertEqual(node._select('GET', None, None, None), 'dest')
+
+    def test_select_header(self):
+        node = urltree.URLNode()
+        node._get_pred_dests(urltree.Header('X-Version', '2'))['GET'] = 'v2'
+        get_header = mock.Mock(side_effect=lambda h, n: h.get(n))
+
+        self.assertEqual(node._select('GET', None, {'x-version': '2'},
+                                      get_header), 'v2')
+        self.assertEqual(node._select('GET', None, {'x-version': '1'},
+                                      get_header), None)
+        self.assertEqual(node._select('GET', None, None, get_header), None)
+        get_header.assert_has_calls([
+            mock.call({'x-version': '2'}, 'x-version'),
+            mock.call({'x-version': '1'}, 'x-version'),
+        ])
+        self.assertEqual(get_header.call_count, 2)
+
     def test_resolve_child_exact_match(self):
         node = urltree.URLNode()
         child = mock.Mock(**{'_match.return_value': True})
@@ -248,6 +977,23 @@ class TestURLNode(unittest2.TestCase):
         node._defaults[1]._match.assert_called_once_with('spam', 'params')
         node._defaults[2]._match.assert_called_once_with('spam', 'params')
 
+    def test_resolve_child_partial_match(self):
+        node = urltree.URLNode()
+        node._partials = [
+            mock.Mock(**{'_match.return_value': False}),
+            mock.Mock(**{'_match.return_value': True}),
+        ]
+        node._defaults = [
+            mock.Mock(**{'_match.return_value': True}),
+        ]
+
+        result = node._resolve_child('spam', 'params')
+
+        self.assertEqual(result, node._partials[1])
+        node._partials[0]._match.assert_called_once_with('spam', 'params')
+        node._partials[1]._match.assert_called_once_with('spam', 'params')
+        self.assertFalse(node._defaults[0]._match.called)
+
     def test_resolve_child_full(self):
         node = urltree.URLNode()
         node._defaults = [
@@ -265,6 +1011,59 @@ class TestURLNode(unittest2.TestCase):
         node._defaults[1]._match.assert_called_once_with('spam', 'params')
         self.assertFalse(node._defaults[2]._match.called)
 
+    def test_resolve_child_bytes_exact(self):
+        node = urltree.URLNode()
+        node._bchildren[b'spam'] = 'child'
+        node._partials = [mock.Mock()]
+
+        result = node._resolve_child_bytes(b'spam', 'params')
+
+        self.assertEqual(result, 'child')
+        self.assertFalse(node._partials[0]._match_bytes.called)
+
+    def test_resolve_child_bytes_partial(self):
+        node = urltree.URLNode()
+        node._partials = [
+            mock.Mock(**{'_match_bytes.return_value': False}),
+            mock.Mock(**{'_match_bytes.return_value': True}),
+        ]
+        node._defaults = [mock.Mock()]
+
+        result = node._resolve_child_bytes(b'spam', 'params')
+
+        self.assertEqual(result, node._partials[1])
+        node._partials[0]._match_bytes.assert_called_once_with(b'spam',
+                                                               'params')
+        self.assertFalse(node._defaults[0]._match_bytes.called)
+
+    def test_resolve_child_bytes_default(self):
+        node = urltree.URLNode()
+        node._defaults = [
+            mock.Mock(**{'_match_bytes.return_value': False}),
+            mock.Mock(**{'_match_bytes.return_value': True}),
+        ]
+
+        result = node._resolve_child_bytes(b'spam', 'params')
+
+        self.assertEqual(result, node._defaults[1])
+
+    def test_resolve_child_bytes_mismatch(self):
+        node = urltree.URLNode()
+        node._defaults = [
+            mock.Mock(**{'_match_bytes.return_value': False}),
+        ]
+
+        result = node._resolve_child_bytes(b'spam', 'params')
+
+        self.assertEqual(result, None)
+
+    def test_match_bytes(self):
+        node = urltree.URLNode()
+
+        result = node._match_bytes(b'elem', 'params')
+
+        self.assertEqual(result, True)
+
     def test_match(self):
         node = urltree.URLNode()
 
@@ -273,7 +1072,7 @@ class TestURLNode(unittest2.TestCase):
         self.assertEqual(result, True)
 
 
-class TestURLVarNode(unittest2.TestCase):
+class TestURLVarNode(unittest.TestCase):
     @mock.patch('re.compile', return_value='compiled_pattern')
     def test_init_restrict_none(self, mock_compile):
         node = urltree.URLVarNode('spam', None)
@@ -293,79 +1092,330 @@ class TestURLVarNode(unittest2.TestCase):
         self.assertEqual(node._pattern, None)
         self.assertFalse(mock_compile.called)
 
-    @mock.patch('re.compile', return_value='compiled_pattern')
-    def test_init_restrict_string_unanchored(self, mock_compile):
-        node = urltree.URLVarNode('spam', 'pattern')
+    @mock.patch('re.compile', return_value='compiled_pattern')
+    def test_init_restrict_string_unanchored(self, mock_compile):
+        node = urltree.URLVarNode('spam', 'pattern')
+
+        self.assertEqual(node._name, 'spam')
+        self.assertEqual(node._restrict, 'pattern')
+        self.assertEqual(node._pattern, 'compiled_pattern')
+        self.assertEqual(node._bpattern, 'compiled_pattern')
+        mock_compile.assert_has_calls([mock.call('pattern$'),
+                                       mock.call(b'pattern$')])
+
+    @mock.patch('re.compile', return_value='compiled_pattern')
+    def test_init_restrict_string_anchored(self, mock_compile):
+        node = urltree.URLVarNode('spam', 'pattern$')
+
+        self.assertEqual(node._name, 'spam')
+        self.assertEqual(node._restrict, 'pattern$')
+        self.assertEqual(node._pattern, 'compiled_pattern')
+        self.assertEqual(node._bpattern, 'compiled_pattern')
+        mock_compile.assert_has_calls([mock.call('pattern$'),
+                                       mock.call(b'pattern$')])
+
+    def test_match_restrict_none(self):
+        node = urltree.URLVarNode('spam', None)
+        params = {}
+
+        result = node._match('element', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(spam='element'))
+
+    def test_match_restrict_pattern_mismatch(self):
+        node = urltree.URLVarNode('spam', None)
+        node._pattern = mock.Mock(**{'match.return_value': None})
+        params = {}
+
+        result = node._match('element', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+        node._pattern.match.assert_called_once_with('element')
+
+    def test_match_restrict_pattern_match(self):
+        node = urltree.URLVarNode('spam', None)
+        node._pattern = mock.Mock(**{'match.return_value': 'match obj'})
+        params = {}
+
+        result = node._match('element', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(spam='match obj'))
+        node._pattern.match.assert_called_once_with('element')
+
+    def test_match_restrict_callable_mismatch(self):
+        node = urltree.URLVarNode('spam', None)
+        node._restrict = mock.Mock(side_effect=ValueError)
+        params = {}
+
+        result = node._match('element', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+        node._restrict.assert_called_once_with('element')
+
+    def test_match_restrict_callable_match(self):
+        node = urltree.URLVarNode('spam', None)
+        node._restrict = mock.Mock(return_value='result')
+        params = {}
+
+        result = node._match('element', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(spam='result'))
+        node._restrict.assert_called_once_with('element')
+
+
+class TestURLVarNodeBytes(unittest.TestCase):
+    def test_match_bytes_restrict_none(self):
+        node = urltree.URLVarNode('spam', None)
+        params = {}
+
+        result = node._match_bytes(b'sp\xc3\xa4m', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(spam='sp\xe4m'))
+
+    def test_match_bytes_undecodable(self):
+        node = urltree.URLVarNode('spam', None)
+        params = {}
+
+        result = node._match_bytes(b'sp\xffm', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+
+    def test_match_bytes_pattern(self):
+        node = urltree.URLVarNode('spam', r'([0-9]+)')
+        params = {}
+
+        result = node._match_bytes(b'1234', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params['spam'].group(1), '1234')
+        self.assertEqual(node._bpattern.pattern, b'([0-9]+)$')
+
+    def test_match_bytes_pattern_non_ascii(self):
+        node = urltree.URLVarNode('spam', r'[a-z]+')
+        params = {}
+
+        result = node._match_bytes(b'caf\xc3\xa9', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+
+    def test_match_bytes_pattern_text(self):
+        for pattern in (r'\w+', '.{4}', '(?u)caf.', '[^/]{4}', 'caf\xe9'):
+            node = urltree.URLVarNode('spam', pattern)
+            params = {}
+
+            result = node._match_bytes(b'caf\xc3\xa9', params)
+
+            self.assertEqual(node._bpattern, None)
+            self.assertEqual(result, True)
+            self.assertEqual(params['spam'].group(0), 'caf\xe9')
+
+    def test_match_bytes_pattern_text_undecodable(self):
+        node = urltree.URLVarNode('spam', r'\w+')
+        params = {}
+
+        result = node._match_bytes(b'caf\xff', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+
+    def test_match_bytes_pattern_mismatch(self):
+        node = urltree.URLVarNode('spam', r'([0-9]+)')
+        params = {}
+
+        result = node._match_bytes(b'abc', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+
+    def test_match_bytes_callable(self):
+        node = urltree.URLVarNode('spam', None)
+        node._restrict = mock.Mock(return_value='result')
+        params = {}
+
+        result = node._match_bytes(b'element', params)
+
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(spam='result'))
+        node._restrict.assert_called_once_with('element')
+
+    def test_match_bytes_callable_mismatch(self):
+        node = urltree.URLVarNode('spam', None)
+        node._restrict = mock.Mock(side_effect=ValueError)
+        params = {}
+
+        result = node._match_bytes(b'element', params)
+
+        self.assertEqual(result, False)
+        self.assertEqual(params, {})
+
+
+class TestURLTemplateNode(unittest.TestCase):
+    def test_init_single(self):
+        node = urltree.URLTemplateNode(['v', 'version', ''], (int,))
+
+        self.assertEqual(node._restricts, (int,))
+        self.assertEqual(node._prefix, 'v')
+        self.assertEqual(node._suffix, '')
+        self.assertEqual(node._fixed, 1)
+        self.assertEqual(node._minlen, 2)
+        self.assertEqual(len(node._vars), 1)
+        self.assertEqual(node._vars[0]._name, 'version')
+        self.assertEqual(node._vars[0]._restrict, int)
+        self.assertEqual(node._regex, None)
+
+    def test_init_multiple(self):
+        node = urltree.URLTemplateNode(['f-', 'name', '.', 'ext', ''],
+                                       (None, None))
+
+        self.assertEqual(node._prefix, 'f-')
+        self.assertEqual(node._suffix, '')
+        self.assertEqual(node._fixed, 3)
+        self.assertEqual(node._minlen, 5)
+        self.assertEqual([var._name for var in node._vars], ['name', 'ext'])
+        self.assertEqual(node._regex.pattern, r'f\-(.+)\.(.+)$')
+
+    def test_match_single(self):
+        node = urltree.URLTemplateNode(['v', 'version', '.json'], (int,))
+        params = {}
+
+        result = node._match('v12.json', params)
 
-        self.assertEqual(node._name, 'spam')
-        self.assertEqual(node._restrict, 'pattern')
-        self.assertEqual(node._pattern, 'compiled_pattern')
-        mock_compile.assert_called_once_with('pattern$')
+        self.assertEqual(result, True)
+        self.assertEqual(params, dict(version=12))
 
-    @mock.patch('re.compile', return_value='compiled_pattern')
-    def test_init_restrict_string_anchored(self, mock_compile):
-        node = urltree.URLVarNode('spam', 'pattern$')
+    def test_match_single_mismatch(self):
+        node = urltree.URLTemplateNode(['v', 'version', '.json'], (int,))
 
-        self.assertEqual(node._name, 'spam')
-        self.assertEqual(node._restrict, 'pattern$')
-        self.assertEqual(node._pattern, 'compiled_pattern')
-        mock_compile.assert_called_once_with('pattern$')
+        for elem in ('v.json', 'x12.json', 'v12.xml', 'vx.json'):
+            params = {}
 
-    def test_match_restrict_none(self):
-        node = urltree.URLVarNode('spam', None)
+            result = node._match(elem, params)
+
+            self.assertEqual(result, False)
+            self.assertEqual(params, {})
+
+    def test_match_bytes(self):
+        node = urltree.URLTemplateNode(['v', 'version', '.json'], (int,))
         params = {}
 
-        result = node._match('element', params)
+        result = node._match_bytes(b'v12.json', params)
 
         self.assertEqual(result, True)
-        self.assertEqual(params, dict(spam='element'))
+        self.assertEqual(params, dict(version=12))
 
-    def test_match_restrict_pattern_mismatch(self):
-        node = urltree.URLVarNode('spam', None)
-        node._pattern = mock.Mock(**{'match.return_value': None})
+    def test_match_bytes_undecodable(self):
+        node = urltree.URLTemplateNode(['v', 'version', '.json'], (None,))
         params = {}
 
-        result = node._match('element', params)
+        result = node._match_bytes(b'v\xff.json', params)
 
         self.assertEqual(result, False)
         self.assertEqual(params, {})
-        node._pattern.match.assert_called_once_with('element')
 
-    def test_match_restrict_pattern_match(self):
-        node = urltree.URLVarNode('spam', None)
-        node._pattern = mock.Mock(**{'match.return_value': 'match obj'})
+    def test_match_multiple(self):
+        node = urltree.URLTemplateNode(['', 'name', '.', 'ext', ''],
+                                       (None, None))
         params = {}
 
-        result = node._match('element', params)
+        result = node._match('archive.tar.gz', params)
 
         self.assertEqual(result, True)
-        self.assertEqual(params, dict(spam='match obj'))
-        node._pattern.match.assert_called_once_with('element')
+        self.assertEqual(params, dict(name='archive.tar', ext='gz'))
 
-    def test_match_restrict_callable_mismatch(self):
-        node = urltree.URLVarNode('spam', None)
-        node._restrict = mock.Mock(side_effect=ValueError)
+    def test_match_multiple_mismatch(self):
+        node = urltree.URLTemplateNode(['', 'name', '.', 'ext', ''],
+                                       (None, int))
         params = {}
 
-        result = node._match('element', params)
+        result = node._match('archive.tar', params)
 
         self.assertEqual(result, False)
         self.assertEqual(params, {})
-        node._restrict.assert_called_once_with('element')
 
-    def test_match_restrict_callable_match(self):
-        node = urltree.URLVarNode('spam', None)
-        node._restrict = mock.Mock(return_value='result')
-        params = {}
 
-        result = node._match('element', params)
+class TestURLTree(unittest.TestCase):
+    def test_init(self):
+        tree = urltree.URLTree()
 
-        self.assertEqual(result, True)
-        self.assertEqual(params, dict(spam='result'))
-        node._restrict.assert_called_once_with('element')
+        self.assertEqual(tree._normalize, False)
+        self.assertEqual(tree._stats, False)
+        self.assertEqual(tree.reject_cache, 0)
+        self.assertEqual(tree._rejected, {})
+        self.assertEqual(tree._rejects, dict(unresolved=0, cached=0))
+        self.assertEqual(tree._vhosts, {})
+        self.assertEqual(tree._version, 0)
+        self.assertEqual(tree._routes, [])
+        self.assertEqual(tree._dest_routes, {})
+        self.assertEqual(tree._dest_id_routes, {})
+        self.assertEqual(tree._node_routes, {})
+
+    def test_init_normalize(self):
+        tree = urltree.URLTree(True)
+
+        self.assertEqual(tree._normalize, True)
+
+    def test_get_root_self(self):
+        tree = urltree.URLTree()
+
+        self.assertEqual(tree._get_root(None, None), tree)
+        self.assertEqual(tree._get_root('*', '*'), tree)
+        self.assertEqual(tree._vhosts, {})
+
+    def test_get_root_vhost(self):
+        tree = urltree.URLTree()
+
+        root1 = tree._get_root('HTTPS', 'Example.com:443')
+        root2 = tree._get_root('https', 'example.com')
+        root3 = tree._get_root('*', '*.example.com')
+
+        self.assertEqual(root1, root2)
+        self.assertTrue(isinstance(root1, urltree.URLNode))
+        self.assertEqual(tree._vhosts, {
+            ('https', 'example.com'): root1,
+            (None, '*.example.com'): root3,
+        })
+
+    def test_get_root_badhost(self):
+        tree = urltree.URLTree()
+
+        for host in ('a*.example.com', 'a.*.example.com', '*example.com'):
+            self.assertRaises(ValueError, tree._get_root, None, host)
+
+    def test_vhost_roots(self):
+        tree = urltree.URLTree()
+        tree._vhosts = {
+            ('https', 'a.example.com'): 'exact_https',
+            (None, 'a.example.com'): 'exact_any',
+            (None, '*.example.com'): 'wild_any',
+            ('https', '*.com'): 'wild_https',
+            ('https', None): 'https',
+            ('http', None): 'http',
+        }
+
+        result = list(tree._vhost_roots('HTTPS', 'A.example.com:443'))
+
+        self.assertEqual(result, ['exact_https', 'exact_any', 'wild_any',
+                                  'wild_https', 'https'])
+
+    def test_vhost_roots_nohost(self):
+        tree = urltree.URLTree()
+        tree._vhosts = {
+            (None, 'a.example.com'): 'exact_any',
+            ('http', None): 'http',
+        }
 
+        result = list(tree._vhost_roots('http', None))
+
+        self.assertEqual(result, ['http'])
 
-class TestURLTree(unittest2.TestCase):
     def test_route_noargs(self):
         tree = urltree.URLTree()
 
@@ -382,6 +1432,7 @@ class TestURLTree(unittest2.TestCase):
         result = tree.route('/', 'dest')
 
         self.assertEqual(result, set())
+        self.assertEqual(tree._version, 1)
         self.assertEqual(tree._dest, {})
         self.assertEqual(tree._dest.default, 'dest')
 
@@ -490,6 +1541,178 @@ class TestURLTree(unittest2.TestCase):
         self.assertEqual(var3._children, {})
         self.assertEqual(var3._variables, {})
 
+    def test_route_tail(self):
+        tree = urltree.URLTree()
+
+        result = tree.route('/elem1/{path:*}', 'dest', 'get')
+
+        self.assertEqual(result, set(['path']))
+        elem1 = tree._children['elem1']
+        self.assertEqual(elem1._variables, {})
+        self.assertEqual(elem1._defaults, [])
+        self.assertTrue(isinstance(elem1._tail, urltree.URLTailNode))
+        self.assertEqual(elem1._tail._name, 'path')
+        self.assertEqual(elem1._tail._dest, dict(GET='dest'))
+
+    def test_route_tail_notlast(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(ValueError, tree.route,
+                          '/elem1/{path:*}/elem2', 'dest')
+
+    def test_route_tail_duplicates(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(NameError, tree.route,
+                          '/{path}/{path:*}', 'dest')
+
+    def test_route_partial(self):
+        tree = urltree.URLTree()
+
+        result1 = tree.route('/files/{name}.{ext}', 'dest1', 'get')
+        result2 = tree.route('/files/{name}.{ext}/{rev}', 'dest2', 'get')
+
+        self.assertEqual(result1, set(['name', 'ext']))
+        self.assertEqual(result2, set(['name', 'ext', 'rev']))
+        files = tree._children['files']
+        self.assertEqual(files._variables, {})
+        self.assertEqual(list(files._templates.keys()),
+                         [(('', '.', ''), (None, None))])
+        template = files._templates[(('', '.', ''), (None, None))]
+        self.assertEqual(template._names, ('name', 'ext'))
+        self.assertEqual(files._partials, [template])
+        self.assertEqual(template._dest, dict(GET='dest1'))
+        self.assertTrue('rev' in template._variables)
+
+    def test_route_partial_name_mismatch(self):
+        tree = urltree.URLTree()
+        tree.route('/f/{a}.{b}', 'one')
+
+        self.assertRaises(NameError, tree.route, '/f/{c}.{d}', 'two')
+        self.assertEqual(tree.resolve('GET', '/f/x.y'),
+                         ('one', dict(a='x', b='y')))
+
+    def test_route_partial_restricts(self):
+        tree = urltree.URLTree()
+        tree.route('/f/{a}.{b}', 'one', a=int)
+        tree.route('/f/{c}.{d}', 'two')
+
+        self.assertEqual(tree.resolve('GET', '/f/1.y'),
+                         ('one', dict(a=1, b='y')))
+        self.assertEqual(tree.resolve('GET', '/f/x.y'),
+                         ('two', dict(c='x', d='y')))
+
+    def test_route_partial_duplicates(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(NameError, tree.route, '/{name}/{name}.txt', 'dest')
+
+    def test_route_partial_adjacent(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(ValueError, tree.route, '/{name}{ext}', 'dest')
+
+    def test_route_partial_tail(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(ValueError, tree.route, '/x{path:*}', 'dest')
+
+    def test_route_predicate(self):
+        tree = urltree.URLTree()
+
+        tree.route('/elem1', 'dest', 'get', urltree.Query('format', 'json'))
+
+        elem1 = tree._children['elem1']
+        self.assertEqual(elem1._dest, {})
+        self.assertEqual(elem1._dest.default, None)
+        self.assertEqual(len(elem1._preds), 1)
+        self.assertEqual(elem1._preds[0].values['json'], dict(GET='dest'))
+
+    def test_route_predicate_default(self):
+        tree = urltree.URLTree()
+
+        tree.route('/elem1', 'dest', urltree.Query('format', 'json'))
+
+        elem1 = tree._children['elem1']
+        self.assertEqual(elem1._preds[0].values['json'].default, 'dest')
+
+    def test_route_predicate_multiple(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(TypeError, tree.route, '/elem1', 'dest',
+                          urltree.Query('format'), urltree.Header('accept'))
+
+    def test_route_registry(self):
+        tree = urltree.URLTree()
+        pred = urltree.Query('format', 'json')
+
+        tree.route('/elem1/{var1}', 'dest1', 'get', 'put', var1=int,
+                   var2=int)
+        tree.route('/elem2/{var2}', 'dest2', pred)
+
+        self.assertEqual(list(tree.routes()), [
+            urltree.Route('/elem1/{var1}', 'dest1', ('GET', 'PUT'), None,
+                          dict(var1=int)),
+            urltree.Route('/elem2/{var2}', 'dest2', None, pred, {}),
+        ])
+        node = tree._children['elem1']._variables['var1']
+        self.assertEqual(tree._node_routes[id(node)],
+                         [tree._routes[0]])
+
+    def test_route_registry_failure(self):
+        tree = urltree.URLTree()
+
+        self.assertRaises(NameError, tree.route, '/{var}/{var}', 'dest')
+
+        self.assertEqual(tree._routes, [])
+
+    def test_patterns_for(self):
+        tree = urltree.URLTree()
+        dest = {'unhashable': True}
+        tree.route('/elem1', 'dest1', 'get')
+        tree.route('/elem2', dest, 'get')
+        tree.route('/elem3', 'dest1', 'put')
+        tree.route('/elem3', dest, 'get')
+
+        self.assertEqual(tree.patterns_for('dest1'), ['/elem1', '/elem3'])
+        self.assertEqual(tree.patterns_for(dest), ['/elem2', '/elem3'])
+        self.assertEqual(tree.patterns_for({'unhashable': True}), [])
+        self.assertEqual(tree.patterns_for('other'), [])
+
+    def test_export(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}', 'dest1', 'get', var=int)
+        tree.route('https://*.example.com/elem2', urltree.URLTree,
+                   urltree.Header('X-Version', '2'))
+        stream = io.StringIO()
+
+        with mock.patch.object(tree, '_walk') as mock_walk:
+            result = tree.export(stream)
+
+        self.assertEqual(result, 2)
+        self.assertFalse(mock_walk.called)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {
+                'pattern': '/elem1/{var}',
+                'dest': 'dest1',
+                'methods': ['GET'],
+                'predicate': None,
+                'restrictions': {'var': 'builtins:int'},
+            },
+            {
+                'pattern': 'https://*.example.com/elem2',
+                'dest': 'urltree:URLTree',
+                'methods': None,
+                'predicate': {
+                    'kind': 'header',
+                    'name': 'x-version',
+                    'value': '2',
+                },
+                'restrictions': {},
+            },
+        ])
+
     def test_resolve_exact_dest(self):
         tree = urltree.URLTree()
         tree.route('/elem1/elem2', 'dest', 'get')
@@ -526,6 +1749,21 @@ class TestURLTree(unittest2.TestCase):
         self.assertEqual(dest, None)
         self.assertEqual(params, None)
 
+    def test_resolve_plain_path(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}', 'dest', 'get', var=int)
+
+        with mock.patch.object(tree, '_resolve') as mock_resolve:
+            result1 = tree.resolve('get', '/elem1/5//elem2/?q=1')
+            result2 = tree.resolve('get', '/elem2')
+            result3 = tree.resolve('put', '/elem1/5')
+
+        self.assertEqual(result1, ('dest', dict(var=5, path_info='elem2')))
+        self.assertEqual(result2, (None, None))
+        self.assertEqual(result3, (None, None))
+        self.assertFalse(mock_resolve.called)
+        self.assertEqual(tree.rejects()['unresolved'], 1)
+
     def test_resolve_root_noroute(self):
         tree = urltree.URLTree()
 
@@ -551,3 +1789,625 @@ class TestURLTree(unittest2.TestCase):
 
         self.assertEqual(dest, 'dest')
         self.assertEqual(params, dict(path_info='elem1/elem2'))
+
+    def test_resolve_tail(self):
+        tree = urltree.URLTree()
+        tree.route('/bucket/{key:*}', 'dest', 'get')
+
+        dest, params = tree.resolve('get', '/bucket/a//b/c.txt/')
+
+        self.assertEqual(dest, 'dest')
+        self.assertEqual(params, dict(key='a//b/c.txt/'))
+
+    def test_resolve_tail_restricted(self):
+        tree = urltree.URLTree()
+        tree.route('/bucket/{key:*}', 'dest', 'get', key=r'.*\.txt')
+
+        dest1, params1 = tree.resolve('get', '/bucket/a/b.txt')
+        dest2, params2 = tree.resolve('get', '/bucket/a/b.png')
+
+        self.assertEqual(dest1, 'dest')
+        self.assertEqual(params1['key'].group(0), 'a/b.txt')
+        self.assertEqual(dest2, None)
+        self.assertEqual(params2, None)
+
+    def test_resolve_tail_priority(self):
+        tree = urltree.URLTree()
+        tree.route('/bucket/{key:*}', 'tail', 'get')
+        tree.route('/bucket/{name}', 'var', 'get', name=int)
+
+        dest1, params1 = tree.resolve('get', '/bucket/123')
+        dest2, params2 = tree.resolve('get', '/bucket/abc/def')
+
+        self.assertEqual(dest1, 'var')
+        self.assertEqual(params1, dict(name=123))
+        self.assertEqual(dest2, 'tail')
+        self.assertEqual(params2, dict(key='abc/def'))
+
+    def test_resolve_tail_empty(self):
+        tree = urltree.URLTree()
+        tree.route('/bucket/{key:*}', 'dest', 'get')
+
+        dest, params = tree.resolve('get', '/bucket/')
+
+        self.assertEqual(dest, None)
+        self.assertEqual(params, None)
+
+    def test_resolve_partial(self):
+        tree = urltree.URLTree()
+        tree.route('/v{version}/files/{name}.{ext}', 'dest', 'get',
+                   version=int)
+        tree.route('/v{version}/files/index.html', 'index', 'get',
+                   version=int)
+        tree.route('/v{version}/files/{name}', 'plain', 'get',
+                   version=int)
+
+        dest1, params1 = tree.resolve('get', '/v2/files/report.pdf')
+        dest2, params2 = tree.resolve('get', '/v2/files/index.html')
+        dest3, params3 = tree.resolve('get', '/v2/files/README')
+        dest4, params4 = tree.resolve('get', '/vx/files/README')
+
+        self.assertEqual(dest1, 'dest')
+        self.assertEqual(params1, dict(version=2, name='report', ext='pdf'))
+        self.assertEqual(dest2, 'index')
+        self.assertEqual(params2, dict(version=2))
+        self.assertEqual(dest3, 'plain')
+        self.assertEqual(params3, dict(version=2, name='README'))
+        self.assertEqual(dest4, None)
+        self.assertEqual(params4, None)
+
+    def test_resolve_vhost(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1', 'shared', 'get')
+        tree.route('/elem2', 'shared2', 'get')
+        tree.route('https://*.example.com/elem1', 'wild', 'get')
+        tree.route('*://api.example.com/elem1', 'api', 'get')
+
+        self.assertEqual(tree.resolve('get', '/elem1'), ('shared', {}))
+        self.assertEqual(tree.resolve('get', 'https://x.example.com/elem1'),
+                         ('wild', {}))
+        self.assertEqual(tree.resolve('get', 'http://x.example.com/elem1'),
+                         ('shared', {}))
+        self.assertEqual(tree.resolve('get', 'http://API.example.com/elem1'),
+                         ('api', {}))
+        self.assertEqual(tree.resolve('get', 'https://x.example.com/elem2'),
+                         ('shared2', {}))
+        self.assertEqual(tree.resolve('get', 'https://example.com/elem3'),
+                         (None, None))
+
+    def test_resolve_vhost_partial(self):
+        tree = urltree.URLTree()
+        tree.route('https://api.example.com/', 'vroot')
+        tree.route('https://api.example.com/v1', 'v1')
+        tree.route('/users/{id}', 'users')
+
+        # The shared route consumes the whole path, so it's preferred
+        self.assertEqual(
+            tree.resolve('GET', 'https://api.example.com/users/5'),
+            ('users', dict(id='5')))
+        # Failing that, the virtual host subtree is the last resort
+        self.assertEqual(
+            tree.resolve('GET', 'https://api.example.com/v1/users'),
+            ('v1', dict(path_info='users')))
+        self.assertEqual(
+            tree.resolve('GET', 'https://api.example.com/users'),
+            ('vroot', dict(path_info='users')))
+
+    def test_resolve_vhost_method(self):
+        tree = urltree.URLTree()
+        tree.route('https://api.example.com/users', 'vhost', 'get')
+        tree.route('/users', 'shared', 'post')
+
+        self.assertEqual(tree.resolve('GET', 'https://api.example.com/users'),
+                         ('vhost', {}))
+        self.assertEqual(
+            tree.resolve('POST', 'https://api.example.com/users'),
+            ('shared', {}))
+        self.assertEqual(tree.resolve('PUT', 'https://api.example.com/users'),
+                         (None, None))
+        self.assertEqual(tree.rejects()['unresolved'], 0)
+
+    def test_resolve_vhost_method_not_allowed(self):
+        tree = urltree.URLTree()
+        tree.route('https://api.example.com/users', 'vhost', 'get')
+        tree.route('/other', 'shared')
+
+        node, dest, params, rest = tree._resolve(
+            'POST', 'https', 'api.example.com', '/users', '', None,
+            urltree._mapping_header)
+
+        self.assertEqual(dest, None)
+        self.assertEqual(node._allowed(), ['GET'])
+        self.assertEqual(tree.rejects()['unresolved'], 0)
+
+    def test_resolve_vhost_reject_cache(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('https://api.example.com/users', 'vhost', 'get')
+        tree.route('https://api.example.com/', 'vroot', 'get')
+
+        tree.resolve('POST', 'https://api.example.com/users')
+        tree.resolve('POST', 'https://api.example.com/other')
+        tree.resolve('GET', 'https://www.example.com/users')
+
+        self.assertEqual(list(tree._rejected),
+                         [('https', 'www.example.com', '/users')])
+
+    def test_resolve_predicates(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1', 'plain', 'get')
+        tree.route('/elem1', 'json', 'get', urltree.Query('format', 'json'))
+        tree.route('/elem1', 'v2', 'get', urltree.Header('X-Version', '2'))
+
+        self.assertEqual(tree.resolve('get', '/elem1'), ('plain', {}))
+        self.assertEqual(tree.resolve('get', '/elem1?format=json'),
+                         ('json', {}))
+        self.assertEqual(tree.resolve('get', '/elem1?format=xml'),
+                         ('plain', {}))
+        self.assertEqual(tree.resolve('get', '/elem1',
+                                      {'X-Version': '2'}), ('v2', {}))
+        self.assertEqual(tree.resolve('post', '/elem1?format=json'),
+                         (None, None))
+
+    def test_resolve_bytes(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}', 'dest', 'get')
+        tree.route('/elem1/{var}/{path:*}', 'tail', 'get')
+        tree.route('/elem\xe4', 'other', 'get')
+
+        self.assertEqual(tree.resolve('get', b'/elem1/spam'),
+                         ('dest', dict(var='spam')))
+        self.assertEqual(tree.resolve('get', memoryview(b'/elem1/a/b/')),
+                         ('tail', dict(var='a', path='b/')))
+        self.assertEqual(tree.resolve('get', bytearray(b'/elem\xc3\xa4/x')),
+                         ('other', dict(path_info='x')))
+        self.assertEqual(tree.resolve('get', b'/elem2'), (None, None))
+
+    def test_resolve_bytes_non_ascii(self):
+        tree = urltree.URLTree()
+        tree.route('/w/{x}', 'word', x=r'\w+')
+        tree.route('/f/{x}', 'four', x='.{4}')
+        tree.route('/u/{x}', 'unicode', x='(?u)[a-z]+')
+
+        for prefix, dest in (('w', 'word'), ('f', 'four')):
+            url = '/%s/caf\xe9' % prefix
+            for request in (url, url.encode('utf-8')):
+                result = tree.resolve('get', request)
+
+                self.assertEqual(result[0], dest)
+                self.assertEqual(result[1]['x'].group(0), 'caf\xe9')
+        self.assertEqual(tree.resolve('get', b'/u/caf\xc3\xa9'), (None, None))
+        self.assertEqual(tree.resolve('get', b'/u/cafe')[0], 'unicode')
+
+    def test_resolve_bytes_vhost_query(self):
+        tree = urltree.URLTree()
+        tree.route('https://example.com/elem1', 'dest', 'get',
+                   urltree.Query('format', 'json'))
+
+        self.assertEqual(
+            tree.resolve('get', b'https://example.com/elem1?format=json'),
+            ('dest', {}))
+
+    def test_resolve_normalize(self):
+        tree = urltree.URLTree(normalize=True)
+        tree.route('/elem1/{var}', 'dest', 'get')
+        tree.route('/elem2/{path:*}', 'tail', 'get')
+
+        self.assertEqual(tree.resolve('get', '/elem3/../elem1/a%2Fb'),
+                         ('dest', dict(var='a/b')))
+        self.assertEqual(tree.resolve('get', '/elem1/a/./b%20c/../d'),
+                         ('dest', dict(var='a', path_info='d')))
+        self.assertEqual(tree.resolve('get', '/elem2/x//./y/'),
+                         ('tail', dict(path='x/y')))
+        self.assertEqual(tree.resolve('get', b'/elem1/%C3%A4'),
+                         ('dest', dict(var='\xe4')))
+
+    def test_resolve_no_normalize(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}', 'dest', 'get')
+
+        self.assertEqual(tree.resolve('get', '/elem1/a%2Fb'),
+                         ('dest', dict(var='a%2Fb')))
+        self.assertEqual(tree.resolve('get', '/elem3/../elem1/a'),
+                         (None, None))
+
+    def test_resolve_stats(self):
+        tree = urltree.URLTree(stats=True)
+        tree.route('/elem1/{var}', 'dest', var=int)
+        tree.route('/elem1/{name}/{path:*}', 'dest')
+
+        tree.resolve('get', '/elem1/1')
+        tree.resolve('get', '/elem1/2')
+        tree.resolve('get', '/elem1/a/b')
+
+        elem1 = tree._children['elem1']
+        self.assertEqual(elem1._hits, 3)
+        self.assertEqual(elem1._variables['var']._hits, 2)
+        self.assertEqual(elem1._variables['name']._hits, 1)
+        self.assertEqual(elem1._variables['name']._tail._hits, 1)
+
+    def test_resolve_nostats(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1', 'dest')
+
+        tree.resolve('get', '/elem1')
+
+        self.assertEqual(tree._children['elem1']._hits, 0)
+
+    def test_optimize(self):
+        tree = urltree.URLTree(stats=True)
+        tree.route('/{action}', 'action', action='(list|show)')
+        tree.route('/{id}', 'id', id=int)
+        tree.route('https://example.com/{kind}', 'kind', kind='(a|b)')
+        tree.route('https://example.com/{num}', 'num', num=int)
+        for _i in range(3):
+            tree.resolve('get', '/5')
+            tree.resolve('get', 'https://example.com/12')
+        tree.resolve('get', '/list')
+
+        result = tree.optimize()
+
+        self.assertEqual(result, 2)
+        self.assertEqual([node._name for node in tree._defaults],
+                         ['id', 'action'])
+        vhost = tree._vhosts[('https', 'example.com')]
+        self.assertEqual([node._name for node in vhost._defaults],
+                         ['num', 'kind'])
+        self.assertEqual(tree._defaults[0]._hits, 0)
+        self.assertEqual(tree.resolve('get', '/list'),
+                         ('action', dict(action=mock.ANY)))
+        self.assertEqual(tree.resolve('get', '/7'), ('id', dict(id=7)))
+
+    def test_optimize_noreset(self):
+        tree = urltree.URLTree(stats=True)
+        tree.route('/{id}', 'id', id=int)
+        tree.resolve('get', '/5')
+
+        result = tree.optimize(reset=False)
+
+        self.assertEqual(result, 0)
+        self.assertEqual(tree._defaults[0]._hits, 1)
+
+    def test_split_request(self):
+        tree = urltree.URLTree()
+
+        self.assertEqual(tree._split_request('https://example.com/a?b=c'),
+                         ('https', 'example.com', '/a', 'b=c'))
+        self.assertEqual(tree._split_request(memoryview(b'/a/../b')),
+                         (None, None, b'/a/../b', b''))
+
+    def test_split_request_normalize(self):
+        tree = urltree.URLTree(normalize=True)
+
+        self.assertEqual(tree._split_request(b'/a/../b%20c?d'),
+                         (None, None, [b'b c'], b'd'))
+
+    def test_walk_rest(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1', 'dest')
+        node = tree._children['elem1']
+
+        self.assertEqual(tree._walk(tree, '///elem1//x/'), (node, {}, 10))
+        self.assertEqual(tree._walk(tree, b'elem1/x'), (node, {}, 6))
+        self.assertEqual(tree._walk(tree, 'x/elem1'), (tree, {}, 0))
+        self.assertEqual(tree._walk(tree, ['elem1', 'x']), (node, {}, 1))
+
+    def test_walks(self):
+        tree = urltree.URLTree()
+        tree.route('https://example.com/elem1', 'vhost')
+        tree.route('/elem1', 'shared')
+
+        result = list(tree._walks('https', 'example.com', '/elem1/x'))
+
+        self.assertEqual(result, [
+            (tree._vhosts[('https', 'example.com')]._children['elem1'],
+             {}, 7),
+            (tree._children['elem1'], {}, 7),
+        ])
+        self.assertEqual(list(tree._walks(None, None, '/elem1')),
+                         [(tree._children['elem1'], {}, None)])
+
+    def test_resolve_internal(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1/{var}', 'dest', 'get', var=int)
+
+        result = tree._resolve('GET', None, None, '/elem1/5/x', None, None,
+                               urltree._mapping_header)
+
+        node = tree._children['elem1']._variables['var']
+        self.assertEqual(result, (node, 'dest', dict(var=5), 9))
+
+    def test_resolve_internal_walks(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1', 'dest', urltree.Query('format', 'json'))
+        node = tree._children['elem1']
+
+        with mock.patch.object(tree, '_walk') as mock_walk:
+            result = tree._resolve('GET', None, None, '/elem1',
+                                   b'format=json', None,
+                                   urltree._mapping_header,
+                                   [(node, {}, None)])
+
+        self.assertEqual(result, (node, 'dest', {}, None))
+        self.assertFalse(mock_walk.called)
+
+    def test_resolve_reject_cache(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1/{var}', 'dest', var=int)
+        tree.resolve('get', '/elem1/spam')
+
+        with mock.patch.object(tree, '_walk') as mock_walk:
+            result = tree._resolve('GET', None, None, '/elem1/spam', '',
+                                   None, urltree._mapping_header)
+
+        self.assertEqual(result, (tree._nowhere, None, {}, None))
+        self.assertFalse(mock_walk.called)
+        self.assertEqual(list(tree._rejected),
+                         [(None, None, '/elem1/spam')])
+
+    def test_resolve_reject_cache_resolved(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1/{var}', 'dest', 'get', var=int)
+
+        tree.resolve('get', '/elem1/5')
+        tree.resolve('put', '/elem1/5')
+
+        self.assertEqual(tree._rejected, {})
+
+    def test_resolve_reject_cache_disabled(self):
+        tree = urltree.URLTree()
+        tree.route('/elem1', 'dest')
+
+        tree.resolve('get', '/elem2')
+
+        self.assertEqual(tree._rejected, {})
+
+    def test_resolve_reject_cache_evict(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1', 'dest')
+
+        for path in ('/elem2', '/elem3', '/elem2', '/elem4'):
+            tree.resolve('get', path)
+
+        self.assertEqual(list(tree._rejected), [
+            (None, None, '/elem2'),
+            (None, None, '/elem4'),
+        ])
+
+    def test_resolve_reject_cache_invalidate(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1', 'dest1')
+        tree.resolve('get', '/elem2')
+
+        tree.route('/elem2', 'dest2')
+
+        self.assertEqual(tree.resolve('get', '/elem2'), ('dest2', {}))
+        self.assertEqual(tree._rejected, {})
+
+    def test_resolve_reject_cache_vhost(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('https://example.com/elem1', 'dest')
+
+        self.assertEqual(tree.resolve('get', 'http://example.com/elem1'),
+                         (None, None))
+        self.assertEqual(tree.resolve('get', 'https://example.com/elem1'),
+                         ('dest', {}))
+        self.assertEqual(list(tree._rejected),
+                         [('http', 'example.com', '/elem1')])
+
+    def test_resolve_reject_cache_normalize(self):
+        tree = urltree.URLTree(normalize=True, reject_cache=2)
+        tree.route('/elem1', 'dest')
+
+        tree.resolve('get', '/elem2/./elem3')
+
+        self.assertEqual(list(tree._rejected),
+                         [(None, None, ('elem2', 'elem3'))])
+
+    def test_rejects(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1', 'dest', 'get')
+
+        tree.resolve('get', '/elem1')
+        tree.resolve('put', '/elem1')
+        tree.resolve('get', '/elem2')
+        tree.resolve('get', '/elem2')
+
+        self.assertEqual(tree.rejects(), dict(unresolved=2, cached=1))
+        self.assertEqual(tree.rejects(reset=True),
+                         dict(unresolved=2, cached=1))
+        self.assertEqual(tree.rejects(), dict(unresolved=0, cached=0))
+
+
+class TestWSGIDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tree = urltree.URLTree()
+        self.app = mock.Mock(return_value=['body'])
+        self.dispatcher = urltree.WSGIDispatcher(self.tree)
+        self.start_response = mock.Mock()
+
+    def test_init(self):
+        self.assertEqual(self.dispatcher.tree, self.tree)
+
+    def test_dispatch(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1/spam',
+                       SCRIPT_NAME='/app')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, ['body'])
+        self.app.assert_called_once_with(environ, self.start_response)
+        self.assertEqual(environ, {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/elem1/spam',
+            'SCRIPT_NAME': '/app',
+            'wsgiorg.routing_args': ((), dict(var='spam')),
+        })
+
+    def test_dispatch_lower_method(self):
+        self.tree.route('/elem1', self.app, 'get')
+        environ = dict(REQUEST_METHOD='get', PATH_INFO='/elem1')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, ['body'])
+
+    def test_dispatch_path_info(self):
+        self.tree.route('/elem1', self.app)
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1//elem2/',
+                       SCRIPT_NAME='/app')
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(environ['SCRIPT_NAME'], '/app/elem1')
+        self.assertEqual(environ['PATH_INFO'], '//elem2/')
+        self.assertEqual(environ['wsgiorg.routing_args'], ((), {}))
+
+    def test_dispatch_non_ascii(self):
+        self.tree.route('/caf\xe9/{name}', self.app, 'get')
+        path = '/caf\xe9/na\xefve'.encode('utf-8').decode('latin-1')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO=path)
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, ['body'])
+        self.assertEqual(environ['wsgiorg.routing_args'],
+                         ((), dict(name='na\xefve')))
+
+    def test_dispatch_non_ascii_path_info(self):
+        self.tree.route('/caf\xe9', self.app)
+        path = '/caf\xe9/r\xe9sum\xe9'.encode('utf-8').decode('latin-1')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO=path)
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(environ['SCRIPT_NAME'], '/caf\xc3\xa9')
+        self.assertEqual(environ['PATH_INFO'], '/r\xc3\xa9sum\xc3\xa9')
+
+    def test_dispatch_restricted_text(self):
+        self.tree.route('/elem1/{id}', self.app, 'get', id='[a-z]+')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1/abc')
+
+        self.dispatcher(environ, self.start_response)
+
+        match = environ['wsgiorg.routing_args'][1]['id']
+        self.assertEqual(match.group(0), 'abc')
+        self.assertTrue(isinstance(match.group(0), str))
+
+    def test_dispatch_non_latin1(self):
+        self.tree.route('/elem1/{name}', self.app, 'get')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1/\u20ac')
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(environ['wsgiorg.routing_args'],
+                         ((), dict(name='\u20ac')))
+
+    def test_dispatch_vhost(self):
+        other = mock.Mock()
+        self.tree.route('/elem1', other)
+        self.tree.route('https://*.example.com/elem1', self.app)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/elem1',
+            'HTTP_HOST': 'www.example.com:443',
+            'wsgi.url_scheme': 'https',
+        }
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertTrue(self.app.called)
+        self.assertFalse(other.called)
+
+    def test_dispatch_vhost_method(self):
+        other = mock.Mock()
+        self.tree.route('https://api.example.com/elem1', other, 'get')
+        self.tree.route('/elem1', self.app, 'post')
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/elem1',
+            'HTTP_HOST': 'api.example.com',
+            'wsgi.url_scheme': 'https',
+        }
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertTrue(self.app.called)
+        self.assertFalse(other.called)
+
+    def test_dispatch_predicate(self):
+        other = mock.Mock()
+        self.tree.route('/elem1', other)
+        self.tree.route('/elem1', self.app, urltree.Header('X-Version', '2'))
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1',
+                       HTTP_X_VERSION='2')
+
+        self.dispatcher(environ, self.start_response)
+
+        self.assertTrue(self.app.called)
+        self.assertFalse(other.called)
+
+    def test_not_found(self):
+        self.tree.route('/elem1', self.app, 'get')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem2')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, [b'404 Not Found'])
+        self.start_response.assert_called_once_with('404 Not Found', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', '13'),
+        ])
+        self.assertFalse(self.app.called)
+        self.assertFalse('wsgiorg.routing_args' in environ)
+        self.assertEqual(self.tree.rejects()['unresolved'], 1)
+
+    def test_not_found_reject_cache(self):
+        self.tree.reject_cache = 2
+        self.tree.route('/elem1', self.app, 'get')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem2')
+
+        self.dispatcher(environ, self.start_response)
+        with mock.patch.object(self.tree, '_walk') as mock_walk:
+            result = self.dispatcher(dict(environ), self.start_response)
+
+        self.assertEqual(result, [b'404 Not Found'])
+        self.assertFalse(mock_walk.called)
+        self.assertEqual(self.tree.rejects(), dict(unresolved=2, cached=1))
+
+    def test_not_found_predicate(self):
+        self.tree.route('/elem1', self.app, urltree.Query('format', 'json'))
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/elem1')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        # The path resolved, so it's not counted as unresolved
+        self.assertEqual(result, [b'404 Not Found'])
+        self.assertEqual(self.tree.rejects()['unresolved'], 0)
+
+    def test_dispatch_websocket_only(self):
+        self.tree.route('/ws', self.app, 'websocket')
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/ws')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, [b'404 Not Found'])
+        self.assertEqual(self.start_response.call_args[0][0],
+                         '404 Not Found')
+        self.assertFalse(self.app.called)
+
+    def test_method_not_allowed(self):
+        self.tree.route('/elem1', self.app, 'get', 'put')
+        environ = dict(REQUEST_METHOD='POST', PATH_INFO='/elem1')
+
+        result = self.dispatcher(environ, self.start_response)
+
+        self.assertEqual(result, [b'405 Method Not Allowed'])
+        self.start_response.assert_called_once_with(
+            '405 Method Not Allowed', [
+                ('Allow', 'GET, PUT'),
+                ('Content-Type', 'text/plain'),
+                ('Content-Length', '22'),
+            ])
+        self.assertFalse(self.app.called)
+        self.assertEqual(self.tree.rejects()['unresolved'], 0)
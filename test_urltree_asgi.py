@@ -0,0 +1,402 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import asyncio
+import unittest
+from unittest import mock
+
+import urltree
+import urltree_asgi
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeApp:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, scope, receive, send):
+        self.calls.append((scope, receive, send))
+
+
+class TestASGIHeader(unittest.TestCase):
+    def test_present(self):
+        headers = [(b'host', b'example.com'), (b'x-version', b'2')]
+
+        self.assertEqual(urltree_asgi._asgi_header(headers, 'x-version'), '2')
+
+    def test_missing(self):
+        headers = [(b'host', b'example.com')]
+
+        self.assertEqual(urltree_asgi._asgi_header(headers, 'x-version'),
+                         None)
+
+
+class TestASGIDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tree = urltree.URLTree()
+        self.app = FakeApp()
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def receive(self):
+        return {'type': 'http.request'}
+
+    def call(self, dispatcher, **scope):
+        scope.setdefault('type', 'http')
+        scope.setdefault('method', 'GET')
+        scope.setdefault('headers', [])
+        run(dispatcher(scope, self.receive, self.send))
+        return scope
+
+    def test_init(self):
+        self.tree._version = 5
+
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree, 10)
+
+        self.assertEqual(dispatcher.tree, self.tree)
+        self.assertEqual(dispatcher.cache_size, 10)
+        self.assertEqual(dispatcher._cache, {})
+        self.assertEqual(dispatcher._version, 5)
+
+    def test_dispatch(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        scope = self.call(dispatcher, path='/elem1/spam', method='get')
+
+        self.assertEqual(len(self.app.calls), 1)
+        self.assertTrue(self.app.calls[0][0] is scope)
+        self.assertEqual(scope['path_params'], dict(var='spam'))
+        self.assertEqual(scope['path'], '/elem1/spam')
+        self.assertFalse('root_path' in scope)
+
+    def test_dispatch_path_info(self):
+        self.tree.route('/elem1', self.app)
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        scope = self.call(dispatcher, path='/elem1/elem2', root_path='/app')
+
+        self.assertEqual(scope['root_path'], '/app/elem1')
+        self.assertEqual(scope['path'], '/elem2')
+        self.assertEqual(scope['path_params'], {})
+
+    def test_dispatch_raw_path(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        with mock.patch.object(self.tree, '_walks',
+                               wraps=self.tree._walks) as mock_walks:
+            scope = self.call(dispatcher, path='/elem1/sp\xe4m',
+                              raw_path=b'/elem1/sp\xc3\xa4m')
+
+        mock_walks.assert_called_once_with(None, None,
+                                           b'/elem1/sp\xc3\xa4m')
+        self.assertEqual(scope['path_params'], dict(var='sp\xe4m'))
+
+    def test_dispatch_raw_path_encoded(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        with mock.patch.object(self.tree, '_walks',
+                               wraps=self.tree._walks) as mock_walks:
+            scope = self.call(dispatcher, path='/elem1/a b',
+                              raw_path=b'/elem1/a%20b')
+
+        mock_walks.assert_called_once_with(None, None, '/elem1/a b')
+        self.assertEqual(scope['path_params'], dict(var='a b'))
+
+    def test_dispatch_raw_path_restricted(self):
+        self.tree.route('/u/{id}', self.app, 'get', id='[a-z]+')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        for path, raw_path in (('/u/abc', b'/u/abc'), ('/u/abc', b'/u/a%62c')):
+            scope = self.call(dispatcher, path=path, raw_path=raw_path)
+
+            match = scope['path_params']['id']
+            self.assertEqual(match.group(0), 'abc')
+            self.assertTrue(isinstance(match.group(0), str))
+
+    def test_dispatch_raw_path_info(self):
+        self.tree.route('/elem\xe4', self.app)
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        scope = self.call(dispatcher, path='/elem\xe4/elem2',
+                          raw_path=b'/elem\xc3\xa4/elem2')
+
+        self.assertEqual(scope['root_path'], '/elem\xe4')
+        self.assertEqual(scope['path'], '/elem2')
+
+    def test_dispatch_websocket(self):
+        self.tree.route('/elem1', self.app, 'websocket')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, type='websocket', path='/elem1')
+        self.call(dispatcher, path='/elem1')
+
+        self.assertEqual(len(self.app.calls), 1)
+        self.assertEqual(self.app.calls[0][0]['type'], 'websocket')
+        self.assertEqual(self.sent[0]['status'], 404)
+
+    def test_dispatch_websocket_default(self):
+        self.tree.route('/elem1', self.app)
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, type='websocket', path='/elem1')
+
+        self.assertEqual(self.app.calls, [])
+        self.assertEqual(self.sent, [{'type': 'websocket.close',
+                                      'code': 1000}])
+
+    def test_dispatch_websocket_vhost(self):
+        other = FakeApp()
+        self.tree.route('https://example.com/elem1', other)
+        self.tree.route('/elem1', self.app, 'websocket')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, type='websocket', path='/elem1',
+                  scheme='https', headers=[(b'host', b'example.com')])
+
+        self.assertEqual(len(self.app.calls), 1)
+        self.assertEqual(other.calls, [])
+
+    def test_dispatch_normalize(self):
+        tree = urltree.URLTree(normalize=True)
+        tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(tree)
+
+        scope = self.call(dispatcher, path='/elem2/../elem1/a/b',
+                          raw_path=b'/elem2/../elem1/a%2Fb')
+
+        self.assertEqual(scope['path_params'], dict(var='a/b'))
+        self.assertEqual(list(dispatcher._cache), [(b'elem1', b'a/b')])
+
+    def test_dispatch_normalize_path_info(self):
+        tree = urltree.URLTree(normalize=True)
+        tree.route('/elem\xe4', self.app)
+        dispatcher = urltree_asgi.ASGIDispatcher(tree)
+
+        scope = self.call(dispatcher, path='/elem\xe4/./elem2//elem3',
+                          raw_path=b'/elem%C3%A4/./elem2//elem3',
+                          root_path='/app')
+
+        self.assertEqual(scope['root_path'], '/app/elem\xe4')
+        self.assertEqual(scope['path'], '/elem2/elem3')
+
+    def test_dispatch_normalize_no_raw_path(self):
+        tree = urltree.URLTree(normalize=True)
+        tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(tree)
+
+        scope = self.call(dispatcher, path='/elem1/100%')
+
+        self.assertEqual(scope['path_params'], dict(var='100%'))
+
+    def test_dispatch_vhost(self):
+        other = FakeApp()
+        self.tree.route('/elem1', other)
+        self.tree.route('https://*.example.com/elem1', self.app)
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem1', scheme='https',
+                  headers=[(b'host', b'www.example.com')])
+        self.call(dispatcher, path='/elem1', scheme='https',
+                  server=('www.example.com', 443))
+        self.call(dispatcher, path='/elem1', scheme='https',
+                  headers=[(b'host', b'www.example.org')])
+
+        self.assertEqual(len(self.app.calls), 2)
+        self.assertEqual(len(other.calls), 1)
+
+    def test_dispatch_predicate(self):
+        other = FakeApp()
+        self.tree.route('/elem1', other)
+        self.tree.route('/elem1', self.app, urltree.Query('format', 'json'))
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem1', query_string=b'format=json')
+        self.call(dispatcher, path='/elem1', query_string=b'format=xml')
+
+        self.assertEqual(len(self.app.calls), 1)
+        self.assertEqual(len(other.calls), 1)
+
+    def test_cache(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree, 2)
+
+        with mock.patch.object(self.tree, '_walks',
+                               wraps=self.tree._walks) as mock_walks:
+            scope1 = self.call(dispatcher, path='/elem1/a')
+            scope2 = self.call(dispatcher, path='/elem1/a')
+            self.call(dispatcher, path='/elem1/b')
+            self.call(dispatcher, path='/elem1/c')
+
+        self.assertEqual(mock_walks.call_count, 3)
+        self.assertEqual(list(dispatcher._cache.keys()),
+                         ['/elem1/b', '/elem1/c'])
+        self.assertEqual(scope1['path_params'], dict(var='a'))
+        self.assertEqual(scope2['path_params'], dict(var='a'))
+        self.assertFalse(scope1['path_params'] is scope2['path_params'])
+
+    def test_cache_mutable(self):
+        self.tree.route('/elem1/{ids}', self.app, 'get',
+                        ids=lambda elem: elem.split(','))
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        scope1 = self.call(dispatcher, path='/elem1/a,b')
+        scope1['path_params']['ids'].append('x')
+        scope2 = self.call(dispatcher, path='/elem1/a,b')
+
+        self.assertEqual(scope2['path_params'], dict(ids=['a', 'b']))
+        self.assertEqual(dispatcher._cache, {})
+
+    def test_cache_immutable(self):
+        self.tree.route('/elem1/{var}', self.app, 'get', var=int)
+        self.tree.route('/elem2/{var}', self.app, 'get',
+                        var=urltree.Memoize(str.split))
+        self.tree.route('/elem3/{var}', self.app, 'get', var='[a-z]+')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        for path in ('/elem1/5', '/elem2/a', '/elem3/a'):
+            self.call(dispatcher, path=path)
+
+        self.assertEqual(list(dispatcher._cache),
+                         ['/elem1/5', '/elem2/a', '/elem3/a'])
+
+    def test_cache_stats(self):
+        tree = urltree.URLTree(stats=True)
+        tree.route('/elem1/{var}', self.app, 'get', var=int)
+        dispatcher = urltree_asgi.ASGIDispatcher(tree)
+
+        self.call(dispatcher, path='/elem1/5')
+        self.call(dispatcher, path='/elem1/5')
+
+        self.assertEqual(dispatcher._cache, {})
+        self.assertEqual(tree._children['elem1']._variables['var']._hits, 2)
+
+    def test_cache_disabled(self):
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree, 0)
+
+        self.call(dispatcher, path='/elem1/a')
+        self.call(dispatcher, path='/elem1/a')
+
+        self.assertEqual(dispatcher._cache, {})
+        self.assertEqual(len(self.app.calls), 2)
+
+    def test_cache_reject_cache(self):
+        tree = urltree.URLTree(reject_cache=2)
+        tree.route('/elem1/{var}', self.app, 'get', var=int)
+        dispatcher = urltree_asgi.ASGIDispatcher(tree)
+
+        with mock.patch.object(tree, '_walks',
+                               wraps=tree._walks) as mock_walks:
+            for path in ('/elem1/a', '/elem1/a', '/elem1/5', '/elem1/5'):
+                self.call(dispatcher, path=path)
+
+        self.assertEqual(mock_walks.call_count, 2)
+        self.assertEqual(list(dispatcher._cache), ['/elem1/5'])
+        self.assertEqual(list(tree._rejected), [(None, None, '/elem1/a')])
+        self.assertEqual(tree.rejects(), dict(unresolved=2, cached=1))
+        self.assertEqual(len(self.app.calls), 2)
+
+    def test_cache_invalidate(self):
+        other = FakeApp()
+        self.tree.route('/elem1/{var}', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem1/a')
+        self.tree.route('/elem1/a', other, 'get')
+        self.call(dispatcher, path='/elem1/a')
+
+        self.assertEqual(len(self.app.calls), 1)
+        self.assertEqual(len(other.calls), 1)
+
+    def test_not_found(self):
+        self.tree.route('/elem1', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem2')
+
+        self.assertEqual(self.sent, [
+            {
+                'type': 'http.response.start',
+                'status': 404,
+                'headers': [
+                    (b'content-type', b'text/plain'),
+                    (b'content-length', b'13'),
+                ],
+            },
+            {'type': 'http.response.body', 'body': b'404 Not Found'},
+        ])
+        self.assertEqual(self.tree.rejects()['unresolved'], 1)
+
+    def test_not_found_websocket(self):
+        self.tree.route('/elem1', self.app, 'get')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, type='websocket', path='/elem1')
+
+        self.assertEqual(self.sent, [{'type': 'websocket.close',
+                                      'code': 1000}])
+        self.assertEqual(self.app.calls, [])
+
+    def test_not_found_http_websocket_only(self):
+        self.tree.route('/elem1', self.app, 'websocket')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem1')
+
+        self.assertEqual(self.sent[0]['status'], 404)
+        self.assertEqual(self.app.calls, [])
+
+    def test_method_not_allowed(self):
+        self.tree.route('/elem1', self.app, 'get', 'put')
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.call(dispatcher, path='/elem1', method='POST')
+
+        self.assertEqual(self.sent[0]['status'], 405)
+        self.assertTrue((b'allow', b'GET, PUT') in self.sent[0]['headers'])
+        self.assertEqual(self.sent[1]['body'], b'405 Method Not Allowed')
+
+    def test_lifespan(self):
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        run(dispatcher({'type': 'lifespan'}, receive, self.send))
+
+        self.assertEqual(self.sent, [
+            {'type': 'lifespan.startup.complete'},
+            {'type': 'lifespan.shutdown.complete'},
+        ])
+
+    def test_unknown_scope(self):
+        dispatcher = urltree_asgi.ASGIDispatcher(self.tree)
+
+        self.assertRaises(ValueError, run,
+                          dispatcher({'type': 'spam'}, None, None))
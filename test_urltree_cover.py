@@ -0,0 +1,345 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import sys
+import unittest
+from unittest import mock
+
+import urltree
+import urltree_cover
+
+
+def log_line(method, url):
+    return ('127.0.0.1 - - [18/Oct/2026:10:00:00 +0000] "%s %s HTTP/1.1" '
+            '200 2 "-" "agent"' % (method, url)).encode('utf-8')
+
+
+# Used by the load_tree() tests
+routes = urltree.URLTree()
+dispatcher = urltree.WSGIDispatcher(routes)
+
+
+def make_routes():
+    return routes
+
+
+def make_other():
+    return 'other'
+
+
+class TestShape(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(urltree_cover._shape(b'/elem1/elem2?q=1'),
+                         '/elem1/elem2')
+
+    def test_placeholders(self):
+        self.assertEqual(
+            urltree_cover._shape(b'/elem1/1234/0123abcd-ef/abc'),
+            '/elem1/{int}/{hex}/abc')
+
+    def test_depth(self):
+        self.assertEqual(urltree_cover._shape(b'/a/b/c/d', 2), '/a/b/...')
+
+    def test_undecodable(self):
+        self.assertEqual(urltree_cover._shape(b'/\xff'), '/�')
+
+
+class TestDescribeRoute(unittest.TestCase):
+    def test_methods(self):
+        route = urltree.Route('/elem1', 'dest', ('GET', 'PUT'), None, {})
+
+        self.assertEqual(urltree_cover._describe_route(route),
+                         'GET,PUT /elem1')
+
+    def test_any_method_predicate(self):
+        route = urltree.Route('/elem1', 'dest', None,
+                              urltree.Query('format', 'json'), {})
+
+        self.assertEqual(urltree_cover._describe_route(route),
+                         "* /elem1 Query('format', 'json')")
+
+
+class TestTopCounter(unittest.TestCase):
+    def test_init(self):
+        counter = urltree_cover._TopCounter(5)
+
+        self.assertEqual(counter.size, 5)
+        self.assertEqual(counter.counts, {})
+        self.assertEqual(counter.dropped, 0)
+
+    def test_add(self):
+        counter = urltree_cover._TopCounter(5)
+
+        for key in 'abacab':
+            counter.add(key)
+
+        self.assertEqual(counter.most_common(2), [('a', 3), ('b', 2)])
+        self.assertEqual(counter.dropped, 0)
+
+    def test_add_prune(self):
+        counter = urltree_cover._TopCounter(2)
+
+        for key in 'aaabbcd':
+            counter.add(key)
+
+        self.assertEqual(counter.counts, dict(a=3, b=2))
+        self.assertEqual(counter.dropped, 2)
+
+
+class TestCoverage(unittest.TestCase):
+    def setUp(self):
+        self.tree = urltree.URLTree()
+        self.tree.route('/elem1/{var}', 'dest1', 'get', var=int)
+        self.tree.route('/elem1/{var}', 'dest2', 'put', var=int)
+        self.tree.route('/elem2', 'dest1')
+        self.tree.route('/elem3', 'dest1')
+        self.tree.route('/elem3', 'dest3', urltree.Query('format', 'csv'))
+        self.cover = urltree_cover.Coverage(
+            self.tree, timer=mock.Mock(side_effect=[1.0, 1.5] * 10))
+
+    def test_init(self):
+        self.assertEqual(self.cover.tree, self.tree)
+        self.assertEqual(self.cover._routes, list(self.tree.routes()))
+        self.assertEqual(self.cover._methods, set(['GET', 'PUT']))
+        self.assertEqual(self.cover.lines, 0)
+        self.assertEqual(self.cover.unmatched.size, 1000)
+
+    def test_add_resolved(self):
+        self.cover.add(log_line('GET', '/elem1/5'))
+        self.cover.add(log_line('get', '/elem1/6'))
+        self.cover.add(log_line('PUT', '/elem1/7'))
+
+        self.assertEqual(self.cover.lines, 3)
+        self.assertEqual(self.cover.resolved, 3)
+        self.assertEqual(self.cover.elapsed, 1.5)
+        self.assertEqual(self.cover._stats, {
+            (0,): [2, 1.0],
+            (1,): [1, 0.5],
+        })
+
+    def test_add_resolve(self):
+        with mock.patch.object(self.tree, '_resolve',
+                               wraps=self.tree._resolve) as mock_resolve:
+            self.cover.add(log_line('GET', '/elem1/5?q=1'))
+
+        mock_resolve.assert_called_once_with(
+            'GET', None, None, b'/elem1/5', b'q=1', None,
+            urltree._mapping_header)
+        self.assertEqual(self.cover.resolved, 1)
+
+    def test_add_same_dest(self):
+        self.cover.add(log_line('GET', '/elem2'))
+        self.cover.add(log_line('DELETE', '/elem3'))
+        self.cover.add(log_line('PATCH', '/elem3'))
+
+        self.assertEqual(self.cover._stats, {
+            (2,): [1, 0.5],
+            (3,): [2, 1.0],
+        })
+        self.assertEqual(len(self.cover._groups), 2)
+
+    def test_add_predicate(self):
+        self.cover.add(log_line('GET', '/elem3?format=csv'))
+        self.cover.add(log_line('GET', '/elem3?format=json'))
+
+        self.assertEqual(self.cover._stats, {
+            (4,): [1, 0.5],
+            (3,): [1, 0.5],
+        })
+
+    def test_add_not_allowed(self):
+        self.cover.add(log_line('POST', '/elem1/5'))
+
+        self.assertEqual(self.cover.not_allowed, 1)
+        self.assertEqual(self.cover.unresolved, 0)
+        self.assertEqual(self.cover._stats, {})
+
+    def test_add_unresolved(self):
+        self.cover.add(log_line('GET', '/elem1/spam'))
+        self.cover.add(log_line('GET', '/elem4/12?q=1'))
+
+        self.assertEqual(self.cover.unresolved, 2)
+        self.assertEqual(self.cover.unmatched.counts, {
+            '/elem1/spam': 1,
+            '/elem4/{int}': 1,
+        })
+
+    def test_add_skipped(self):
+        self.cover.add(b'garbage "-" 400')
+
+        self.assertEqual(self.cover.lines, 1)
+        self.assertEqual(self.cover.skipped, 1)
+        self.assertFalse(self.cover.timer.called)
+
+    def test_dead_routes(self):
+        self.cover.add(log_line('GET', '/elem1/5'))
+        self.cover.add(log_line('GET', '/elem3'))
+
+        self.assertEqual(self.cover.dead_routes(), [
+            self.cover._routes[1],
+            self.cover._routes[2],
+            self.cover._routes[4],
+        ])
+
+    def test_progress(self):
+        self.cover.add(log_line('GET', '/elem1/5'))
+        self.cover.add(log_line('GET', '/elem4'))
+        self.cover.add(b'garbage')
+        stream = io.StringIO()
+
+        self.cover.progress(stream)
+
+        self.assertEqual(stream.getvalue(),
+                         '3 lines, 2 requests: 1 resolved, 1 unresolved, '
+                         '0 method not allowed; 500000.0 us/request\n')
+
+    def test_progress_empty(self):
+        stream = io.StringIO()
+
+        self.cover.progress(stream)
+
+        self.assertEqual(stream.getvalue(),
+                         '0 lines, 0 requests: 0 resolved, 0 unresolved, '
+                         '0 method not allowed; 0.0 us/request\n')
+
+    def test_report(self):
+        self.cover.unmatched.size = 1
+        for url in ('/elem1/5', '/elem1/6', '/elem2', '/elem4', '/elem4',
+                    '/elem5'):
+            self.cover.add(log_line('GET', url))
+        stream = io.StringIO()
+
+        self.cover.report(stream, 5)
+
+        self.assertEqual(stream.getvalue().splitlines()[1:], [
+            '',
+            'Routes by hits:',
+            '      hits   total ms    mean us  route',
+            '         2     1000.0  500000.00  GET /elem1/{var}',
+            '         1      500.0  500000.00  * /elem2',
+            '',
+            'Routes never hit (3):',
+            '    PUT /elem1/{var}',
+            '    * /elem3',
+            "    * /elem3 Query('format', 'csv')",
+            '',
+            'Unresolvable paths by shape:',
+            '         2  /elem4',
+            '         1  (other shapes)',
+        ])
+
+
+class TestReadLines(unittest.TestCase):
+    def test_read_lines(self):
+        stream = io.BytesIO(b'line1\nline2\r\n\nline3')
+
+        result = list(urltree_cover.read_lines(stream, 4))
+
+        self.assertEqual(result, [b'line1', b'line2\r', b'', b'line3'])
+
+    def test_read_lines_trailing_newline(self):
+        stream = io.BytesIO(b'line1\nline2\n')
+
+        result = list(urltree_cover.read_lines(stream))
+
+        self.assertEqual(result, [b'line1', b'line2'])
+
+    def test_read_lines_chunks(self):
+        stream = mock.Mock(**{'read.side_effect': [b'abc', b'de\nf', b'']})
+
+        result = list(urltree_cover.read_lines(stream, 3))
+
+        self.assertEqual(result, [b'abcde', b'f'])
+        stream.read.assert_called_with(3)
+
+
+class TestOpen(unittest.TestCase):
+    @mock.patch.object(sys, 'stdin')
+    def test_stdin(self, mock_stdin):
+        self.assertEqual(urltree_cover._open('-'), mock_stdin.buffer)
+
+    @mock.patch('gzip.open')
+    def test_gzip(self, mock_gzip_open):
+        result = urltree_cover._open('access.log.gz')
+
+        self.assertEqual(result, mock_gzip_open.return_value)
+        mock_gzip_open.assert_called_once_with('access.log.gz', 'rb')
+
+    @mock.patch('builtins.open')
+    def test_file(self, mock_open):
+        result = urltree_cover._open('access.log')
+
+        self.assertEqual(result, mock_open.return_value)
+        mock_open.assert_called_once_with('access.log', 'rb')
+
+
+class TestLoadTree(unittest.TestCase):
+    def test_tree(self):
+        self.assertEqual(urltree_cover.load_tree('test_urltree_cover:routes'),
+                         routes)
+
+    def test_dispatcher(self):
+        self.assertEqual(
+            urltree_cover.load_tree('test_urltree_cover:dispatcher'), routes)
+
+    def test_callable(self):
+        self.assertEqual(
+            urltree_cover.load_tree('test_urltree_cover:make_routes'),
+            routes)
+
+    def test_dotted(self):
+        self.assertEqual(
+            urltree_cover.load_tree('test_urltree_cover:dispatcher.tree'),
+            routes)
+
+    def test_bad_spec(self):
+        self.assertRaises(ValueError, urltree_cover.load_tree,
+                          'test_urltree_cover')
+        self.assertRaises(ValueError, urltree_cover.load_tree,
+                          'test_urltree_cover:')
+
+    def test_not_tree(self):
+        self.assertRaises(TypeError, urltree_cover.load_tree,
+                          'test_urltree_cover:make_other')
+
+
+class TestMain(unittest.TestCase):
+    @mock.patch.object(sys, 'stderr', new_callable=io.StringIO)
+    @mock.patch.object(sys, 'stdout', new_callable=io.StringIO)
+    @mock.patch.object(urltree_cover, '_open')
+    def test_main(self, mock_open, mock_stdout, mock_stderr):
+        routes.route('/main', 'main')
+        mock_open.return_value = io.BytesIO(b'\n'.join([
+            log_line('GET', '/main'),
+            log_line('GET', '/other'),
+            log_line('GET', '/main'),
+        ]))
+
+        urltree_cover.main(['test_urltree_cover:routes', 'log1', '--every',
+                            '2'])
+
+        mock_open.assert_called_once_with('log1')
+        self.assertTrue(mock_open.return_value.closed)
+        self.assertTrue(mock_stderr.getvalue().startswith(
+            '2 lines, 2 requests: 1 resolved, 1 unresolved'))
+        self.assertTrue('         2' in mock_stdout.getvalue())
+
+    @mock.patch.object(sys, 'stderr', new_callable=io.StringIO)
+    def test_main_bad_routes(self, mock_stderr):
+        self.assertRaises(SystemExit, urltree_cover.main,
+                          ['test_urltree_cover:missing'])
+
+        self.assertTrue('missing' in mock_stderr.getvalue())
@@ -26,9 +26,112 @@ the URL are represented by plain text, and variable parts are
 delimited by braces ("{}"); the text inside the braces specifies the
 name of the variable that will be computed from the replacement.  Each
 such variable part corresponds to a single slash-delimited part of the
-path; unlike Routes, it is not possible for one variable block to
-cover only a portion of the URL path element, or to cover multiple URL
-path elements.
+path, although a path element may contain several variable parts
+mixed with constant text (e.g., "{name}.{ext}" or "v{version}").
+Such partial elements are compiled into a matcher which checks the
+constant prefix and suffix first, resorting to a regular expression
+only when there is more than one variable part; each variable part
+matches at least one character, and earlier variable parts match as
+much text as possible.  Partial elements are tried after exact
+constant matches, but before whole-element variables; among
+themselves, those with the most constant text are tried first.  Two
+variable parts may not be directly adjacent.
+
+The one exception to the single element rule is the catch-all
+variable, which is written with a trailing ":*" (e.g., "{path:*}") and
+which must be the last element of the route.  A catch-all variable
+matches all the remaining text of the URL, starting with the first
+unconsumed path element; the value is taken as a single slice of the
+original URL, so repeated and trailing slashes are preserved.
+Catch-all variables may be restricted like any other variable, but
+they are only tried after all other children of a node have failed to
+match, and they never match an empty remainder.
+
+Routes may also be restricted to particular schemes and hosts by
+giving an absolute URL pattern, e.g., "https://api.example.com/v1".
+Either the scheme or the host may be given as "*" to match any scheme
+or host, and a host of the form "*.example.com" will match any
+subdomain of "example.com" (but not "example.com" itself); the most
+specific wildcard is preferred.  Hosts are compared case
+insensitively, and any port number is ignored.  Routes for each
+distinct scheme and host are stored in their own subtree, so routes
+given as plain paths are stored only once and are shared by all
+hosts.  A more specific subtree takes precedence over the shared
+routes only if it consumes the whole path and has a destination for
+the request's method; otherwise, the shared routes are consulted, and
+a route in a more specific subtree which leaves part of the path
+unconsumed is only used if the shared routes do not resolve the
+request at all.  To take advantage of this, pass an absolute URL to
+``URLTree.resolve()``.
+
+URLs may be passed to ``URLTree.resolve()`` as byte strings (including
+``bytearray`` and ``memoryview`` objects), in which case they are
+assumed to be UTF-8 encoded.  Such URLs are resolved without decoding
+them; constant path elements are looked up by their encoded form, and
+regular expression restrictions are first tried against the raw bytes
+where that matches the same elements, so mismatches are rejected
+without decoding.  Only the values actually placed in the parameters
+are decoded, so they are always text, and match objects are always
+matches on text; an element which is not valid UTF-8 will not match a
+variable.
+
+Normally, ``URLTree.resolve()`` expects a path which has already been
+percent-decoded and normalized.  A ``URLTree`` created with
+``normalize=True`` will instead do this itself as it splits the path:
+dot segments (".", "..") are resolved, and each path element is
+percent-decoded separately, so that an encoded slash ("%2F") remains
+part of its path element.  Paths without any "%" are not decoded at
+all.  Since the elements no longer correspond to a slice of the
+original URL, catch-all variables and ``path_info`` are then built by
+joining the remaining elements with "/".  Route patterns are never
+normalized.
+
+Since the order in which restricted variables are tried can matter a
+great deal to performance, a ``URLTree`` created with ``stats=True``
+counts how often each node is reached.  Calling ``URLTree.optimize()``
+then reorders the restricted variables at each level so that the most
+frequently matched are tried first--but only where this is provably
+safe, i.e., where the restrictions cannot match the same path
+element.  Restrictions which can be proven distinct are ``int``,
+regular expressions matching a fixed set of strings (e.g.,
+"(list|detail)"), and regular expressions consisting of a single
+character class containing no digits (e.g., "[a-z]+").  The order only
+ever changes when ``optimize()`` is called.
+
+Requests for paths which cannot resolve are answered cheaply, since
+the walk stops at the first path element which matches nothing, and
+the rest of the path is never matched.  When the routes have many
+restricted variables, though, each such request may still run a
+number of restrictions.  A ``URLTree`` created with a nonzero
+``reject_cache`` therefore remembers up to that many unresolvable
+paths (together with the scheme and host, if there are virtual host
+routes), and rejects them without walking the tree; the cache is
+discarded whenever a route is added.  Either way, the number of
+requests for unresolvable paths is reported by ``URLTree.rejects()``.
+
+Every route added to a ``URLTree`` is also recorded, as a ``Route``,
+in a flat registry.  The registry may be iterated with
+``URLTree.routes()``, dumped as JSON lines with ``URLTree.export()``,
+and searched by destination with ``URLTree.patterns_for()``, all
+without walking the tree.
+
+For WSGI applications, ``WSGIDispatcher`` wraps a ``URLTree`` and
+dispatches each request directly from the WSGI environment.  Here,
+the destinations must be WSGI applications, and the parameters are
+stored in the environment under "wsgiorg.routing_args".  As PEP 3333
+requires, "PATH_INFO" is taken to be the UTF-8 encoded path decoded as
+ISO-8859-1, so it is re-encoded and resolved as a byte string.
+
+Finally, a route may be made conditional on a query string parameter
+or a request header by passing a ``Query`` or ``Header`` predicate
+along with the HTTP methods.  A predicate with a value matches only
+when the parameter or header has exactly that value, and one without
+a value matches whenever the parameter or header is present.
+Predicates are only evaluated once the path has been resolved, and
+only if the node that was reached has predicated routes; the query
+string is not even parsed otherwise.  Predicated routes take
+precedence over the plain routes of the same node, and at most one
+predicate may be given for each route.
 
 When constructing the route, it is possible to apply restrictions to
 what a variable element can match; these restrictions are passed as
@@ -42,19 +145,396 @@ parameter value will be the return value of the function.  If no
 restrictions are specified, the matched element text will be used as
 the value of the parameter.
 
+A restriction function is called every time a variable is tried, even
+if the same path element has been seen before.  If the function is
+expensive, wrap it in a ``Memoize``, which remembers the results
+(including ``ValueError`` failures) for a bounded number of recently
+seen path elements, and reports how often they were reused.
+
 Note that, because individual routes are not independent, all
 variables with the same name at the same level MUST have the same
 restriction, and that all variables with the same restriction at the
-same level MUST have the same name.  If multiple variables exist at a
-given level, the ones with restrictions will be processed first, in
-the order in which they were added; the variable with no restrictions
-specified, if any, will be checked last.
+same level MUST have the same name; the same goes for the variables of
+partial path elements with the same constant text.  If multiple
+variables exist at a given level, the ones with restrictions will be
+processed first, in the order in which they were added; the variable
+with no restrictions specified, if any, will be checked last.
 """
 
+import collections
+import functools
+import json
 import re
+import sys
+from urllib.parse import parse_qsl, unquote, unquote_to_bytes
+
+
+__all__ = ['URLTree', 'Route', 'Query', 'Header', 'Memoize',
+           'WSGIDispatcher']
+
+
+# The types of URLs which are resolved as byte strings
+_binary_types = (bytes, bytearray, memoryview)
+
+# Methods which only match routes that list them explicitly
+_pseudo_methods = frozenset(['WEBSOCKET'])
+
+
+# Recognizes the variable parts of a path element
+_var_re = re.compile(r'\{([^{}]+)\}')
+
+# Used to analyze restriction patterns; see _restrict_domain()
+_group_re = re.compile(r'\((?:\?:)?([^()]*)\)$')
+_class_re = re.compile(r'\[([^\]\\^][^\]\\]*)\](?:[+*]|\{\d+(?:,\d*)?\})?$')
+_regex_meta = frozenset('.^$*+?{}[]\\|()')
+
+# Used to find restriction patterns which match the same path elements
+# whether applied to text or to UTF-8 encoded bytes; see _bytes_pattern()
+_escape_re = re.compile(r'\\(.)', re.S)
+_flags_re = re.compile(r'\(\?[aiLmsux-]')
+
+
+def _mapping_header(headers, name):
+    """
+    Look up a header in a mapping of header names to values.  The
+    lookup is case insensitive.
+
+    :param headers: The mapping of header names to values.
+    :param name: The name of the header, in lower case.
+
+    :returns: The value of the header, or ``None`` if it is not
+              present.
+    """
+
+    value = headers.get(name)
+    if value is None:
+        for key, val in headers.items():
+            if key.lower() == name:
+                return val
+
+    return value
+
+
+@functools.lru_cache(maxsize=256)
+def _environ_key(name):
+    """
+    Compute the WSGI environment key for a header.
+
+    :param name: The name of the header, in lower case.
+
+    :returns: The WSGI environment key.
+    """
+
+    key = name.upper().replace('-', '_')
+    if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        key = 'HTTP_' + key
+
+    return key
+
+
+def _environ_header(environ, name):
+    """
+    Look up a header in a WSGI environment.
+
+    :param environ: The WSGI environment.
+    :param name: The name of the header, in lower case.
+
+    :returns: The value of the header, or ``None`` if it is not
+              present.
+    """
+
+    return environ.get(_environ_key(name))
+
+
+def _is_int(text):
+    """
+    Determine whether ``int()`` accepts a string.
+
+    :param text: The string to check.
+
+    :returns: ``True`` if ``int()`` accepts the string, ``False``
+              otherwise.
+    """
+
+    try:
+        int(text)
+    except ValueError:
+        return False
+
+    return True
+
+
+def _bytes_pattern(pattern):
+    """
+    Compile a restriction pattern for matching UTF-8 encoded path
+    elements, if it matches exactly the same elements as the text
+    pattern does.  That is only the case for ASCII patterns which
+    cannot match a non-ASCII character: patterns using ".", negated
+    character classes, escapes such as "\\w" or "\\d", or inline
+    flags may match a multibyte character differently from its
+    individual bytes, or have a different meaning altogether.
+
+    :param pattern: The anchored restriction pattern.
+
+    :returns: The compiled byte string pattern, or ``None`` if the
+              pattern must be applied to the decoded element.
+    """
+
+    if not pattern.isascii():
+        return None
+
+    # Any escaped letter or digit may be Unicode-aware; escaped
+    # punctuation is literal
+    if any(esc.isalnum() for esc in _escape_re.findall(pattern)):
+        return None
+
+    plain = _escape_re.sub('', pattern)
+    if '.' in plain or '[^' in plain or _flags_re.search(plain):
+        return None
+
+    return re.compile(pattern.encode('ascii'))
+
+
+def _restrict_domain(restrict):
+    """
+    Classify the path elements a restriction can match, to the extent
+    that can be determined.  Regular expression restrictions are
+    classified as either matching a fixed set of strings, or matching
+    only strings without any digits.
+
+    :param restrict: The restriction.
+
+    :returns: A tuple of the kind of domain--"int", "literals", or
+              "nodigits"--and, for "literals", the set of strings.
+              If the domain cannot be determined, returns ``None``.
+    """
+
+    # Memoization doesn't change what a restriction matches
+    if isinstance(restrict, Memoize):
+        restrict = restrict.func
+
+    if restrict is int:
+        return ('int', None)
+    elif not isinstance(restrict, str):
+        return None
+
+    # The pattern is anchored at the end when it's compiled
+    pattern = restrict[:-1] if restrict[-1:] == '$' else restrict
+
+    # Look for a set of alternative literals; note that the
+    # alternatives must be grouped, or the anchor only applies to the
+    # last of them
+    match = _group_re.match(pattern)
+    alts = match.group(1).split('|') if match else [pattern]
+    if all(alt and not _regex_meta.intersection(alt) for alt in alts):
+        return ('literals', frozenset(alts))
+
+    # Look for a character class with no digits
+    match = _class_re.match(pattern)
+    if match:
+        chars = match.group(1)
+        idx = 0
+        while idx < len(chars):
+            if chars[idx + 1:idx + 2] == '-' and idx + 2 < len(chars):
+                low, high = ord(chars[idx]), ord(chars[idx + 2])
+                idx += 3
+            else:
+                low = high = ord(chars[idx])
+                idx += 1
+
+            # Be conservative with large ranges
+            if (high - low > 256 or
+                    any(chr(code).isdigit()
+                        for code in range(low, high + 1))):
+                return None
+
+        return ('nodigits', None)
+
+    return None
+
+
+def _disjoint(domain1, domain2):
+    """
+    Determine whether two restrictions are provably unable to match
+    the same path element.
+
+    :param domain1: The domain of the first restriction, as returned
+                    by ``_restrict_domain()``.
+    :param domain2: The domain of the second restriction.
+
+    :returns: ``True`` if the restrictions are disjoint, ``False`` if
+              they are not or if it cannot be determined.
+    """
+
+    if domain1 is None or domain2 is None:
+        return False
+
+    kinds = {domain1[0], domain2[0]}
+    if kinds == {'literals'}:
+        return not (domain1[1] & domain2[1])
+    elif kinds == {'int', 'nodigits'}:
+        return True
+    elif kinds == {'int', 'literals'}:
+        literals = domain1[1] or domain2[1]
+        return not any(_is_int(literal) for literal in literals)
+
+    return False
+
+
+def _describe(obj):
+    """
+    Describe an object for export.  Strings are returned unchanged;
+    classes and functions are described by their module and qualified
+    name; anything else is described by its ``repr()``.
+
+    :param obj: The object to describe.
+
+    :returns: A string describing the object.
+    """
+
+    if isinstance(obj, str):
+        return obj
+
+    qualname = getattr(obj, '__qualname__', None)
+    if qualname is not None and hasattr(obj, '__module__'):
+        return '%s:%s' % (obj.__module__, qualname)
+
+    return repr(obj)
+
+
+def _host_key(host):
+    """
+    Canonicalize a host name for lookup.  The host is converted to
+    lower case, and any port number or trailing dot is removed.
+
+    :param host: The host name, as given in the URL or the "Host"
+                 header.
+
+    :returns: The canonical host name.
+    """
+
+    host = host.lower()
+
+    # Strip the port, taking care not to break IPv6 literals
+    idx = host.rfind(':')
+    if idx >= 0 and host.find(']', idx) < 0:
+        host = host[:idx]
+
+    return host.rstrip('.')
+
+
+@functools.lru_cache(maxsize=1024)
+def _host_candidates(host):
+    """
+    Compute the host patterns which may match a host name, from most
+    to least specific.  Since the set of host names a server sees is
+    usually small, the results are cached.
+
+    :param host: The host name, as given in the URL or the "Host"
+                 header.
+
+    :returns: A tuple of the canonical host name, followed by each of
+              the wildcard host patterns which would match it.
+    """
+
+    host = _host_key(host)
+    result = [host]
+
+    idx = host.find('.')
+    while idx >= 0:
+        result.append('*' + host[idx:])
+        idx = host.find('.', idx + 1)
+
+    return tuple(result)
+
+
+def _split_url(url):
+    """
+    Split a URL into its scheme, host, and path.  Only absolute URLs,
+    i.e., those with a "scheme://" prefix, are split; anything else
+    is assumed to be a bare path.
+
+    :param url: The URL to split.
+
+    :returns: A tuple of the scheme, the host, and the path.  If the
+              URL is not absolute, the scheme and host will be
+              ``None``.  Note that the scheme and host are returned
+              exactly as given in the URL, except that they are
+              decoded if the URL is a byte string; the path is
+              always returned as the same type as the URL.
+    """
+
+    binary = isinstance(url, _binary_types)
+    if binary:
+        colon, slash = b'://', b'/'
+    else:
+        colon, slash = '://', '/'
+
+    idx = url.find(colon)
+    if idx <= 0 or slash in url[:idx]:
+        return None, None, url
+
+    start = idx + 3
+    end = url.find(slash, start)
+    if end < 0:
+        scheme, host, path = url[:idx], url[start:], slash
+    else:
+        scheme, host, path = url[:idx], url[start:end], url[end:]
+
+    if binary:
+        scheme = scheme.decode('latin-1')
+        host = host.decode('latin-1')
+
+    return scheme, host, path
+
+
+def _path_normalize(path):
+    """
+    Split up a URL path into its component elements, normalizing it
+    in the same pass.  Repeated slashes are skipped, as for
+    ``_path_split()``; in addition, "." elements are dropped, ".."
+    elements drop the preceding element, if any, and each element is
+    percent-decoded.
+
+    :param path: The URL path to split.
 
+    :returns: A list of the normalized elements of the path.
+    """
+
+    if isinstance(path, _binary_types):
+        sep, pct, dot, dotdot = b'/', b'%', b'.', b'..'
+        decode = unquote_to_bytes
+    else:
+        sep, pct, dot, dotdot = '/', '%', '.', '..'
+        decode = unquote
+
+    # Only bother decoding if there's anything to decode
+    encoded = pct in path
+
+    elems = []
+    start = 0
+    end = len(path)
+
+    while start < end:
+        idx = path.find(sep, start)
+        if idx < 0:
+            idx = end
 
-__all__ = ['URLTree']
+        # Ignore repeated slashes
+        if idx > start:
+            elem = path[start:idx]
+            if encoded and pct in elem:
+                elem = decode(elem)
+
+            if elem == dotdot:
+                if elems:
+                    elems.pop()
+            elif elem != dot:
+                elems.append(elem)
+
+        start = idx + 1
+
+    return elems
 
 
 def _path_split(path):
@@ -65,33 +545,20 @@ def _path_split(path):
 
     :param path: The URL path to split.
 
-    :returns: An iterator which iterates over all the elements of the
-              path.
+    :returns: A list of all the elements of the path.
     """
 
-    # Initialize the state
-    start = None
-    slash = True
+    sep = b'/' if isinstance(path, _binary_types) else '/'
+    return [elem for elem in path.split(sep) if elem]
 
-    # Walk through the path
-    for idx, char in enumerate(path):
-        if char == '/':
-            if not slash:
-                # We hit the next slash, so yield the path element and
-                # reset
-                yield path[start:idx]
-                start = None
 
-                # Ignore repeated slashes
-                slash = True
-        elif start is None:
-            # Found the start of a path element
-            start = idx
-            slash = False
-
-    if start is not None:
-        # Make sure to yield the last element
-        yield path[start:]
+#: A record of a route added to a ``URLTree``.  The ``methods`` are
+#: the upper case HTTP methods, or ``None`` if the route matches all
+#: methods; ``predicate`` is the ``Predicate``, if any; and
+#: ``restrictions`` maps the names of the restricted parameters to
+#: their restrictions.
+Route = collections.namedtuple('Route', ['pattern', 'dest', 'methods',
+                                         'predicate', 'restrictions'])
 
 
 class MethodDict(dict):
@@ -107,23 +574,259 @@ class MethodDict(dict):
         will be returned when no element has been defined.
         """
 
-        super(MethodDict, self).__init__()
+        super().__init__()
 
         self.default = None
 
     def __missing__(self, key):
         """
-        Fill in missing keys.
+        Fill in missing keys.  Pseudo-methods such as "WEBSOCKET" are
+        not real HTTP methods, so a route without methods does not
+        match them.
 
         :param key: The key that couldn't be found.
 
         :returns: The defined default.
         """
 
+        if key in _pseudo_methods:
+            return None
+
         return self.default
 
 
-class URLNode(object):
+class Predicate:
+    """
+    Base class for route predicates.  A predicate restricts a route
+    to requests having a particular value--or any value--for some
+    attribute of the request other than the path.
+    """
+
+    kind = None
+
+    def __init__(self, name, value=None):
+        """
+        Initialize a ``Predicate``.
+
+        :param name: The name of the attribute to check.
+        :param value: The value the attribute must have.  If
+                      ``None``, the attribute need only be present.
+        """
+
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        """
+        Return a representation of the predicate.
+
+        :returns: A string representation of the predicate.
+        """
+
+        return '%s(%r, %r)' % (self.__class__.__name__, self.name,
+                               self.value)
+
+
+class Query(Predicate):
+    """
+    A predicate on a query string parameter.  If the parameter is
+    given more than once, only the first value is considered.
+    """
+
+    kind = 'query'
+
+
+class Header(Predicate):
+    """
+    A predicate on a request header.  Header names are compared case
+    insensitively.
+    """
+
+    kind = 'header'
+
+    def __init__(self, name, value=None):
+        """
+        Initialize a ``Header``.
+
+        :param name: The name of the header.
+        :param value: The value the header must have.  If ``None``,
+                      the header need only be present.
+        """
+
+        super().__init__(name.lower(), value)
+
+
+class Memoize:
+    """
+    A wrapper for a restriction function which remembers its results
+    for the most recently seen path elements, so that an expensive
+    conversion is not repeated for every request.  Failures to
+    convert, signalled by ``ValueError``, are remembered as well.
+    Since the results are shared between requests, the function
+    should not return mutable objects.
+
+    Two ``Memoize`` objects wrapping the same function compare equal,
+    so the same restriction may be given for a variable in several
+    routes; the variable node keeps the first, and its cache is
+    shared by all of those routes.
+    """
+
+    def __init__(self, func, size=1024):
+        """
+        Initialize a ``Memoize``.
+
+        :param func: The restriction function to wrap.
+        :param size: The maximum number of path elements to remember
+                     the results for.
+        """
+
+        # Don't copy the function's __dict__; for a type such as int,
+        # that would copy all of its methods onto the instance
+        functools.update_wrapper(self, func, updated=())
+
+        self.func = func
+        self.size = size
+
+        # The cache maps path elements to a tuple of a flag indicating
+        # success and either the result or the exception
+        self._cache = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __call__(self, elem):
+        """
+        Convert a path element, consulting the cache first.
+
+        :param elem: The path element.
+
+        :returns: The result of the restriction function.
+        """
+
+        cache = self._cache
+        try:
+            success, result = cache[elem]
+            cache.move_to_end(elem)
+        except KeyError:
+            self._misses += 1
+            try:
+                success, result = True, self.func(elem)
+            except ValueError as exc:
+                success, result = False, exc
+
+            cache[elem] = success, result
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+                self._evictions += 1
+        else:
+            self._hits += 1
+
+        if not success:
+            # Don't let the traceback grow each time it's raised
+            raise result.with_traceback(None)
+
+        return result
+
+    def __eq__(self, other):
+        """
+        Compare two ``Memoize`` objects.
+
+        :param other: The object to compare to.
+
+        :returns: ``True`` if ``other`` is a ``Memoize`` wrapping the
+                  same function, ``False`` otherwise.
+        """
+
+        if not isinstance(other, Memoize):
+            return NotImplemented
+
+        return self.func == other.func
+
+    def __hash__(self):
+        """
+        Compute a hash for the ``Memoize``.
+
+        :returns: The hash of the wrapped function.
+        """
+
+        return hash(self.func)
+
+    def __repr__(self):
+        """
+        Return a representation of the ``Memoize``.
+
+        :returns: A string representation of the ``Memoize``.
+        """
+
+        return '%s(%r, %r)' % (self.__class__.__name__, self.func,
+                               self.size)
+
+    def stats(self, reset=False):
+        """
+        Report how effective the cache has been.
+
+        :param reset: If ``True``, the counts are reset to zero.  The
+                      cache itself is kept.
+
+        :returns: A dictionary with the keys "hits", "misses", and
+                  "evictions", giving the number of calls answered
+                  from the cache, the number of calls to the wrapped
+                  function, and the number of results discarded to
+                  keep the cache within its size; and "size", the
+                  number of results currently cached.
+        """
+
+        result = dict(hits=self._hits, misses=self._misses,
+                      evictions=self._evictions, size=len(self._cache))
+        if reset:
+            self._hits = self._misses = self._evictions = 0
+
+        return result
+
+
+class PredicateIndex:
+    """
+    Index of the destinations for the predicated routes of a node
+    which share the same predicate kind and name.  The destinations
+    are indexed by the exact value required by the predicate.
+    """
+
+    def __init__(self, kind, name):
+        """
+        Initialize a ``PredicateIndex``.
+
+        :param kind: The kind of the predicate, e.g., "query".
+        :param name: The name of the attribute the predicate checks.
+        """
+
+        self.kind = kind
+        self.name = name
+        self.values = {}
+        self.present = None
+
+    def get_dests(self, value):
+        """
+        Get the destinations for a given predicate value, creating
+        them if necessary.
+
+        :param value: The value required by the predicate, or
+                      ``None`` if any value is accepted.
+
+        :returns: The ``MethodDict`` holding the destinations.
+        """
+
+        if value is None:
+            if self.present is None:
+                self.present = MethodDict()
+            return self.present
+
+        if value not in self.values:
+            self.values[value] = MethodDict()
+
+        return self.values[value]
+
+
+class URLNode:
     """
     Base class for URL nodes.  Represents a single element of the URL
     to be resolved.
@@ -135,9 +838,15 @@ class URLNode(object):
         """
 
         self._children = {}
+        self._bchildren = {}
         self._variables = {}
         self._defaults = []
+        self._templates = {}
+        self._partials = []
+        self._tail = None
         self._dest = MethodDict()
+        self._preds = []
+        self._hits = 0
 
     def _get_var_child(self, name, restrict):
         """
@@ -159,7 +868,7 @@ class URLNode(object):
                 raise NameError("variable node %r restriction mismatch")
         else:
             # Check for matching restrictions
-            for chk_node in self._defaults:
+            for chk_node in self._variables.values():
                 if chk_node._restrict == restrict:
                     # Complain about the mismatch
                     raise NameError("variable node name mismatch: %s != %s" %
@@ -168,19 +877,159 @@ class URLNode(object):
             # Create new variable node
             node = URLVarNode(name, restrict)
             self._variables[name] = node
+            self._order_defaults()
 
-            # Insert it into the appropriate place.  We want variable
-            # nodes with no set restrict to always be at the end,
-            # which is the reason for the complicated append
-            # vs. insert logic here...
-            if (restrict is None or not self._defaults or
-                    self._defaults[-1]._restrict is not None):
-                self._defaults.append(node)
-            else:
-                self._defaults.insert(-1, node)
+        return node
+
+    def _order_defaults(self):
+        """
+        Rebuild the list of variable nodes in the order in which they
+        are to be tried.  This is the order of ``_variables``, except
+        that the variable node with no restriction, if any, is always
+        last.
+        """
+
+        self._defaults = sorted(self._variables.values(),
+                                key=lambda node: node._restrict is None)
+
+    def _optimize(self):
+        """
+        Reorder the restricted variable nodes that are children of this
+        node so that the most frequently matched are tried first.  A
+        node is only moved ahead of another if their restrictions are
+        provably disjoint, so the result of matching any path element
+        is unchanged.
+
+        :returns: ``True`` if the order was changed, ``False``
+                  otherwise.
+        """
+
+        restricted = [node for node in self._defaults
+                      if node._restrict is not None]
+        if len(restricted) < 2:
+            return False
+
+        domains = {node._name: _restrict_domain(node._restrict)
+                   for node in restricted}
+
+        # Repeatedly pick the most frequently matched node from among
+        # those which don't have to follow some other remaining node
+        order = []
+        remaining = restricted[:]
+        while remaining:
+            best = None
+            for idx, node in enumerate(remaining):
+                if best is not None and node._hits <= best._hits:
+                    continue
+                if all(_disjoint(domains[other._name], domains[node._name])
+                       for other in remaining[:idx]):
+                    best = node
+            order.append(best)
+            remaining.remove(best)
+
+        if order == restricted:
+            return False
+
+        # The order of _variables determines the order of _defaults
+        order.extend(node for node in self._defaults
+                     if node._restrict is None)
+        self._variables = {node._name: node for node in order}
+        self._order_defaults()
+
+        return True
+
+    def _descendants(self):
+        """
+        Iterate over this node and all the nodes below it.
+
+        :returns: An iterator of nodes.
+        """
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+
+            stack.extend(node._children.values())
+            stack.extend(node._partials)
+            stack.extend(node._variables.values())
+            if node._tail is not None:
+                stack.append(node._tail)
+
+    def _get_template_child(self, parts, restricts):
+        """
+        Get the partial element node that's a child of this node,
+        creating it if necessary.
+
+        :param parts: A list of the parts of the path element, as
+                      returned by splitting it with ``_var_re``.  The
+                      even-numbered items are constant text, and the
+                      odd-numbered items are variable names.
+        :param restricts: A list of the restrictions on the variable
+                          parts, in order.
+
+        :returns: The desired partial element node.
+        """
+
+        restricts = tuple(restricts)
+        names = tuple(parts[1::2])
+        key = (tuple(parts[::2]), restricts)
+
+        if key in self._templates:
+            node = self._templates[key]
+            if node._names != names:
+                # Complain about the mismatch
+                raise NameError("partial element node name mismatch: "
+                                "%s != %s" % (', '.join(names),
+                                              ', '.join(node._names)))
+        else:
+            # Check for matching names
+            for (fixed, _restricts), chk_node in self._templates.items():
+                if fixed == key[0] and chk_node._names == names:
+                    # Complain about the mismatch
+                    raise NameError("partial element node restriction "
+                                    "mismatch: %s" % ', '.join(names))
+
+            node = URLTemplateNode(parts, restricts)
+            self._templates[key] = node
+
+            # Keep the most specific partial elements first; the
+            # search skips over all the nodes with the same or more
+            # constant text, so insertion order is otherwise
+            # preserved
+            idx = len(self._partials)
+            while idx and self._partials[idx - 1]._fixed < node._fixed:
+                idx -= 1
+            self._partials.insert(idx, node)
 
         return node
 
+    def _get_tail_child(self, name, restrict):
+        """
+        Get the catch-all variable node that's a child of this node,
+        creating it with the given name if necessary.
+
+        :param name: The name that will be used to represent the value
+                     in the parameters.
+        :param restrict: Restrictions on whether this parameter will
+                         match.
+
+        :returns: The desired catch-all variable node.
+        """
+
+        if self._tail is None:
+            self._tail = URLTailNode(name, restrict)
+        elif self._tail._name != name:
+            # Complain about the mismatch
+            raise NameError("catch-all variable node name mismatch: "
+                            "%s != %s" % (name, self._tail._name))
+        elif self._tail._restrict != restrict:
+            # Complain about the mismatch
+            raise NameError("catch-all variable node %r restriction "
+                            "mismatch" % name)
+
+        return self._tail
+
     def _get_child(self, elem):
         """
         Get the element node that's a child of this node and has the
@@ -188,19 +1037,141 @@ class URLNode(object):
 
         :param elem: The path element the node will be stored under.
 
-        :returns: The desired node.
-        """
+        :returns: The desired node.
+        """
+
+        # Create the element if necessary; interning saves memory
+        # when the same element appears throughout the tree
+        if elem not in self._children:
+            elem = sys.intern(elem)
+            self._children[elem] = URLNode()
+
+            # Also index it for byte string lookups
+            self._bchildren[elem.encode('utf-8')] = self._children[elem]
+
+        return self._children[elem]
+
+    def _get_pred_dests(self, pred):
+        """
+        Get the destinations for routes with the given predicate,
+        creating them if necessary.
+
+        :param pred: The ``Predicate``.
+
+        :returns: The ``MethodDict`` holding the destinations.
+        """
+
+        for index in self._preds:
+            if index.kind == pred.kind and index.name == pred.name:
+                break
+        else:
+            index = PredicateIndex(pred.kind, pred.name)
+            self._preds.append(index)
+
+        return index.get_dests(pred.value)
+
+    def _has_dest(self):
+        """
+        Determine whether any routes terminate at this node.
+
+        :returns: ``True`` if there are routes terminating at this
+                  node, ``False`` otherwise.
+        """
+
+        return bool(self._dest or self._dest.default is not None or
+                    self._preds)
+
+    def _allowed(self):
+        """
+        Determine the HTTP methods routed at this node.  Methods which
+        are only routed subject to a predicate are not included, nor
+        are pseudo-methods such as "WEBSOCKET", which are of no use in
+        an "Allow" header.
+
+        :returns: A sorted list of the HTTP methods.
+        """
+
+        return sorted(meth for meth, dest in self._dest.items()
+                      if dest and meth not in _pseudo_methods)
+
+    def _select(self, method, query, headers, get_header):
+        """
+        Select the destination for a request which resolved to this
+        node.  Predicated routes are checked first.
+
+        :param method: The HTTP method of the request, in upper case.
+        :param query: The query string of the request, or ``None``.
+        :param headers: The source of the request headers, or
+                        ``None``.
+        :param get_header: A function taking ``headers`` and a lower
+                           case header name and returning the value
+                           of the header, or ``None`` if it is not
+                           present.
+
+        :returns: The destination, or ``None`` if there is none.
+        """
+
+        if self._preds:
+            args = None
+            for index in self._preds:
+                if index.kind == 'query':
+                    # Only parse the query string when we need to
+                    if args is None:
+                        args = {}
+                        for key, value in parse_qsl(query or '', True):
+                            args.setdefault(key, value)
+                    value = args.get(index.name)
+                elif headers is not None:
+                    value = get_header(headers, index.name)
+                else:
+                    value = None
+
+                if value is None:
+                    continue
+
+                dests = index.values.get(value)
+                if dests is not None and dests[method]:
+                    return dests[method]
+                if index.present is not None and index.present[method]:
+                    return index.present[method]
+
+        return self._dest[method]
+
+    def _resolve_child(self, elem, params):
+        """
+        Look up the appropriate child element for the given next URL
+        element.
+
+        :param elem: The path element.
+        :param params: A dictionary of parameters that is developed
+                       from the URL.
+
+        :returns: The appropriate child element, or ``None`` if the
+                  child cannot be found.
+        """
+
+        # Handle the case of an exact match first
+        if (elem in self._children and
+                self._children[elem]._match(elem, params)):
+            return self._children[elem]
+
+        # Next, try the partial elements
+        for node in self._partials:
+            if node._match(elem, params):
+                return node
 
-        # Create the element if necessary
-        if elem not in self._children:
-            self._children[elem] = URLNode()
+        # OK, check on the default elements
+        for node in self._defaults:
+            if node._match(elem, params):
+                return node
 
-        return self._children[elem]
+        # No matching child, then
+        return None
 
-    def _resolve_child(self, elem, params):
+    def _resolve_child_bytes(self, elem, params):
         """
         Look up the appropriate child element for the given next URL
-        element.
+        element, which is a UTF-8 encoded byte string.
 
         :param elem: The path element.
         :param params: A dictionary of parameters that is developed
@@ -211,13 +1182,18 @@ class URLNode(object):
         """
 
         # Handle the case of an exact match first
-        if (elem in self._children and
-                self._children[elem]._match(elem, params)):
-            return self._children[elem]
+        node = self._bchildren.get(elem)
+        if node is not None:
+            return node
+
+        # Next, try the partial elements
+        for node in self._partials:
+            if node._match_bytes(elem, params):
+                return node
 
         # OK, check on the default elements
         for node in self._defaults:
-            if node._match(elem, params):
+            if node._match_bytes(elem, params):
                 return node
 
         # No matching child, then
@@ -237,6 +1213,21 @@ class URLNode(object):
 
         return True
 
+    def _match_bytes(self, elem, params):
+        """
+        Check if the element, which is a UTF-8 encoded byte string,
+        actually matches this node.
+
+        :params elem: The path element.
+        :param params: A dictionary of parameters that is developed
+                       from the URL.
+
+        :returns: ``True`` if the element matches, ``False``
+                  otherwise.
+        """
+
+        return True
+
 
 class URLVarNode(URLNode):
     """
@@ -253,18 +1244,20 @@ class URLVarNode(URLNode):
         :param name: The name of the variable.
         """
 
-        super(URLVarNode, self).__init__()
+        super().__init__()
         self._name = name
         self._restrict = restrict
         self._pattern = None
+        self._bpattern = None
 
         # Compile the pattern
-        if isinstance(restrict, basestring):
+        if isinstance(restrict, str):
             # Anchor the end of the pattern
             if restrict[-1:] != '$':
                 restrict += '$'
 
             self._pattern = re.compile(restrict)
+            self._bpattern = _bytes_pattern(restrict)
 
     def _match(self, elem, params):
         """
@@ -297,6 +1290,146 @@ class URLVarNode(URLNode):
         params[self._name] = elem
         return True
 
+    def _match_bytes(self, elem, params):
+        """
+        Check if the element, which is a UTF-8 encoded byte string,
+        actually matches this node.  Additionally adds the element to
+        the parameters dictionary in the correct location.  Regular
+        expression restrictions which match the same elements either
+        way are first applied to the byte string itself, so that
+        mismatches are rejected without decoding; the value saved is
+        always the match on the decoded element.
+
+        :params elem: The path element.
+        :param params: A dictionary of parameters that is developed
+                       from the URL.
+
+        :returns: ``True`` if the element matches, ``False``
+                  otherwise.
+        """
+
+        # Reject mismatches cheaply
+        if self._bpattern is not None and self._bpattern.match(elem) is None:
+            return False
+
+        try:
+            elem = elem.decode('utf-8')
+        except ValueError:
+            # Failed to decode it...
+            return False
+
+        return self._match(elem, params)
+
+
+class URLTemplateNode(URLNode):
+    """
+    Represent a partial element node in the URL tree.  Partial element
+    nodes match path elements consisting of constant text mixed with
+    one or more variable parts.  Each variable part is handled by an
+    embedded ``URLVarNode``, which applies any restrictions and saves
+    the value in the parameters dictionary.
+    """
+
+    def __init__(self, parts, restricts):
+        """
+        Initialize a ``URLTemplateNode``.
+
+        :param parts: A list of the parts of the path element, as
+                      returned by splitting it with ``_var_re``.  The
+                      even-numbered items are constant text, and the
+                      odd-numbered items are variable names.
+        :param restricts: A tuple of the restrictions on the variable
+                          parts, in order.
+        """
+
+        super().__init__()
+        self._restricts = restricts
+        self._names = tuple(parts[1::2])
+        self._prefix = parts[0]
+        self._suffix = parts[-1]
+        self._fixed = sum(len(part) for part in parts[::2])
+        self._vars = [URLVarNode(name, restrict)
+                      for name, restrict in zip(parts[1::2], restricts)]
+        self._minlen = self._fixed + len(self._vars)
+        self._regex = None
+
+        # A regular expression is only needed to find the boundaries
+        # between multiple variable parts
+        if len(self._vars) > 1:
+            self._regex = re.compile('(.+)'.join(
+                re.escape(part) for part in parts[::2]) + '$')
+
+    def _match(self, elem, params):
+        """
+        Check if the element actually matches this node.  Additionally
+        adds the values of the variable parts to the parameters
+        dictionary in the correct locations.
+
+        :params elem: The path element.
+        :param params: A dictionary of parameters that is developed
+                       from the URL.
+
+        :returns: ``True`` if the element matches, ``False``
+                  otherwise.
+        """
+
+        # Check the constant text first; it's cheap
+        if (len(elem) < self._minlen or not elem.startswith(self._prefix) or
+                not elem.endswith(self._suffix)):
+            return False
+
+        # With only one variable part, we already know its value
+        if self._regex is None:
+            return self._vars[0]._match(
+                elem[len(self._prefix):len(elem) - len(self._suffix)],
+                params)
+
+        match = self._regex.match(elem)
+        if match is None:
+            return False
+
+        # Don't touch params unless all the variable parts match
+        values = {}
+        for var, value in zip(self._vars, match.groups()):
+            if not var._match(value, values):
+                return False
+
+        params.update(values)
+        return True
+
+    def _match_bytes(self, elem, params):
+        """
+        Check if the element, which is a UTF-8 encoded byte string,
+        actually matches this node.  The element is decoded and
+        matched as text.
+
+        :params elem: The path element.
+        :param params: A dictionary of parameters that is developed
+                       from the URL.
+
+        :returns: ``True`` if the element matches, ``False``
+                  otherwise.
+        """
+
+        try:
+            elem = elem.decode('utf-8')
+        except ValueError:
+            return False
+
+        return self._match(elem, params)
+
+
+class URLTailNode(URLVarNode):
+    """
+    Represent a catch-all variable node in the URL tree.  Catch-all
+    variable nodes are like variable nodes, except that they are
+    matched against all the remaining text of the URL, rather than
+    against a single path element.  Catch-all variable nodes never
+    have children.
+    """
+
+    pass
+
 
 class URLTree(URLNode):
     """
@@ -304,22 +1437,377 @@ class URLTree(URLNode):
     URLs are resolved using the ``resolve()`` method.
     """
 
+    def __init__(self, normalize=False, stats=False, reject_cache=0):
+        """
+        Initialize a ``URLTree``.
+
+        :param normalize: If ``True``, ``resolve()`` will resolve dot
+                          segments and percent-decode path elements
+                          as it splits the path.  This also applies to
+                          the "raw_path" in ``ASGIDispatcher``, but
+                          not to ``WSGIDispatcher``, since WSGI
+                          servers already decode the path.
+        :param stats: If ``True``, count how often each node is
+                      reached, for the benefit of ``optimize()``.
+        :param reject_cache: The maximum number of unresolvable paths
+                             to remember, so that repeated requests
+                             for them can be rejected without walking
+                             the tree.  The default, 0, disables the
+                             cache.
+        """
+
+        super().__init__()
+
+        self._normalize = normalize
+        self._stats = stats
+        self.reject_cache = reject_cache
+
+        # The cache of unresolvable paths, the tree version it was
+        # built for, and the counts of unresolvable paths
+        self._rejected = collections.OrderedDict()
+        self._reject_version = None
+        self._rejects = dict(unresolved=0, cached=0)
+
+        # Returned in place of a node when a path is rejected from the
+        # cache
+        self._nowhere = URLNode()
+
+        # Maps (scheme, host) to the root node for that virtual host;
+        # the tree itself is the root for (None, None)
+        self._vhosts = {}
+
+        # Incremented whenever a route is added, so that anything
+        # caching resolution results can tell when to discard them
+        self._version = 0
+
+        # The registry of routes, in the order they were added, and
+        # indexes into it by destination and by the identity of the
+        # node the route ends at; unhashable destinations are indexed
+        # by identity
+        self._routes = []
+        self._dest_routes = {}
+        self._dest_id_routes = {}
+        self._node_routes = {}
+
+    def _get_root(self, scheme, host):
+        """
+        Get the root node for the given scheme and host pattern,
+        creating it if necessary.
+
+        :param scheme: The scheme from the URL pattern, or ``None``.
+        :param host: The host from the URL pattern, or ``None``.
+
+        :returns: The desired root node.
+        """
+
+        scheme = None if scheme in (None, '*') else scheme.lower()
+        if host is not None:
+            host = _host_key(host)
+            if host == '*':
+                host = None
+            elif '*' in (host[2:] if host[:2] == '*.' else host):
+                raise ValueError("invalid host pattern %r" % host)
+
+        if scheme is None and host is None:
+            return self
+
+        key = (scheme, host)
+        if key not in self._vhosts:
+            self._vhosts[key] = URLNode()
+
+        return self._vhosts[key]
+
+    def _vhost_roots(self, scheme, host):
+        """
+        Iterate over the virtual host root nodes which may apply to a
+        given scheme and host, from most to least specific.  The tree
+        itself is not included.
+
+        :param scheme: The scheme of the request, or ``None``.
+        :param host: The host of the request, or ``None``.
+
+        :returns: An iterator which iterates over the root nodes.
+        """
+
+        vhosts = self._vhosts
+        schemes = (None,) if scheme is None else (scheme.lower(), None)
+
+        if host is not None:
+            # The exact host first, then the wildcards
+            for pattern in _host_candidates(host):
+                for sch in schemes:
+                    root = vhosts.get((sch, pattern))
+                    if root is not None:
+                        yield root
+
+        # Finally, routes for the scheme alone
+        if scheme is not None:
+            root = vhosts.get((schemes[0], None))
+            if root is not None:
+                yield root
+
+    def _walks(self, scheme, host, path):
+        """
+        Walk the tree from each root node which may apply to a URL:
+        the virtual host root nodes applicable to the scheme and host,
+        from most to least specific, and finally the tree itself.
+
+        :param scheme: The scheme of the request, or ``None``.
+        :param host: The host of the request, or ``None``.
+        :param path: The URL path.
+
+        :returns: An iterator over the results of ``_walk()`` from
+                  each root node.  The walks are performed lazily.
+        """
+
+        if self._vhosts and (scheme is not None or host is not None):
+            for root in self._vhost_roots(scheme, host):
+                yield self._walk(root, path)
+
+        yield self._walk(self, path)
+
+    def _resolve(self, method, scheme, host, path, query, headers,
+                 get_header, walks=None):
+        """
+        Resolve a request whose URL has already been split up.  This
+        is the common core of ``resolve()`` and the dispatchers; if
+        there are virtual host root nodes applicable to the scheme and
+        host, the walk to use is chosen by ``_select_walk()``.  If the
+        cache of unresolvable paths is enabled, paths found there are
+        rejected without walking the tree at all, and an empty node is
+        returned.
+
+        :param method: The HTTP method of the request, in upper case.
+        :param scheme: The scheme of the request, or ``None``.
+        :param host: The host of the request, or ``None``.
+        :param path: The URL path, as for ``_walk()``.
+        :param query: The query string, or ``None``.  A byte string
+                      is decoded as ISO-8859-1 if there are predicates
+                      to evaluate.
+        :param headers: The request headers, in whatever form
+                        ``get_header`` expects.
+        :param get_header: A function which looks up a header, given
+                           ``headers`` and the lower-case header name.
+        :param walks: The results of ``_walks()`` for the URL, if they
+                      are already known, e.g., from a cache.  The cache
+                      of unresolvable paths is not consulted in that
+                      case, since the caller has already walked the
+                      tree, but the path is still added to it if it
+                      turns out to be unresolvable.
+
+        :returns: A tuple of the node that was reached, the
+                  destination (``None`` if the request did not
+                  resolve), a dictionary of parameters, and the index
+                  in ``path`` of the first unconsumed path element, as
+                  for ``_walk()``.
+        """
+
+        if walks is None:
+            # Consult the cache of unresolvable paths
+            if self.reject_cache and self._is_rejected(scheme, host, path):
+                return self._nowhere, None, {}, None
+
+            if self._vhosts and (scheme is not None or host is not None):
+                walks = self._walks(scheme, host, path)
+
+        if walks is None:
+            node, params, rest = self._walk(self, path)
+            if node._preds and isinstance(query, bytes):
+                query = query.decode('latin-1')
+            dest = node._select(method, query, headers, get_header)
+        else:
+            node, dest, params, rest = self._select_walk(
+                walks, method, query, headers, get_header)
+
+        if not dest and not node._has_dest():
+            self._rejects['unresolved'] += 1
+            if self.reject_cache:
+                self._rejected[self._reject_key(scheme, host, path)] = True
+                if len(self._rejected) > self.reject_cache:
+                    self._rejected.popitem(last=False)
+
+        return node, dest, params, rest
+
+    def _reject_key(self, scheme, host, path):
+        """
+        Compute the key for a request in the cache of unresolvable
+        paths, discarding the cache first if the routes have changed.
+
+        :param scheme: The scheme of the request, or ``None``.
+        :param host: The host of the request, or ``None``.
+        :param path: The URL path, as for ``_walk()``.
+
+        :returns: The key.
+        """
+
+        if self._reject_version != self._version:
+            self._rejected.clear()
+            self._reject_version = self._version
+
+        if isinstance(path, list):
+            path = tuple(path)
+        if self._vhosts:
+            return (scheme, host, path)
+        return (None, None, path)
+
+    def _is_rejected(self, scheme, host, path):
+        """
+        Look up a request in the cache of unresolvable paths, counting
+        it as unresolved if it is found there.
+
+        :param scheme: The scheme of the request, or ``None``.
+        :param host: The host of the request, or ``None``.
+        :param path: The URL path, as for ``_walk()``.
+
+        :returns: ``True`` if the path is known to be unresolvable,
+                  ``False`` otherwise.
+        """
+
+        key = self._reject_key(scheme, host, path)
+        if key not in self._rejected:
+            return False
+
+        self._rejected.move_to_end(key)
+        self._rejects['cached'] += 1
+        self._rejects['unresolved'] += 1
+        return True
+
+    def _select_walk(self, walks, method, query, headers, get_header):
+        """
+        Choose among the walks from each applicable root node, and
+        select the destination.  A virtual host subtree only takes
+        precedence if it consumed the whole path and has a destination
+        for the request; otherwise, the walk from the tree itself is
+        used.  A virtual host subtree which consumed only part of the
+        path is the last resort.  If the request does not resolve, the
+        node which comes closest is returned, so that a "405 Method Not
+        Allowed" response may be given where appropriate.
+
+        :param walks: An iterable of the results of ``_walk()`` from
+                      each root node, as produced by ``_walks()``; the
+                      last must be the walk from the tree itself.
+        :param method: The HTTP method of the request, in upper case.
+        :param query: The query string, or ``None``.
+        :param headers: The request headers.
+        :param get_header: A function which looks up a header.
+
+        :returns: A tuple of the node, the destination, the
+                  parameters, and the index of the first unconsumed
+                  path element, as for ``_resolve()``.
+        """
+
+        if isinstance(query, bytes):
+            query = query.decode('latin-1')
+
+        partial = closest = walk = None
+        for walk in walks:
+            node, params, rest = walk
+            if not node._has_dest():
+                continue
+            elif rest is not None:
+                if partial is None:
+                    partial = walk
+                continue
+
+            dest = node._select(method, query, headers, get_header)
+            if dest:
+                return node, dest, params, rest
+            elif closest is None:
+                closest = walk
+
+        # The last walk was from the tree itself, so it may resolve a
+        # path it only partly consumed
+        node, params, rest = walk
+        if rest is not None and node._has_dest():
+            dest = node._select(method, query, headers, get_header)
+            if dest:
+                return node, dest, params, rest
+
+        if partial is not None and partial is not walk:
+            dest = partial[0]._select(method, query, headers, get_header)
+            if dest:
+                return partial[0], dest, partial[1], partial[2]
+
+        # Nothing resolved; the tree itself takes precedence if it got
+        # anywhere at all
+        if not node._has_dest():
+            node, params, rest = closest or partial or walk
+
+        return node, None, params, rest
+
+    def _split_request(self, url):
+        """
+        Split up a URL for ``_resolve()``, normalizing the path if the
+        tree was created with ``normalize=True``.
+
+        :param url: The URL.  May be a byte string, ``bytearray``, or
+                    ``memoryview``.
+
+        :returns: A tuple of the scheme, host, path, and query string.
+                  The scheme and host will be ``None`` if the URL is
+                  not absolute; the path will be a list of path
+                  elements if it was normalized.
+        """
+
+        if isinstance(url, _binary_types):
+            if not isinstance(url, bytes):
+                url = bytes(url)
+            sep = b'?'
+        else:
+            sep = '?'
+
+        scheme, host, path = _split_url(url)
+        path, _sep, query = path.partition(sep)
+        if self._normalize:
+            path = _path_normalize(path)
+
+        return scheme, host, path, query
+
+    def rejects(self, reset=False):
+        """
+        Report how many requests have been for unresolvable paths,
+        e.g., for feeding into rate limiting.  Note that requests for
+        a path which resolves, but not for the requested method, are
+        not counted.
+
+        :param reset: If ``True``, the counts are reset to zero.
+
+        :returns: A dictionary with the keys "unresolved" (the number
+                  of requests for unresolvable paths) and "cached"
+                  (how many of those were rejected from the cache of
+                  unresolvable paths).
+        """
+
+        result = dict(self._rejects)
+        if reset:
+            self._rejects = dict.fromkeys(result, 0)
+
+        return result
+
     def route(self, *methods, **restrictions):
         """
         Add a route to the tree.  Takes two required positional
         arguments--the URL pattern for the route to match on, and the
         destination for the route.  Remaining positional arguments are
         interpreted as HTTP methods for the route to match on--if none
-        are given, the route will match on all HTTP methods.  (Note
-        that methods are treated case insensitively.)  Keyword
-        arguments specify any restrictions on the parameters; if a
-        restriction is a string, it is interpreted as a regular
-        expression which the value must match, and the match object
-        will be the value of the parameter (allowing access to, e.g.,
-        parenthesized groups).  If, on the other hand, the restriction
-        is a function, that function will be called, and its return
-        value will become the value of the parameter; the function may
-        raise ``ValueError`` to indicate a mismatch.
+        are given, the route will match on all HTTP methods, though not
+        on the "websocket" pseudo-method.  (Note that methods are
+        treated case insensitively.)  A ``Query`` or ``Header``
+        predicate may be given along with the methods to further
+        restrict the route.  Keyword arguments specify any
+        restrictions on the parameters; if a restriction is a string,
+        it is interpreted as a regular expression which the value
+        must match, and the match object will be the value of the
+        parameter (allowing access to, e.g., parenthesized groups).
+        If, on the other hand, the restriction is a function, that
+        function will be called, and its return value will become the
+        value of the parameter; the function may raise ``ValueError``
+        to indicate a mismatch.
+
+        The URL pattern may be an absolute URL, in which case the
+        route will only match requests for the given scheme and
+        host.  Either may be "*" to match any value, and the host may
+        be a wildcard of the form "*.example.com".
 
         Note that destinations may be any value; they are simply
         returned when the route matches in ``resolve()``.
@@ -333,34 +1821,261 @@ class URLTree(URLNode):
                             len(methods))
 
         url, dest = methods[:2]
+        scheme, host, path = _split_url(url)
 
-        node = self
+        self._version += 1
+        node = self._get_root(scheme, host)
         params = set()
+        elems = _path_split(path)
 
         # Iterate over the URI path elements
-        for elem in _path_split(url):
-            if (elem[:1], elem[-1:]) == ('{', '}'):
-                name = elem[1:-1]
+        for idx, elem in enumerate(elems):
+            parts = _var_re.split(elem)
+            if len(parts) == 1:
+                node = node._get_child(elem)
+            elif len(parts) > 3 or parts[0] or parts[2]:
+                names = parts[1::2]
+
+                # Sanity-check the variable parts
+                for name in names:
+                    if name[-2:] == ':*':
+                        raise ValueError("catch-all parameter %r must be "
+                                         "a complete path element" %
+                                         name[:-2])
+                    elif name in params:
+                        raise NameError("duplicate parameter name %r" % name)
+                    params.add(name)
+                if '' in parts[2:-1:2]:
+                    raise ValueError("adjacent variables in path element %r" %
+                                     elem)
+
+                node = node._get_template_child(
+                    parts, [restrictions.get(name) for name in names])
+            else:
+                name = parts[1]
+                tail = name[-2:] == ':*'
+                if tail:
+                    name = name[:-2]
+
+                    # The catch-all must come last
+                    if idx != len(elems) - 1:
+                        raise ValueError("catch-all parameter %r must be "
+                                         "the last path element" % name)
 
                 # Check for duplicates
                 if name in params:
                     raise NameError("duplicate parameter name %r" % name)
 
-                node = node._get_var_child(name, restrictions.get(name))
+                if tail:
+                    node = node._get_tail_child(name, restrictions.get(name))
+                else:
+                    node = node._get_var_child(name, restrictions.get(name))
                 params.add(name)
-            else:
-                node = node._get_child(elem)
+
+        # Separate out any predicate
+        preds = [meth for meth in methods[2:] if isinstance(meth, Predicate)]
+        methods = [meth for meth in methods[2:]
+                   if not isinstance(meth, Predicate)]
+        if len(preds) > 1:
+            raise TypeError("route() takes at most 1 predicate (%d given)" %
+                            len(preds))
+        dests = node._get_pred_dests(preds[0]) if preds else node._dest
 
         # Store the destination under the appropriate HTTP method(s)
-        if len(methods) > 2:
-            for method in methods[2:]:
-                node._dest[method.upper()] = dest
+        if methods:
+            methods = tuple(method.upper() for method in methods)
+            for method in methods:
+                dests[method] = dest
         else:
-            node._dest.default = dest
+            methods = None
+            dests.default = dest
+
+        # Record the route in the registry
+        self._register(Route(url, dest, methods, preds[0] if preds else None,
+                             {name: restrictions[name]
+                              for name in sorted(params)
+                              if restrictions.get(name) is not None}),
+                       node)
 
         return params
 
-    def resolve(self, method, url):
+    def _register(self, route, node):
+        """
+        Add a route to the registry.
+
+        :param route: The ``Route`` to add.
+        :param node: The node the route ends at.
+        """
+
+        self._routes.append(route)
+        self._node_routes.setdefault(id(node), []).append(route)
+
+        try:
+            self._dest_routes.setdefault(route.dest, []).append(route)
+        except TypeError:
+            self._dest_id_routes.setdefault(id(route.dest), []).append(route)
+
+    def routes(self):
+        """
+        Iterate over all the routes in the tree, in the order in which
+        they were added.
+
+        :returns: An iterator of ``Route`` objects.
+        """
+
+        return iter(self._routes)
+
+    def patterns_for(self, dest):
+        """
+        Look up the URL patterns of all the routes for a destination.
+
+        :param dest: The destination.
+
+        :returns: A list of the URL patterns, in the order in which the
+                  routes were added.  A pattern will be repeated if
+                  it was routed more than once, e.g., for different
+                  HTTP methods.
+        """
+
+        try:
+            routes = self._dest_routes.get(dest, [])
+        except TypeError:
+            routes = self._dest_id_routes.get(id(dest), [])
+
+        return [route.pattern for route in routes]
+
+    def export(self, stream):
+        """
+        Write out all the routes in the tree as JSON lines, one JSON
+        object per route.  Each object has the keys "pattern",
+        "dest", "methods", "predicate", and "restrictions"; the
+        destination and any function restrictions are described by
+        their module and qualified name, if they have them, or by
+        their ``repr()``.
+
+        :param stream: A text stream to write the routes to.
+
+        :returns: The number of routes written.
+        """
+
+        count = 0
+        for route in self._routes:
+            pred = route.predicate
+            stream.write(json.dumps({
+                'pattern': route.pattern,
+                'dest': _describe(route.dest),
+                'methods': route.methods and list(route.methods),
+                'predicate': pred and {
+                    'kind': pred.kind,
+                    'name': pred.name,
+                    'value': pred.value,
+                },
+                'restrictions': {
+                    name: _describe(restrict)
+                    for name, restrict in route.restrictions.items()},
+            }, sort_keys=True) + '\n')
+            count += 1
+
+        return count
+
+    def _walk(self, root, path):
+        """
+        Walk the tree, starting at a given root node, to find the node
+        corresponding to a URL path.
+
+        :param root: The node to start the walk at.
+        :param path: The URL path to walk.  This may also be a list of
+                     the path elements, as returned by
+                     ``_path_normalize()``.
+
+        :returns: A tuple of the node that was reached, a dictionary
+                  of parameters, and the index in ``path`` of the
+                  first unconsumed path element.  If the entire path
+                  was consumed, the last element will be ``None``.
+        """
+
+        params = {}
+        node = root
+        stats = self._stats
+
+        # Handle pre-split paths; otherwise, split on every slash and
+        # skip the empty elements, leaving the start of the element
+        # to be worked out only if it's needed
+        if isinstance(path, list):
+            elems = path
+            binary = bool(path) and isinstance(path[0], _binary_types)
+        else:
+            binary = isinstance(path, _binary_types)
+            sep = b'/' if binary else '/'
+            elems = path.split(sep)
+
+        # Select the byte string variants if necessary
+        if binary:
+            resolve_child = URLNode._resolve_child_bytes
+            match_tail = URLTailNode._match_bytes
+        else:
+            resolve_child = URLNode._resolve_child
+            match_tail = URLTailNode._match
+
+        # Iterate over the URL finding the next nodes
+        for idx, elem in enumerate(elems):
+            if not elem:
+                continue
+
+            next = resolve_child(node, elem, params)
+            if next is None:
+                if elems is path:
+                    start = idx
+                else:
+                    start = len(sep.join(elems[:idx])) + 1 if idx else 0
+
+                # Try the catch-all; note that this consumes the rest
+                # of the path as a single slice, unless the path was
+                # pre-split
+                tail = node._tail
+                if tail is not None:
+                    rest = path[start:]
+                    if isinstance(rest, list):
+                        rest = (b'/' if binary else '/').join(rest)
+                    if match_tail(tail, rest, params):
+                        if stats:
+                            tail._hits += 1
+                        return tail, params, None
+
+                return node, params, start
+            if stats:
+                next._hits += 1
+            node = next
+
+        return node, params, None
+
+    def optimize(self, reset=True):
+        """
+        Reorder the restricted variables at each level of the tree so
+        that the most frequently matched are tried first, based on
+        the statistics collected since the tree was created or
+        ``optimize()`` was last called.  Variables are only reordered
+        where the result of resolving any URL is unaffected.  Note
+        that statistics are only collected if the tree was created
+        with ``stats=True``.
+
+        :param reset: If ``True``, the statistics are reset once the
+                      tree has been reordered.
+
+        :returns: The number of levels which were reordered.
+        """
+
+        count = 0
+        for root in [self] + list(self._vhosts.values()):
+            for node in root._descendants():
+                if node._optimize():
+                    count += 1
+                if reset:
+                    node._hits = 0
+
+        return count
+
+    def resolve(self, method, url, headers=None):
         """
         Given an HTTP method and a URL, resolve the routes to
         determine the appropriate destination and the parameters.
@@ -369,8 +2084,17 @@ class URLTree(URLNode):
         remaining, unconsumed path elements, those elements will be
         placed into the special parameter ``path_info``.
 
+        Routes restricted to a particular scheme or host will only be
+        considered if ``url`` is an absolute URL, e.g.,
+        "https://api.example.com/v1/users".
+
         :param method: The HTTP method of the request.
-        :param url: The URL of the request.
+        :param url: The URL of the request.  May include a query
+                    string.  May be a byte string, ``bytearray``, or
+                    ``memoryview``, which will be interpreted as UTF-8.
+        :param headers: An optional mapping of the request headers;
+                        only needed if ``Header`` predicates are in
+                        use.
 
         :returns: A tuple of the destination and a dictionary of
                   parameters.  If the destination could not be
@@ -378,25 +2102,158 @@ class URLTree(URLNode):
                   ``(None, None)``.
         """
 
-        params = {}
-        node = self
-        path_iter = _path_split(url)
-
-        # Iterate over the URL finding the next nodes
-        for elem in path_iter:
-            next = node._resolve_child(elem, params)
-            if next is None:
-                break
-            node = next
+        if (isinstance(url, str) and not self._vhosts and
+                not self.reject_cache and not self._normalize and
+                '://' not in url):
+            # Fast path: a plain path, with nothing to choose between
+            # walks or to remember about it
+            path, _sep, query = url.partition('?')
+            node, params, rest = self._walk(self, path)
+            dest = node._select(method.upper(), query, headers,
+                                _mapping_header)
+            if not dest:
+                if not node._has_dest():
+                    self._rejects['unresolved'] += 1
+                return None, None
         else:
-            path_iter = None
+            scheme, host, path, query = self._split_request(url)
+            node, dest, params, rest = self._resolve(
+                method.upper(), scheme, host, path, query, headers,
+                _mapping_header)
+            if not dest:
+                return None, None
 
         # Build the path info
-        if path_iter is not None:
-            params['path_info'] = '/'.join([elem] + list(path_iter))
+        if rest is not None:
+            binary = isinstance(url, _binary_types)
+            rest = path[rest:]
+            if isinstance(rest, list):
+                rest = (b'/' if binary else '/').join(rest)
+            else:
+                rest = (b'/' if binary else '/').join(_path_split(rest))
+            if binary:
+                rest = rest.decode('utf-8', 'replace')
+            params['path_info'] = rest
+
+        return dest, params
 
-        dest = node._dest[method.upper()]
+
+class WSGIDispatcher:
+    """
+    A WSGI application which dispatches requests to other WSGI
+    applications using a ``URLTree``.  The parameters are stored in
+    the WSGI environment as "wsgiorg.routing_args"; if there are
+    unconsumed path elements, the consumed part of the path is moved
+    from "PATH_INFO" to "SCRIPT_NAME", rather than setting the
+    ``path_info`` parameter.  Requests which do not resolve are
+    answered with "404 Not Found", or with "405 Method Not Allowed" if
+    the path resolved but the method did not.
+    """
+
+    def __init__(self, tree):
+        """
+        Initialize a ``WSGIDispatcher``.
+
+        :param tree: The ``URLTree`` to use for dispatching.  The
+                     destinations must be WSGI applications.
+        """
+
+        self.tree = tree
+
+    def __call__(self, environ, start_response):
+        """
+        Dispatch a request.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI ``start_response()``
+                               callable.
+
+        :returns: The response body iterable.
+        """
+
+        tree = self.tree
+        path = environ.get('PATH_INFO') or '/'
+
+        # Methods are nearly always in canonical form already
+        method = environ['REQUEST_METHOD']
+        if not method.isupper():
+            method = method.upper()
+
+        # Only dig out the host if it could matter
+        if tree._vhosts:
+            scheme = environ.get('wsgi.url_scheme')
+            host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME')
+        else:
+            scheme = host = None
+
+        # Under PEP 3333, PATH_INFO holds the raw bytes of the path
+        # decoded as ISO-8859-1; recover them, so the UTF-8 path is
+        # walked as a byte string
+        try:
+            raw = path.encode('latin-1')
+        except UnicodeEncodeError:
+            # Not a conforming server; walk the text as it stands
+            raw = path
+
+        node, dest, params, rest = tree._resolve(
+            method, scheme, host, raw, environ.get('QUERY_STRING'),
+            environ, _environ_header)
         if not dest:
-            return None, None
+            allowed = node._allowed()
+            if allowed:
+                return self.method_not_allowed(environ, start_response,
+                                               allowed)
+            return self.not_found(environ, start_response)
 
-        return dest, params
+        # Shift the consumed part of the path over to SCRIPT_NAME; the
+        # encoding preserves the length, so the byte index applies to
+        # the original text as well
+        if rest is not None:
+            script = path[:rest].rstrip('/')
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + script
+            environ['PATH_INFO'] = path[len(script):]
+
+        environ['wsgiorg.routing_args'] = ((), params)
+
+        return dest(environ, start_response)
+
+    def not_found(self, environ, start_response):
+        """
+        Respond to a request which could not be resolved.  May be
+        overridden by subclasses.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI ``start_response()``
+                               callable.
+
+        :returns: The response body iterable.
+        """
+
+        body = b'404 Not Found'
+        start_response('404 Not Found', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
+
+    def method_not_allowed(self, environ, start_response, allowed):
+        """
+        Respond to a request whose path was resolved, but whose method
+        was not.  May be overridden by subclasses.
+
+        :param environ: The WSGI environment.
+        :param start_response: The WSGI ``start_response()``
+                               callable.
+        :param allowed: A list of the HTTP methods which are allowed
+                        for the path.
+
+        :returns: The response body iterable.
+        """
+
+        body = b'405 Method Not Allowed'
+        start_response('405 Method Not Allowed', [
+            ('Allow', ', '.join(allowed)),
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
@@ -0,0 +1,342 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Provides ``ASGIDispatcher``, an ASGI application which dispatches
+requests to other ASGI applications using a ``URLTree``.
+
+Both "http" and "websocket" scopes are dispatched.  HTTP requests are
+routed on their HTTP method as usual; websocket connections are
+routed as if their method were "WEBSOCKET", so a websocket endpoint
+is declared like so::
+
+    mapper.route("/events", events_socket, "websocket")
+
+Routes without methods do not match websocket connections; they must
+list "websocket" explicitly.
+
+Where possible, the undecoded "raw_path" is resolved directly, as a
+byte string; it is only necessary to fall back to the decoded "path"
+when "raw_path" is absent or contains percent-encoded characters.  If
+the tree was created with ``normalize=True``, the "raw_path" is
+normalized and percent-decoded as it is split up, just as
+``URLTree.resolve()`` would; a server which does not provide
+"raw_path" has already decoded the path, so the "path" is resolved as
+it stands.
+
+The parameters are stored in the scope under "path_params".  If there
+are unconsumed path elements, the consumed part of the path is moved
+from "path" to "root_path", rather than setting the ``path_info``
+parameter.
+
+Since clients tend to request the same paths over and over, the
+results of walking the tree for each path are cached, up to a
+configurable number of paths; the cache is discarded whenever a route
+is added to the tree.  Only the walk down the tree is cached; the HTTP
+method and any predicates are evaluated anew for each request.  Since
+the parameter values would be shared between requests, paths reaching
+routes with restriction functions are not cached, unless the functions
+are ``int``, ``float``, or wrapped in ``urltree.Memoize``.  Nothing is
+cached if the tree collects statistics (``stats=True``), so that every
+request is counted.  If the tree was created with a ``reject_cache``,
+it is consulted before walking a path missing from this cache, and
+unresolvable paths are remembered there rather than here.
+"""
+
+import collections
+
+import urltree
+
+
+__all__ = ['ASGIDispatcher']
+
+
+# Restriction functions whose values may safely be shared between
+# requests
+_immutable_results = (int, float)
+
+
+def _asgi_header(headers, name):
+    """
+    Look up a header in an ASGI header list.
+
+    :param headers: The list of header name and value pairs, as byte
+                    strings, from the ASGI scope.
+    :param name: The name of the header, in lower case.
+
+    :returns: The value of the header, or ``None`` if it is not
+              present.
+    """
+
+    key = name.encode('latin-1')
+    for hdr, value in headers:
+        if hdr == key:
+            return value.decode('latin-1')
+
+    return None
+
+
+class ASGIDispatcher:
+    """
+    An ASGI application which dispatches requests to other ASGI
+    applications using a ``URLTree``.  Requests which do not resolve
+    are answered with "404 Not Found", or with "405 Method Not
+    Allowed" if the path resolved but the method did not; websocket
+    connections which do not resolve are closed.
+    """
+
+    def __init__(self, tree, cache_size=1024):
+        """
+        Initialize an ``ASGIDispatcher``.
+
+        :param tree: The ``URLTree`` to use for dispatching.  The
+                     destinations must be ASGI applications.
+        :param cache_size: The maximum number of paths for which
+                           resolution results are cached.  Use 0 to
+                           disable caching.
+        """
+
+        self.tree = tree
+        self.cache_size = cache_size
+
+        self._cache = collections.OrderedDict()
+        self._version = tree._version
+
+    def _cacheable(self, walks):
+        """
+        Determine whether the walks for a path may be cached.  They
+        may not if any route ending at a node they reached has a
+        restriction function which could return a mutable value.
+
+        :param walks: The list of results of ``URLTree._walks()``.
+
+        :returns: ``True`` if the walks may be cached, ``False``
+                  otherwise.
+        """
+
+        node_routes = self.tree._node_routes
+        for node, _params, _rest in walks:
+            for route in node_routes.get(id(node), ()):
+                for restrict in route.restrictions.values():
+                    if not (isinstance(restrict, (str, urltree.Memoize)) or
+                            restrict in _immutable_results):
+                        return False
+
+        return True
+
+    def _resolve(self, scope, method, path):
+        """
+        Resolve the request described by an ASGI scope, consulting the
+        cache first.
+
+        :param scope: The ASGI scope.
+        :param method: The HTTP method, or "WEBSOCKET".
+        :param path: The path to resolve; this is either the "path" or
+                     the "raw_path" from the scope.
+
+        :returns: A tuple of the node that was reached, the
+                  destination, a dictionary of parameters, and the
+                  index in the path of the first unconsumed path
+                  element, as for ``URLTree._resolve()``.  The
+                  dictionary of parameters is always a fresh copy.
+        """
+
+        tree = self.tree
+
+        # Only dig out the host if it could matter
+        if tree._vhosts:
+            scheme = scope.get('scheme')
+            host = _asgi_header(scope.get('headers', ()), 'host')
+            if host is None and scope.get('server'):
+                host = scope['server'][0]
+            key = (scheme, host, path)
+        else:
+            scheme = host = None
+            key = path
+
+        # A normalized path is a list of elements
+        if isinstance(path, list):
+            key = (key[:2] + (tuple(path),)) if tree._vhosts else tuple(path)
+
+        query = scope.get('query_string')
+        headers = scope.get('headers', ())
+
+        if not self.cache_size or tree._stats:
+            return tree._resolve(method, scheme, host, path, query, headers,
+                                 _asgi_header)
+
+        # Discard the cache if the routes have changed
+        cache = self._cache
+        if self._version != tree._version:
+            cache.clear()
+            self._version = tree._version
+
+        try:
+            walks = cache[key]
+            cache.move_to_end(key)
+            store = False
+        except KeyError:
+            # Paths the tree already knows to be unresolvable need not
+            # be walked at all
+            if tree.reject_cache and tree._is_rejected(scheme, host, path):
+                return tree._nowhere, None, {}, None
+
+            walks = list(tree._walks(scheme, host, path))
+            store = self._cacheable(walks)
+
+        node, dest, params, rest = tree._resolve(
+            method, scheme, host, path, query, headers, _asgi_header, walks)
+
+        # Leave unresolvable paths to the tree's own cache of them, so
+        # they don't push resolvable paths out of this one
+        if store and (dest or node._has_dest() or not tree.reject_cache):
+            cache[key] = walks
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+        return node, dest, dict(params), rest
+
+    async def __call__(self, scope, receive, send):
+        """
+        Dispatch a request.
+
+        :param scope: The ASGI scope.
+        :param receive: The ASGI ``receive()`` awaitable callable.
+        :param send: The ASGI ``send()`` awaitable callable.
+        """
+
+        kind = scope['type']
+        if kind == 'http':
+            method = scope['method']
+            if not method.isupper():
+                method = method.upper()
+        elif kind == 'websocket':
+            method = 'WEBSOCKET'
+        elif kind == 'lifespan':
+            return await self.lifespan(scope, receive, send)
+        else:
+            raise ValueError('unsupported ASGI scope type %r' % kind)
+
+        # Use the raw path if it doesn't need decoding, or if it's to
+        # be normalized
+        path = scope.get('raw_path')
+        if path and self.tree._normalize:
+            path = urltree._path_normalize(path.partition(b'?')[0])
+        elif not path or b'%' in path or b'?' in path:
+            path = scope['path']
+
+        node, dest, params, rest = self._resolve(scope, method, path)
+        if not dest:
+            allowed = node._allowed()
+            if allowed and kind == 'http':
+                return await self.method_not_allowed(scope, receive, send,
+                                                     allowed)
+            return await self.not_found(scope, receive, send)
+
+        # Shift the consumed part of the path over to root_path
+        if rest is not None:
+            if isinstance(path, list):
+                # The normalized path no longer corresponds to the
+                # path in the scope, so rebuild both parts from it
+                root = b''.join(b'/' + elem for elem in path[:rest])
+                root = root.decode('utf-8', 'replace')
+                remainder = b''.join(b'/' + elem for elem in path[rest:])
+                remainder = remainder.decode('utf-8', 'replace')
+            else:
+                if isinstance(path, bytes):
+                    root = path[:rest].rstrip(b'/').decode('utf-8')
+                else:
+                    root = path[:rest].rstrip('/')
+                remainder = scope['path'][len(root):]
+            scope['root_path'] = scope.get('root_path', '') + root
+            scope['path'] = remainder
+
+        scope['path_params'] = params
+
+        return await dest(scope, receive, send)
+
+    async def _respond(self, send, status, body, headers=()):
+        """
+        Send a complete, plain text HTTP response.
+
+        :param send: The ASGI ``send()`` awaitable callable.
+        :param status: The integer HTTP status code.
+        :param body: The response body, as a byte string.
+        :param headers: Any additional headers, as pairs of byte
+                        strings.
+        """
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/plain'),
+                (b'content-length', str(len(body)).encode('ascii')),
+            ] + list(headers),
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+        })
+
+    async def not_found(self, scope, receive, send):
+        """
+        Respond to a request which could not be resolved.  May be
+        overridden by subclasses.
+
+        :param scope: The ASGI scope.
+        :param receive: The ASGI ``receive()`` awaitable callable.
+        :param send: The ASGI ``send()`` awaitable callable.
+        """
+
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1000})
+        else:
+            await self._respond(send, 404, b'404 Not Found')
+
+    async def method_not_allowed(self, scope, receive, send, allowed):
+        """
+        Respond to a request whose path was resolved, but whose method
+        was not.  May be overridden by subclasses.
+
+        :param scope: The ASGI scope.
+        :param receive: The ASGI ``receive()`` awaitable callable.
+        :param send: The ASGI ``send()`` awaitable callable.
+        :param allowed: A list of the HTTP methods which are allowed
+                        for the path.
+        """
+
+        await self._respond(send, 405, b'405 Method Not Allowed', [
+            (b'allow', ', '.join(allowed).encode('latin-1')),
+        ])
+
+    async def lifespan(self, scope, receive, send):
+        """
+        Handle the ASGI lifespan protocol.  The default implementation
+        simply acknowledges the startup and shutdown events.  May be
+        overridden by subclasses.
+
+        :param scope: The ASGI scope.
+        :param receive: The ASGI ``receive()`` awaitable callable.
+        :param send: The ASGI ``send()`` awaitable callable.
+        """
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,467 @@
+# Copyright 2013 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the route coverage of an access log.  Each request in the log
+is resolved through a ``URLTree``, and the number of hits and the time
+spent resolving are accumulated for each route; requests which do not
+resolve are summarized by the shape of their path, with numbers and
+hexadecimal identifiers replaced by placeholders.  The report lists
+the routes by number of hits, followed by the routes which were never
+hit, and the most common shapes of unresolvable paths.  The time
+reported is that spent walking the tree and selecting a destination,
+by the same code ``URLTree.resolve()`` and the dispatchers use; parsing
+the log and splitting up the URL are not included.
+
+The log is read in large chunks, and its lines are handled as byte
+strings, which ``URLTree.resolve()`` resolves without decoding.  The
+request line is found by looking for the first double-quoted string
+of the form "METHOD URL ...", as in the Common and Combined Log
+Formats; lines without one are skipped.  Memory use does not depend
+on the size of the log: the statistics are kept per route, and only a
+bounded number of unresolvable path shapes are tracked, so the counts
+reported for those are approximate (they may be too low, never too
+high).
+
+Each request is attributed to the route which matched it.  Routes
+which can't be told apart--those with the same URL pattern,
+destination, and methods, differing only in their predicates--are
+reported together.  Header predicates never match, since access logs
+don't record the request headers.
+
+This module is installed as the ``urltree-cover`` command::
+
+    urltree-cover myapp.routes:mapper access.log
+
+The route object may be a ``URLTree``, a dispatcher wrapping one, or a
+callable returning either.
+"""
+
+import argparse
+import gzip
+import importlib
+import os
+import re
+import sys
+import time
+
+import urltree
+
+
+__all__ = ['Coverage', 'load_tree', 'read_lines', 'main']
+
+
+# Finds the method and URL in the request line of a log entry
+_request_re = re.compile(rb'"([A-Za-z]+) ([^ "]+)[^"]*"')
+
+# Recognizes path elements to be replaced by placeholders
+_int_re = re.compile(rb'^[0-9]+$')
+_hex_re = re.compile(rb'^[-0-9a-fA-F]{8,}$')
+
+
+def _shape(url, depth=6):
+    """
+    Compute the shape of a URL, for grouping unresolvable URLs.  The
+    query string is dropped, and path elements which are numbers or
+    hexadecimal identifiers are replaced by placeholders.
+
+    :param url: The URL, as a byte string.
+    :param depth: The maximum number of path elements to keep.
+
+    :returns: The shape of the URL, as a string.
+    """
+
+    elems = url.partition(b'?')[0].split(b'/')
+    shaped = []
+    for elem in elems[:depth + 1]:
+        if _int_re.match(elem):
+            elem = b'{int}'
+        elif _hex_re.match(elem):
+            elem = b'{hex}'
+        shaped.append(elem)
+    if len(elems) > depth + 1:
+        shaped.append(b'...')
+
+    return b'/'.join(shaped).decode('utf-8', 'replace')
+
+
+def _describe_route(route):
+    """
+    Describe a route for the report.
+
+    :param route: The ``urltree.Route``.
+
+    :returns: A string describing the route.
+    """
+
+    text = '%s %s' % (','.join(route.methods or ['*']), route.pattern)
+    if route.predicate is not None:
+        text += ' %r' % (route.predicate,)
+    return text
+
+
+class _TopCounter:
+    """
+    Count occurrences of keys, keeping only a bounded number of them.
+    When the number of keys reaches twice the bound, only the most
+    common keys are kept; counts are therefore lower bounds.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize a ``_TopCounter``.
+
+        :param size: The number of keys to keep.
+        """
+
+        self.size = size
+        self.counts = {}
+        self.dropped = 0
+
+    def add(self, key):
+        """
+        Count an occurrence of a key.
+
+        :param key: The key.
+        """
+
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + 1
+        if len(counts) >= 2 * self.size:
+            keep = self.most_common(self.size)
+            self.dropped += sum(counts.values()) - sum(
+                count for _key, count in keep)
+            self.counts = dict(keep)
+
+    def most_common(self, count):
+        """
+        List the most common keys.
+
+        :param count: The maximum number of keys to list.
+
+        :returns: A list of tuples of the key and its count, most
+                  common first.
+        """
+
+        return sorted(self.counts.items(),
+                      key=lambda item: (-item[1], item[0]))[:count]
+
+
+class Coverage:
+    """
+    Accumulate route coverage statistics for a ``URLTree``.
+    """
+
+    def __init__(self, tree, shapes=1000, timer=time.perf_counter):
+        """
+        Initialize a ``Coverage``.
+
+        :param tree: The ``URLTree`` to resolve requests with.
+        :param shapes: The number of shapes of unresolvable paths to
+                       keep track of.
+        :param timer: A function returning the current time in
+                       seconds, used to time resolution.
+        """
+
+        self.tree = tree
+        self.timer = timer
+
+        # The routes, and the position of each in the list; the
+        # routes are identified by their position in the statistics
+        self._routes = list(tree.routes())
+        self._index = {id(route): idx for idx, route in
+                       enumerate(self._routes)}
+        self._methods = set()
+        for route in self._routes:
+            self._methods.update(route.methods or ())
+
+        # Maps (node ID, destination ID, method) to the tuple of the
+        # indexes of the routes the request is attributed to, and
+        # those tuples to a list of the hit count and the total
+        # resolution time
+        self._groups = {}
+        self._stats = {}
+
+        self.lines = 0
+        self.skipped = 0
+        self.resolved = 0
+        self.not_allowed = 0
+        self.unresolved = 0
+        self.elapsed = 0.0
+        self.unmatched = _TopCounter(shapes)
+
+    def _group(self, node, dest, method):
+        """
+        Determine the routes a resolved request is attributed to.
+
+        :param node: The node the request resolved to.
+        :param dest: The destination the request resolved to.
+        :param method: The method of the request.
+
+        :returns: A tuple of the indexes of the candidate routes.
+        """
+
+        # Methods no route mentions all end up at the default routes,
+        # so they can share a key
+        key = (id(node), id(dest),
+               method if method in self._methods else None)
+
+        group = self._groups.get(key)
+        if group is None:
+            candidates = [route for route in
+                          self.tree._node_routes.get(id(node), [])
+                          if route.dest is dest]
+            group = [route for route in candidates
+                     if route.methods and method in route.methods]
+            if not group:
+                group = [route for route in candidates if not route.methods]
+            group = tuple(self._index[id(route)] for route in group)
+
+            self._groups[key] = group
+            self._stats.setdefault(group, [0, 0.0])
+
+        return group
+
+    def add(self, line):
+        """
+        Process a line of the log.
+
+        :param line: The log line, as a byte string.
+        """
+
+        self.lines += 1
+        match = _request_re.search(line)
+        if match is None:
+            self.skipped += 1
+            return
+
+        method = match.group(1).decode('ascii').upper()
+        url = match.group(2)
+
+        tree = self.tree
+        scheme, host, path, query = tree._split_request(url)
+
+        start = self.timer()
+        node, dest, _params, _rest = tree._resolve(
+            method, scheme, host, path, query, None, urltree._mapping_header)
+        elapsed = self.timer() - start
+        self.elapsed += elapsed
+
+        if dest:
+            self.resolved += 1
+            stats = self._stats[self._group(node, dest, method)]
+            stats[0] += 1
+            stats[1] += elapsed
+        elif node._has_dest():
+            self.not_allowed += 1
+        else:
+            self.unresolved += 1
+            self.unmatched.add(_shape(url))
+
+    def progress(self, stream):
+        """
+        Write a one-line summary of the progress so far.
+
+        :param stream: The text stream to write to.
+        """
+
+        requests = self.lines - self.skipped
+        stream.write('%d lines, %d requests: %d resolved, %d unresolved, '
+                     '%d method not allowed; %.1f us/request\n' % (
+                         self.lines, requests, self.resolved,
+                         self.unresolved, self.not_allowed,
+                         1e6 * self.elapsed / requests if requests else 0.0))
+        stream.flush()
+
+    def dead_routes(self):
+        """
+        List the routes which have not been hit.
+
+        :returns: A list of ``urltree.Route`` objects, in the order in
+                  which they were added to the tree.
+        """
+
+        hit = set()
+        for group, (hits, _elapsed) in self._stats.items():
+            if hits:
+                hit.update(group)
+
+        return [route for idx, route in enumerate(self._routes)
+                if idx not in hit]
+
+    def report(self, stream, top=20):
+        """
+        Write a report of the route coverage.
+
+        :param stream: The text stream to write to.
+        :param top: The number of unresolvable path shapes to list.
+        """
+
+        self.progress(stream)
+
+        stream.write('\nRoutes by hits:\n')
+        stream.write('%10s %10s %10s  %s\n' % (
+            'hits', 'total ms', 'mean us', 'route'))
+        for group, (hits, elapsed) in sorted(
+                self._stats.items(), key=lambda item: -item[1][0]):
+            if hits:
+                stream.write('%10d %10.1f %10.2f  %s\n' % (
+                    hits, 1e3 * elapsed, 1e6 * elapsed / hits,
+                    ' | '.join(_describe_route(self._routes[idx])
+                               for idx in group)))
+
+        dead = self.dead_routes()
+        stream.write('\nRoutes never hit (%d):\n' % len(dead))
+        for route in dead:
+            stream.write('    %s\n' % _describe_route(route))
+
+        shapes = self.unmatched.most_common(top)
+        stream.write('\nUnresolvable paths by shape:\n')
+        for shape, count in shapes:
+            stream.write('%10d  %s\n' % (count, shape))
+        if self.unmatched.dropped:
+            stream.write('%10d  (other shapes)\n' % self.unmatched.dropped)
+
+
+def read_lines(stream, chunk_size=1 << 20):
+    """
+    Read the lines of a binary stream in large chunks.
+
+    :param stream: The binary stream.
+    :param chunk_size: The number of bytes to read at a time.
+
+    :returns: An iterator of the lines, as byte strings without line
+              endings.
+    """
+
+    rest = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+
+    if rest:
+        yield rest
+
+
+def load_tree(spec):
+    """
+    Load a ``URLTree`` from a "module:attribute" specification.
+
+    :param spec: The specification.  The attribute may be dotted, and
+                 may name a ``URLTree``, an object with a ``tree``
+                 attribute (such as a dispatcher), or a callable
+                 returning either.
+
+    :returns: The ``URLTree``.
+    """
+
+    modname, sep, attr = spec.partition(':')
+    if not sep or not attr:
+        raise ValueError("route specification %r must be of the form "
+                         "'module:attribute'" % spec)
+
+    obj = importlib.import_module(modname)
+    for name in attr.split('.'):
+        obj = getattr(obj, name)
+
+    if not isinstance(obj, urltree.URLTree) and not hasattr(obj, 'tree'):
+        obj = obj()
+    if not isinstance(obj, urltree.URLTree):
+        obj = getattr(obj, 'tree', None)
+    if not isinstance(obj, urltree.URLTree):
+        raise TypeError("%r does not refer to a URLTree" % spec)
+
+    return obj
+
+
+def _open(filename):
+    """
+    Open a log file for reading in binary mode.
+
+    :param filename: The name of the file; "-" is the standard input,
+                     and names ending in ".gz" are decompressed.
+
+    :returns: A binary stream.
+    """
+
+    if filename == '-':
+        return sys.stdin.buffer
+    elif filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def main(argv=None):
+    """
+    The entry point of the ``urltree-cover`` command.
+
+    :param argv: The command line arguments, not including the
+                 program name.  Defaults to ``sys.argv[1:]``.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='urltree-cover',
+        description="Report the routes hit by the requests in an access "
+        "log, and how long resolving them took.")
+    parser.add_argument('routes', help="The routes to resolve requests "
+                        "with, as 'module:attribute'.")
+    parser.add_argument('logs', nargs='*', default=['-'],
+                        help="The access logs to read; '-' is the standard "
+                        "input, which is the default.")
+    parser.add_argument('--every', type=int, default=1000000,
+                        help="Report progress every this many lines.  "
+                        "Default: %(default)s.")
+    parser.add_argument('--top', type=int, default=20,
+                        help="The number of unresolvable path shapes to "
+                        "list.  Default: %(default)s.")
+    parser.add_argument('--shapes', type=int, default=1000,
+                        help="The number of unresolvable path shapes to "
+                        "keep track of.  Default: %(default)s.")
+    parser.add_argument('--chunk-size', type=int, default=1 << 20,
+                        help="The number of bytes to read at a time.  "
+                        "Default: %(default)s.")
+    args = parser.parse_args(argv)
+
+    # Allow the routes to be imported from the current directory
+    if '' not in sys.path and os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+
+    try:
+        tree = load_tree(args.routes)
+    except (ImportError, AttributeError, TypeError, ValueError) as exc:
+        parser.error(str(exc))
+
+    cover = Coverage(tree, args.shapes)
+    for filename in args.logs:
+        stream = _open(filename)
+        try:
+            for line in read_lines(stream, args.chunk_size):
+                cover.add(line)
+                if args.every and not cover.lines % args.every:
+                    cover.progress(sys.stderr)
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+    cover.report(sys.stdout, args.top)
+
+
+if __name__ == '__main__':
+    main()